@@ -24,6 +24,14 @@ namespace megat {
                                     std::string tag = "", std::string tpc_name = "TPC",
                                     dd4hep::PrintLevel level = dd4hep::ERROR );
 
+    // register a geometry under a tag, it is built by requireGeometry on first use
+    void registerGeometry( std::vector<std::string> xmlList, std::string tpc_readout_name = "",
+                           std::string tag = "", std::string tpc_name = "TPC",
+                           dd4hep::PrintLevel level = dd4hep::ERROR );
+
+    // return the geometry of a tag, build it first if it is only registered
+    dd4hep::Detector& requireGeometry( std::string tag = "default" );
+
     // return cell positions as RVec<RVecD>
     template <typename HitData>
     class CellPosition {
@@ -30,4 +30,6 @@ utility = import_item('utility')
 
 # import utility
 import_ns_item('utility', 'loadGeometry')
+import_ns_item('utility', 'registerGeometry')
+import_ns_item('utility', 'requireGeometry')
 import_ns_item('utility', 'IdConverter')
@@ -0,0 +1,189 @@
+import os, sys
+import json, time
+import glob, shutil, tempfile
+import subprocess, statistics
+
+from .utility import expand_absolute_directory
+from .index import scan_files
+from .manifest import manifest_path, MANIFEST_SUFFIX
+from .logger import rootLogger
+
+# default results file, in the working directory
+BENCH_FILE = 'mgana_bench.json'
+
+# api function
+def setup_bench_parser(parser):
+    '''
+    Setup bench command arguments
+    '''
+    publicOptions = parser.add_argument_group('User options')
+    publicOptions.add_argument("pathToAnalysisScript", help="path to the stage analysis script to benchmark")
+    publicOptions.add_argument("--files", help="Fixed input files of the benchmark", nargs='+', required=True)
+    publicOptions.add_argument("--threads", help="Thread counts to sweep, default 1, 2, 4, ... up to the number of cores", type=int, nargs='+')
+    publicOptions.add_argument("--repeat", help="Number of measured runs per thread count", type=int, default=3)
+    publicOptions.add_argument("--warmup", help="Unmeasured runs before the sweep (fills the page and expression caches)", type=int, default=1)
+    publicOptions.add_argument("--nevents", help="Max number of events of each run", type=int, default=-1)
+    publicOptions.add_argument("--extra", help="Extra options passed to mgana run, e.g. --extra=--storage=fast-read", default=[], nargs='*')
+    publicOptions.add_argument("--results", help=f"JSON file keeping the results of every revision, default {BENCH_FILE}", type=str, default=BENCH_FILE)
+    publicOptions.add_argument("--tag", help="Name of this measurement, default the git revision of the script", type=str)
+    publicOptions.add_argument("--save-baseline", action='store_true', help="Use this measurement as the baseline of later ones")
+    publicOptions.add_argument("--tolerance", help="Relative slow-down against the baseline reported as a regression", type=float, default=0.1)
+    publicOptions.add_argument("--compare-storage", help="Instead of the thread sweep, rewrite the input files with each storage profile and compare size, write and read times", nargs='+', metavar='PROFILE')
+    publicOptions.add_argument("--columns", help="Columns rewritten by --compare-storage, default all", nargs='+')
+
+#__________________________________________________________
+def git_revision(path: str) -> str:
+    '''
+    Short git revision of the repository containing path, '+dirty' with local changes.
+    '''
+    try:
+        rev = subprocess.run(['git', '-C', path, 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', '-C', path, 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True, check=True).stdout.strip()
+        return rev + ('+dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+#__________________________________________________________
+def measure(command: list, workDir: str, logFile: str, outputs=()) -> dict:
+    '''
+    Run one mgana command in a child process.
+    Return its wall time, CPU time, peak RSS and I/O counters.
+    The run failed unless it exits with 0 and writes a file with its manifest for each pattern
+    of outputs (in workDir, e.g. 'bench.*' whatever the output format).
+    '''
+    ioFile = os.path.join(workDir, 'io.json')
+    env = dict(os.environ, MGANA_IO_REPORT=ioFile)
+    # outputs of the previous run
+    for pattern in outputs:
+        for path in glob.glob(os.path.join(workDir, pattern)):
+            os.remove(path)
+    start_time = time.perf_counter()
+    with open(logFile, 'w') as log:
+        p = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=env)
+        _, status, usage = os.wait4(p.pid, 0)
+    wall = time.perf_counter() - start_time
+    missing = [pattern for pattern in outputs
+               if not any(not f.endswith(MANIFEST_SUFFIX) and os.path.isfile(manifest_path(f))
+                          for f in glob.glob(os.path.join(workDir, pattern)))]
+    if os.waitstatus_to_exitcode(status) != 0 or missing:
+        with open(logFile, 'r') as log:
+            tail = ''.join(log.readlines()[-20:])
+        reason = 'failed' if os.waitstatus_to_exitcode(status) != 0 else f'wrote no {", ".join(missing)} output'
+        raise RuntimeError(f'{" ".join(command)} {reason}:\n{tail}')
+
+    io = {}
+    if os.path.isfile(ioFile):
+        with open(ioFile, 'r') as f:
+            io = json.load(f)
+        os.remove(ioFile)
+    return {'wall': wall,
+            'cpu': usage.ru_utime + usage.ru_stime,
+            'maxrss': usage.ru_maxrss*1024,
+            'read': io.get('rchar'),
+            'written': io.get('wchar')}
+
+#__________________________________________________________
+def summarize(runs: list, entries: int) -> dict:
+    '''
+    Median of each quantity over the repeated runs of one thread count.
+    '''
+    summary = {k: statistics.median(r[k] for r in runs) for k in ('wall', 'cpu', 'maxrss')}
+    for k in ('read', 'written'):
+        values = [r[k] for r in runs if r[k] is not None]
+        summary[k] = statistics.median(values) if values else None
+    summary['evps'] = entries/summary['wall'] if summary['wall'] > 0 else 0.
+    summary['walls'] = [r['wall'] for r in runs]
+    return summary
+
+#__________________________________________________________
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    '''
+    Return the thread counts whose median wall time is slower than the baseline beyond tolerance.
+    '''
+    regressions = []
+    for threads, summary in current.items():
+        ref = baseline.get(threads)
+        if ref is None:
+            continue
+        change = summary['wall']/ref['wall'] - 1.
+        flag = 'REGRESSION' if change > tolerance else 'ok'
+        print(f'      {threads:>3} threads: {ref["wall"]:8.2f} s -> {summary["wall"]:8.2f} s ({change:+.1%}) {flag}')
+        if change > tolerance:
+            regressions.append(threads)
+    return regressions
+
+#__________________________________________________________
+def bench_analysis(mainparser):
+    args, _ = mainparser.parse_known_args()
+    analysisFile = expand_absolute_directory(args.pathToAnalysisScript)
+    if not os.path.isfile(analysisFile):
+        rootLogger.error(f'Script {analysisFile} not exist')
+        sys.exit(3)
+
+    files = [expand_absolute_directory(f) for f in args.files]
+    if args.compare_storage:
+        from .storage import compare_profiles
+        compare_profiles(files, args.compare_storage, args.columns, args.repeat)
+        return
+
+    entries = sum(info['entries'] for info in scan_files(files))
+    if args.nevents > 0:
+        entries = min(entries, args.nevents)
+
+    threads = args.threads
+    if not threads:
+        threads, t = [], 1
+        while t < (os.cpu_count() or 1):
+            threads.append(t)
+            t *= 2
+        threads.append(os.cpu_count() or 1)
+
+    tag = args.tag or git_revision(os.path.dirname(analysisFile))
+    workDir = tempfile.mkdtemp(prefix='mgana_bench_')
+    command = [sys.executable, sys.argv[0], 'run', analysisFile, '--files', *files,
+               # outputs and their cache stay in the work directory, outputDir of the script is not touched
+               '--output-dir', workDir, '--output', 'bench.root', '--force', '--nevents', str(args.nevents),
+               # the memory probe would run in every measured run
+               '--memory-probe', '0'] + args.extra
+    print(f'----> Info: Benchmark {tag}: {entries} events, threads {threads}, {args.repeat} repeats')
+
+    results = {}
+    try:
+        for i in range(args.warmup):
+            measure(command + ['--ncpus', str(threads[-1])], workDir, os.path.join(workDir, 'warmup.log'), ['bench.*'])
+        for t in threads:
+            runs = []
+            for i in range(args.repeat):
+                runs.append(measure(command + ['--ncpus', str(t)], workDir, os.path.join(workDir, f'run_{t}_{i}.log'), ['bench.*']))
+            results[str(t)] = summarize(runs, entries)
+            r = results[str(t)]
+            print(f'      {t:>3} threads: wall {r["wall"]:8.2f} s  cpu {r["cpu"]:8.2f} s  '
+                  f'rss {r["maxrss"]/2**20:8.1f} MB  {r["evps"]:10.1f} evt/s')
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    # results of every measured revision, and the baseline
+    data = {'runs': {}, 'baseline': None}
+    if os.path.isfile(args.results):
+        with open(args.results, 'r') as f:
+            data = json.load(f)
+    data['runs'][tag] = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'script': analysisFile,
+                         'files': files, 'entries': entries, 'extra': args.extra, 'results': results}
+
+    regressions = []
+    baseline = data.get('baseline')
+    if baseline and baseline != tag and baseline in data['runs']:
+        print(f'----> Info: Comparison with the baseline {baseline} (tolerance {args.tolerance:.0%})')
+        regressions = compare(results, data['runs'][baseline]['results'], args.tolerance)
+    if args.save_baseline:
+        data['baseline'] = tag
+
+    tmp = f'{args.results}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, args.results)
+    print(f'----> Info: Results saved in {args.results}')
+
+    if regressions:
+        print(f'----> Error: Regression at {", ".join(regressions)} threads')
+        sys.exit(3)
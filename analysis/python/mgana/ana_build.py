@@ -1,6 +1,6 @@
 import shlex
 
-from .utility import parse_meta, current_mgana_path, get_absolute_directory
+from .utility import package_env, current_mgana_path
 from .utility import execute, setup_megat
 
 # api function
@@ -30,7 +30,7 @@ def build_analysis(mainparser):
 
     # get running env config
     pkg_dir = current_mgana_path()
-    envs = parse_meta(get_absolute_directory('.mgana/env.json', pkg_dir))
+    envs = package_env()
 
     # create cmd list
     cmds = {
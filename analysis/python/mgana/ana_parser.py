@@ -0,0 +1,53 @@
+from .storage import STORAGE_PROFILES
+
+# api functions, the options of mgana run, final and plot are set up without loading ROOT
+def setup_run_parser(parser):
+    publicOptions = parser.add_argument_group('User options')
+    publicOptions.add_argument("pathToAnalysisScript", help="path to analysis script")
+    publicOptions.add_argument("--loglevel", help="Specify the RDataFrame ELogLevel", type=str, default="kUnset", choices = ['kUnset','kFatal','kError','kWarning','kInfo','kDebug'])
+    publicOptions.add_argument("--files", help="Specify input file to bypass the processList", default=[], nargs='+')
+    publicOptions.add_argument("--output", help="Specify output file name to bypass the processList and or outputList, default output.root", type=str, default="output.root")
+    publicOptions.add_argument("--output-dir", help="Directory of the outputs and their cache, overrides outputDir of the script", type=str)
+    publicOptions.add_argument("--nevents", help="Specify max number of events to process per output, read with implicit MT", type=int, default=-1)
+    publicOptions.add_argument('--bench', action='store_true', help='Output benchmark results to a JSON file')
+    publicOptions.add_argument('--force', action='store_true', help='Rerun all chunks even if their outputs are up-to-date')
+    publicOptions.add_argument("--storage", help="Storage profile of the outputs (compression, baskets, format), overrides storageProfile of the script", type=str, choices=list(STORAGE_PROFILES))
+    publicOptions.add_argument("--friend", action='store_true', help="Write only the new columns, read later as a friend of the inputs (same as friendOutput = True)")
+    publicOptions.add_argument("--ncpus", help="Set number of threads, the total core budget when --jobs is used", type=int)
+    publicOptions.add_argument("--jobs", help="Number of chunks run in parallel worker processes, 0 for one worker per chunk within the core budget", type=int, default=1)
+    publicOptions.add_argument("--memory-budget", help="Memory of all workers and threads, e.g. 16G, default 80%% of the available memory", type=str)
+    publicOptions.add_argument("--memory-probe", help="Events of the memory probe fitting workers and threads in the budget, 0 to disable", type=int, default=2000)
+    publicOptions.add_argument("--executor", help="Where chunks are run: local processes or a dask.distributed cluster", type=str, default="local", choices=['local', 'dask'])
+    publicOptions.add_argument("--scheduler-address", help="Address of a running dask scheduler, a local cluster is started if not given", type=str)
+    publicOptions.add_argument("--no-jit-cache", action='store_true', help="Jit the string expressions instead of using their compiled cache")
+    publicOptions.add_argument("--profile", action='store_true', help="Time each string Define/Filter, save the table and the annotated graph next to the outputs")
+    publicOptions.add_argument("--tree-cache", help="TTreeCache of each input tree and thread, e.g. 64M, 0 to disable, default two clusters on network storage, one elsewhere", type=str)
+    publicOptions.add_argument("--cache-learn", help="Entries read to learn the branches the TTreeCache fetches, ROOT default 100", type=int)
+    publicOptions.add_argument("--prefetch", help="Asynchronous prefetching of the cached baskets, auto: on network storage", type=str, default="auto", choices=['auto', 'on', 'off'])
+    publicOptions.add_argument("--stage-dir", help="Local scratch directory the upcoming input files are copied to and read from", type=str)
+    publicOptions.add_argument("--stage-size", help="Size of the scratch directory, least recently used copies are evicted", type=str, default="50G")
+    publicOptions.add_argument("--watch", action='store_true', help="Keep running, process the files arriving in the process directories into new chunks")
+    publicOptions.add_argument("--watch-interval", help="Seconds between two looks at the process directories in --watch mode", type=float, default=30.)
+    publicOptions.add_argument("--watch-settle", help="A new input is complete when closed (inotify) or not modified for this many seconds", type=float, default=60.)
+    publicOptions.add_argument("--watch-final", help="Final script whose outputs are updated with each new chunk in --watch mode", type=str)
+    publicOptions.add_argument("--watch-plot", help="Plot script redrawn after each update in --watch mode", type=str)
+    #publicOptions.add_argument("--final", action='store_true', help="Run final analysis (produces final histograms and trees)")
+    #publicOptions.add_argument("--plots", action='store_true', help="Run analysis plots")
+
+def setup_run_parser_final(parser):
+    publicOptions = parser.add_argument_group('User final options')
+    publicOptions.add_argument("pathToAnalysisScript", help="path to analysis_final script")
+    publicOptions.add_argument("--loglevel", help="Specify the RDataFrame ELogLevel", type=str, default="kUnset", choices = ['kUnset','kFatal','kError','kWarning','kInfo','kDebug'])
+    publicOptions.add_argument('--force', action='store_true', help='Rerun all processes even if their outputs are up-to-date')
+    publicOptions.add_argument("--ncpus", help="Set number of threads, the total core budget when --jobs is used", type=int)
+    publicOptions.add_argument("--jobs", help="Number of dask workers the processes are partitioned to, 0 for one per process within the core budget", type=int, default=1)
+    publicOptions.add_argument("--executor", help="Where processes are run: this process or a dask.distributed cluster", type=str, default="local", choices=['local', 'dask'])
+    publicOptions.add_argument("--scheduler-address", help="Address of a running dask scheduler, a local cluster is started if not given", type=str)
+    publicOptions.add_argument("--no-jit-cache", action='store_true', help="Jit the string expressions instead of using their compiled cache")
+    publicOptions.add_argument("--profile", action='store_true', help="Time each string Define/Filter, save the table and the annotated graph next to the outputs")
+
+def setup_run_parser_plots(parser):
+    publicOptions = parser.add_argument_group('User plots options')
+    publicOptions.add_argument("pathToAnalysisScript", help="path to analysis_plots script")
+    publicOptions.add_argument("--jobs", help="Number of worker processes rendering plots, 0 for one per core", type=int, default=1)
+    publicOptions.add_argument('--force', action='store_true', help='Redraw all plots even if their histograms and parameters did not change')
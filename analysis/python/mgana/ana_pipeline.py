@@ -0,0 +1,305 @@
+import os, sys
+import time
+import argparse
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from .utility import expand_absolute_directory, get_io_directory
+from .memory import available_cores
+from .cache import output_key, StageCache
+from .logger import rootLogger
+
+# api function
+def setup_pipeline_parser(parser):
+    '''
+    Setup pipeline command arguments
+    '''
+    publicOptions = parser.add_argument_group('User options')
+    publicOptions.add_argument("pathToPipeline", help="path to the pipeline file")
+    publicOptions.add_argument("--ncpus", help="Total core budget of the pipeline, default all available cores", type=int)
+    publicOptions.add_argument("--jobs", help="Nodes run at once in worker processes, default one per core of the budget", type=int)
+    publicOptions.add_argument('--force', action='store_true', help='Rerun all nodes even if their outputs are up-to-date')
+    publicOptions.add_argument('--dry-run', action='store_true', help='Print the stages, processes and their dependencies, then exit')
+
+#__________________________________________________________
+def loadPipeline(pipelineFile):
+    '''
+    Load the pipeline file, return its stages {name: {'script', 'command', 'after', 'processes', 'options'}}.
+    Scripts are relative to the directory of the pipeline file.
+    '''
+    spec = importlib.util.spec_from_file_location("pipeline", pipelineFile)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    stages = getattr(module, 'stages', None)
+    if not stages:
+        print(f'----> Error: Variable <stages> is mandatory in the pipeline file {pipelineFile}')
+        sys.exit(3)
+
+    baseDir = os.path.dirname(pipelineFile)
+    for name, stage in stages.items():
+        stage.setdefault('command', 'run')
+        stage.setdefault('after', [])
+        stage.setdefault('options', [])
+        if stage['command'] not in ('run', 'final', 'plot'):
+            print(f'----> Error: Unknown command {stage["command"]} of stage {name}, use run, final or plot')
+            sys.exit(3)
+        for dep in stage['after']:
+            if dep not in stages:
+                print(f'----> Error: Stage {name} runs after {dep}, which is not a stage of the pipeline')
+                sys.exit(3)
+        script = stage['script']
+        stage['script'] = script if os.path.isabs(script) else os.path.join(baseDir, script)
+        if not os.path.isfile(stage['script']):
+            print(f'----> Error: Script {stage["script"]} of stage {name} not exist')
+            sys.exit(3)
+    return stages
+
+#__________________________________________________________
+# options of the stage commands replaced by the pipeline scheduling
+_SCHEDULER_OPTIONS = ['ncpus', 'jobs', 'executor', 'scheduler_address', 'memory_budget', 'memory_probe',
+                      'watch', 'watch_final', 'watch_plot']
+
+def stageArgs(name, stage, threads, force):
+    '''
+    Arguments of a stage, as parsed by the mgana command of the stage with its options.
+    '''
+    from .ana_parser import setup_run_parser, setup_run_parser_final, setup_run_parser_plots
+    parser = argparse.ArgumentParser()
+    setup = {'run': setup_run_parser, 'final': setup_run_parser_final, 'plot': setup_run_parser_plots}[stage['command']]
+    setup(parser)
+    args = parser.parse_args([stage['script']] + list(stage['options']))
+    args.command = stage['command']
+    args.pathToAnalysisScript = os.path.abspath(stage['script'])
+    args.force = args.force or force
+    if stage['command'] != 'plot':
+        # the pipeline schedules the nodes itself, options of the stage scheduler are not honoured
+        ignored = [f'--{dest.replace("_", "-")}' for dest in _SCHEDULER_OPTIONS
+                   if getattr(args, dest, None) != parser.get_default(dest)]
+        if ignored:
+            print(f'----> Error: Option {", ".join(ignored)} of stage {name} is not supported in a pipeline, '
+                  'use --ncpus/--jobs of mgana pipeline')
+            sys.exit(3)
+        args.ncpus = threads
+        args.jobs = 1
+        args.executor = 'local'
+    return args
+
+#__________________________________________________________
+def checkGeometries(geometries):
+    '''
+    Every stage registers its geometries in the same process, a tag ('default' or a readoutName)
+    must name the same compact files in all of them. geometries is {stage: {tag: files}}.
+    '''
+    seen = {}
+    for name, tags in geometries.items():
+        for tag, files in tags.items():
+            other, otherFiles = seen.setdefault(tag, (name, files))
+            if otherFiles != files:
+                print(f'----> Error: Geometry {tag} of stage {name} ({", ".join(files)}) differs from the one '
+                      f'of stage {other} ({", ".join(otherFiles)})')
+                sys.exit(3)
+
+# runtimes of the stages, inherited by the forked workers
+_pipeline = {}
+
+def _runNode(stage, kind, payload):
+    '''
+    Entry point of a node in a worker: one chunk of a stage or one process of a final stage.
+    payload holds the picklable arguments of runLocal or runFinalProcesses, the analysis
+    module of the stage is taken from the runtimes inherited from the parent.
+    '''
+    from .ana_run import runLocal, runFinalProcesses
+    from .rdfwrap import set_expression_cache
+    rt = _pipeline[stage]
+    set_expression_cache(rt['expressionCache'])
+    start_time = time.time()
+    if kind == 'run':
+        result = runLocal(rt['module'], *payload)
+    else:
+        result = runFinalProcesses(rt['module'], *payload)
+    return result, time.time() - start_time
+
+#__________________________________________________________
+class Pipeline:
+    '''
+    DAG of the pipeline: a group is the (stage, process) of a run or final stage, or a plot stage.
+    A group becomes ready when the groups it depends on are done; it is then planned
+    (chunks of a run process, the files of a final process) and its nodes are submitted.
+    A group of a stage listed in 'after' is a dependency if it writes the output of the same name,
+    otherwise every group of that stage is.
+    '''
+    def __init__(self, stages, runtimes):
+        self.stages = stages
+        self.runtimes = runtimes
+        self.groups = {}
+        for name, stage in stages.items():
+            module = runtimes[name]['module']
+            if stage['command'] == 'plot':
+                self.groups[(name, None)] = {'output': None}
+                continue
+            from .ana_run import getElement, processOutput
+            processList = getElement(module, "processList")
+            for pr in processList:
+                if stage['command'] == 'run' and stage.get('processes') and pr not in stage['processes']:
+                    continue
+                output = processOutput(processList, pr) if stage['command'] == 'run' else pr
+                self.groups[(name, pr)] = {'output': output}
+
+        for key, group in self.groups.items():
+            group['deps'] = set()
+            for dep in self.stages[key[0]]['after']:
+                depGroups = [k for k in self.groups if k[0] == dep]
+                same = [k for k in depGroups if key[1] is not None and self.groups[k]['output'] == key[1]]
+                group['deps'].update(same or depGroups)
+
+    def describe(self):
+        for key, group in self.groups.items():
+            deps = ', '.join(f'{s}/{p}' if p else s for s, p in sorted(group['deps'], key=str)) or '-'
+            print(f'      {key[0]}/{key[1] or ""}'.ljust(40) + f' after {deps}')
+
+#__________________________________________________________
+def runPipeline(stages, runtimes, jobs, threads):
+    from .ana_run import planStage, recordOutput, getFinalFiles, recordFinal, runFinal, runPlots, getElement, stageOutputDir
+
+    dag = Pipeline(stages, runtimes)
+    caches = {}
+    done = set()
+    planned = set()
+    remaining = {}
+    nodes = {}
+    finals = []
+    plots = []
+
+    def cacheOf(outputDir):
+        if outputDir not in caches:
+            caches[outputDir] = StageCache(outputDir)
+        return caches[outputDir]
+
+    def finish(key):
+        done.add(key)
+        print(f'----> Info: {key[0]}/{key[1] or ""} done')
+
+    def plan(key, pool):
+        name, pr = key
+        rt = runtimes[name]
+        command = stages[name]['command']
+        planned.add(key)
+        if command == 'plot':
+            plots.append(name)
+            finish(key)
+        elif command == 'run':
+            outputDir = stageOutputDir(rt['module'], rt['args'])
+            _, cache, tasks, labels, digests = planStage(rt['module'], rt['args'], [pr], cacheOf(outputDir))
+            for task, label, digest in zip(tasks, labels, digests):
+                task[3].ncpus = threads
+                # the module stays in the parent, only (ranges, outputDir, args) are sent
+                fut = pool.submit(_runNode, name, 'run', task[1:])
+                nodes[fut] = (key, f'{name}/{label}', lambda result, c=cache, o=outputDir, l=label, d=digest:
+                                                         recordOutput(c, o, l, d, result))
+            remaining[key] = len(tasks)
+            if not tasks:
+                finish(key)
+        else:
+            if name not in finals:
+                finals.append(name)
+            inputDir = get_io_directory(getElement(rt['module'], "inputDir", False))
+            outputDir = get_io_directory(getElement(rt['module'], "outputDir"))
+            files = getFinalFiles(pr, inputDir)
+            digest = output_key(rt['args'].runtimeKey, files)
+            cache = cacheOf(outputDir)
+            if not rt['args'].force and cache.lookup(pr, digest):
+                print(f'----> Process {pr} of {name} is up-to-date, skip')
+                finish(key)
+                return
+            fut = pool.submit(_runNode, name, 'final', ({pr: files}, outputDir, rt['args']))
+            nodes[fut] = (key, f'{name}/{pr}', lambda result, c=cache, p=pr, d=digest: recordFinal(c, p, d, result[p]))
+            remaining[key] = 1
+
+    ctx = multiprocessing.get_context('fork')
+    print(f'----> Info: Running the pipeline on {jobs} worker processes x {threads} threads')
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx) as pool:
+        while True:
+            # plan every group whose dependencies are done
+            for key, group in dag.groups.items():
+                if key not in planned and group['deps'] <= done:
+                    plan(key, pool)
+            if not nodes:
+                break
+            finished, _ = wait(list(nodes), return_when=FIRST_COMPLETED)
+            for fut in finished:
+                key, label, callback = nodes.pop(fut)
+                try:
+                    result, elapsed = fut.result()
+                except Exception:
+                    rootLogger.error(f'Node {label} failed')
+                    for other in nodes:
+                        other.cancel()
+                    raise
+                print(f'----> {label} done in {elapsed:.1f}s')
+                callback(result)
+                remaining[key] -= 1
+                if remaining[key] == 0:
+                    finish(key)
+
+    blocked = [k for k in dag.groups if k not in done and k[0] not in plots]
+    if blocked:
+        print(f'----> Error: Dependency cycle between {", ".join(f"{s}/{p}" for s, p in blocked)}')
+        sys.exit(3)
+
+    # cutflows and tables of the final stages (their processes are all up-to-date), then plots
+    for name in finals:
+        runFinal(runtimes[name]['module'], runtimes[name]['args'])
+    for name in plots:
+        runPlots(runtimes[name]['module'], runtimes[name]['args'])
+
+#__________________________________________________________
+def pipeline_analysis(mainparser):
+    args, _ = mainparser.parse_known_args()
+    pipelineFile = expand_absolute_directory(args.pathToPipeline)
+    if not os.path.isfile(pipelineFile):
+        rootLogger.error(f'Pipeline {pipelineFile} not exist')
+        sys.exit(3)
+    stages = loadPipeline(pipelineFile)
+
+    ncores = args.ncpus if args.ncpus and args.ncpus >= 1 else available_cores()
+    jobs = args.jobs if args.jobs and args.jobs >= 1 else ncores
+    threads = max(1, ncores // jobs)
+
+    # libraries and geometry of every stage are loaded once, before the workers are forked
+    from .ana_run import loadRuntime, loadScript, buildGeometry, geometryFiles, getElement
+    from . import rdfwrap
+    runtimes = {}
+    geometries = {}
+    for name, stage in stages.items():
+        print(f'\n----> Info: Loading stage {name}')
+        stageArgv = stageArgs(name, stage, threads, args.force)
+        if stage['command'] == 'plot':
+            module = loadScript(stageArgv.pathToAnalysisScript)
+        else:
+            module = loadRuntime(stageArgv.pathToAnalysisScript, stageArgv)
+            files = geometryFiles(module)
+            if files:
+                geometries[name] = {tag: files for tag in ['default'] + list(getElement(module, "readoutName") or [])}
+        runtimes[name] = {'module': module, 'args': stageArgv, 'expressionCache': rdfwrap.expressionCache}
+    checkGeometries(geometries)
+    _pipeline.update(runtimes)
+
+    if args.dry_run:
+        print('----> Info: Pipeline nodes')
+        Pipeline(stages, runtimes).describe()
+        return
+    # registered geometries are built lazily, build them here so the workers share them
+    for name, stage in stages.items():
+        if stage['command'] != 'plot':
+            buildGeometry(runtimes[name]['module'])
+    start_time = time.time()
+    try:
+        runPipeline(stages, runtimes, jobs, threads)
+    finally:
+        _pipeline.clear()
+    # the expressions recorded by the nodes of each stage are compiled once, for the next runs
+    for name in runtimes:
+        rdfwrap.set_expression_cache(runtimes[name]['expressionCache'])
+        rdfwrap.compile_expressions()
+    print(f'----> Info: Pipeline done in {time.time()-start_time:.1f}s')
@@ -1,9 +1,14 @@
 import sys, os
 import ROOT
-import copy
 import re
+import json
+import hashlib
 
 from .utility import get_io_directory
+from .histstore import HistoStore, split_variation
+from .cache import StageCache
+from .manifest import read_manifest
+from .scheduler import split_core_budget, run_tasks
 
 #__________________________________________________________
 def removekey(d, key):
@@ -15,66 +20,128 @@ def sortedDictValues(dic):
     keys = sorted(dic)
     return [dic[key] for key in keys]
 
+#__________________________________________________________
+def buildStore(param) -> HistoStore:
+    '''
+    Read every {inputDir}/{process}_{sel}_histo.root needed by the plots once,
+    then merge the signal and background groups of each label, with their systematic variations.
+    Merged groups are stored under the process name '{label}/{group}'.
+    With param.histoCache set, the store is kept in that file and reused
+    as long as none of the input files changed.
+    '''
+    inputDir = get_io_directory(param.inputDir, False)
+    cacheFile = getattr(param, 'histoCache', '')
+    if cacheFile and os.path.isfile(cacheFile):
+        store = HistoStore.load(cacheFile)
+        if store.is_current():
+            print (f'----> Info: histograms read from {cacheFile}')
+            return store
+        print (f'----> Info: {cacheFile} is out of date, rebuild it')
+
+    store = HistoStore()
+    done = set()
+    for label, sels in param.selections.items():
+        groups = dict(param.plots[label]['signal'])
+        groups.update(param.plots[label]['backgrounds'])
+        for sel in sels:
+            for group, processes in groups.items():
+                for f in processes:
+                    if (f, sel) in done:
+                        continue
+                    done.add((f, sel))
+                    fin=f'{inputDir}/{f}_{sel}_histo.root'
+                    if not os.path.isfile(fin):
+                        print (f'War: {fin} does not exist, skip')
+                        continue
+                    # the manifest lists the histograms, files without any plotted variable are not opened
+                    m = read_manifest(fin)
+                    if m is not None and not any(split_variation(k)[0] in param.variables for k in m.get('keys', [])):
+                        print (f'War: {fin} has none of the variables, skip')
+                        continue
+                    store.read(fin, f, sel, param.variables)
+                for var in param.variables:
+                    if store.merge(f'{label}/{group}', processes, sel, var) is None:
+                        print (f'War: {var} not found for {group} in selection {sel}, skip')
+                        continue
+                    for v in store.variations(sel, var):
+                        store.merge(f'{label}/{group}', processes, sel, v, fallback=var)
+
+    if cacheFile:
+        store.save(cacheFile)
+    return store
+
 #__________________________________________________________
 def mapHistos(var,   # histogram name
               label, # label string (key of 'plots')
               sel,   # selection tag string
-              param  # param python script
+              param, # param python script
+              store  # HistoStore from buildStore
               ):
     print (f'run plots for var:{var}     label:{label}     selection:{sel}')
     signal=param.plots[label]['signal']
     backgrounds=param.plots[label]['backgrounds']
 
-    # get input directory
-    inputDir = get_io_directory(param.inputDir, False)
-
-    # get signal hists
     hsignal = {}
     for s in signal:
-        hsignal[s]=[]
-        for f in signal[s]:
-            fin=f'{inputDir}/{f}_{sel}_histo.root'
-            if not os.path.isfile(fin):
-                print (f'War: {fin} does not exist, skip')
-            else:
-                tf=ROOT.TFile(fin)
-                h=tf.Get(var)
-                hh = copy.deepcopy(h)
-                if len(hsignal[s])==0:
-                    hsignal[s].append(hh)
-                else:
-                    hh.Add(hsignal[s][0])
-                    hsignal[s][0]=hh
+        h = store.get(f'{label}/{s}', sel, var)
+        if h is not None:
+            hsignal[s] = [h]
 
-
-    # get bkg hists
     hbackgrounds = {}
     for b in backgrounds:
-        hbackgrounds[b]=[]
-        for f in backgrounds[b]:
-            fin=param.inputDir+f+'_'+sel+'_histo.root'
-            if not os.path.isfile(fin):
-                print ('file {} does not exist, skip'.format(fin))
-            else:
-                tf=ROOT.TFile(fin)
-                h=tf.Get(var)
-                hh = copy.deepcopy(h)
-                if len(hbackgrounds[b])==0:
-                    hbackgrounds[b].append(hh)
-                else:
-                    hh.Add(hbackgrounds[b][0])
-                    hbackgrounds[b][0]=hh
-
-    for s in hsignal:
-        if len(hsignal[s])==0:
-            hsignal=removekey(hsignal,s)
-
-    for b in hbackgrounds:
-        if len(hbackgrounds[b])==0:
-            hbackgrounds=removekey(hbackgrounds,b)
+        h = store.get(f'{label}/{b}', sel, var)
+        if h is not None:
+            hbackgrounds[b] = [h]
 
     return hsignal,hbackgrounds
 
+#__________________________________________________________
+def systematicBand(var, label, sel, param, store):
+    '''
+    Total of the stacked groups of a plot with the systematic uncertainty as bin errors:
+    for each variation the largest shift of its tags from the nominal, added in quadrature.
+    None without variations, or when param.systematics is False.
+    '''
+    if not getattr(param, 'systematics', True):
+        return None
+    groups = [f'{label}/{g}' for g in list(param.plots[label]['backgrounds']) + list(param.plots[label]['signal'])]
+    nominal = None
+    for g in groups:
+        h = store.get(g, sel, var)
+        if h is None:
+            continue
+        if nominal is None:
+            nominal = h.Clone(f'{var}_{label}_syst')
+            nominal.SetDirectory(ROOT.nullptr)
+        else:
+            nominal.Add(h)
+    if nominal is None:
+        return None
+    shifts = {}
+    for v in store.variations(sel, var):
+        total = None
+        for g in groups:
+            h = store.get(g, sel, v)
+            if h is None:
+                h = store.get(g, sel, var)
+            if h is None:
+                continue
+            if total is None:
+                total = h.Clone()
+                total.SetDirectory(ROOT.nullptr)
+            else:
+                total.Add(h)
+        if total is None:
+            continue
+        name = split_variation(v)[1]
+        old = shifts.get(name, [0.]*(nominal.GetNbinsX()+2))
+        shifts[name] = [max(old[i], abs(total.GetBinContent(i)-nominal.GetBinContent(i))) for i in range(len(old))]
+    if not shifts:
+        return None
+    for i in range(nominal.GetNbinsX()+2):
+        nominal.SetBinError(i, sum(s[i]**2 for s in shifts.values())**0.5)
+    return nominal
+
 #__________________________________________________________
 def runPlots(var,
              sel, # list sel tags
@@ -82,7 +149,8 @@ def runPlots(var,
              hsignal, # map of signal histograms
              hbackgrounds, # map of bkg histograms
              extralab,
-             splitLeg: bool):
+             splitLeg: bool,
+             band=None): # stacked total with the systematic uncertainty
     #Below are settings for separate signal and background legends
     if(splitLeg):
         legsize = 0.04*(len(hsignal))
@@ -120,6 +188,12 @@ def runPlots(var,
             leg.AddEntry(hbackgrounds[b][0],param.legend[b],"f")
     for s in hsignal:
         leg.AddEntry(hsignal[s][0],param.legend[s],"l")
+    if band is not None and 'stack' in param.stacksig:
+        band.SetFillColor(ROOT.kGray+2)
+        band.SetFillStyle(3254)
+        band.SetLineWidth(0)
+        band.SetMarkerSize(0)
+        (leg2 if splitLeg else leg).AddEntry(band,"Syst. unc.","f")
 
     # get list of hists
     histos=[]
@@ -147,24 +221,26 @@ def runPlots(var,
         print ('no customLable, using nothing...')
 
     # draw the plots, available combinations: [stack, nostack] + [lin, log]
+    files = []
     if 'stack' in param.stacksig:
         if 'lin' in param.yaxis:
-            drawStack(var+"_stack_lin", 'events', leg, lt, rt, param.formats, param.outputDir+"/"+sel, False , True , histos, colors, param.ana_tex, extralab, customLabel, nsig, nbkg, leg2)
+            files += drawStack(var+"_stack_lin", 'events', leg, lt, rt, param.formats, param.outputDir+"/"+sel, False , True , histos, colors, param.ana_tex, extralab, customLabel, nsig, nbkg, leg2, band)
         if 'log' in param.yaxis:
-            drawStack(var+"_stack_log", 'events', leg, lt, rt, param.formats, param.outputDir+"/"+sel, True , True , histos, colors, param.ana_tex, extralab, customLabel, nsig, nbkg, leg2)
+            files += drawStack(var+"_stack_log", 'events', leg, lt, rt, param.formats, param.outputDir+"/"+sel, True , True , histos, colors, param.ana_tex, extralab, customLabel, nsig, nbkg, leg2, band)
         if 'lin' not in param.yaxis and 'log' not in param.yaxis:
             print ('unrecognised option in formats, should be [\'lin\',\'log\']'.format(param.formats))
 
     if 'nostack' in param.stacksig:
         if 'lin' in param.yaxis:
-            drawStack(var+"_nostack_lin", 'events', leg, lt, rt, param.formats, param.outputDir+"/"+sel, False , False , histos, colors, param.ana_tex, extralab, customLabel, nsig, nbkg, leg2)
+            files += drawStack(var+"_nostack_lin", 'events', leg, lt, rt, param.formats, param.outputDir+"/"+sel, False , False , histos, colors, param.ana_tex, extralab, customLabel, nsig, nbkg, leg2, band)
         if 'log' in param.yaxis:
-            drawStack(var+"_nostack_log", 'events', leg, lt, rt, param.formats, param.outputDir+"/"+sel, True , False , histos, colors, param.ana_tex, extralab, customLabel, nsig, nbkg, leg2)
+            files += drawStack(var+"_nostack_log", 'events', leg, lt, rt, param.formats, param.outputDir+"/"+sel, True , False , histos, colors, param.ana_tex, extralab, customLabel, nsig, nbkg, leg2, band)
         if 'lin' not in param.yaxis and 'log' not in param.yaxis:
             print ('unrecognised option in formats, should be [\'lin\',\'log\']'.format(param.formats))
 
     if 'stack' not in param.stacksig and 'nostack' not in param.stacksig:
         print ('unrecognised option in stacksig, should be [\'stack\',\'nostack\']'.format(param.formats))
+    return files
 
 
 #___________________________________________________________________________________________
@@ -173,7 +249,8 @@ def drawStack(name, ylabel, legend, leftText, rightText,
               logY, stacksig, histos,
               colors, ana_tex, extralab, customLabel,
               nsig, nbkg,
-              legend2=None):
+              legend2=None,
+              band=None):
     # canvas
     canvas = ROOT.TCanvas(name, name, 600, 600)
     canvas.SetLogy(logY)
@@ -298,6 +375,10 @@ def drawStack(name, ylabel, legend, leftText, rightText,
     if not stacksig and nbkg:
         hStackSig.Draw("same hist nostack")
 
+    # systematic uncertainty of the stacked total
+    if band is not None and stacksig:
+        band.Draw("E2 same")
+
     # draw legend and other annotations
     legend.Draw()
     if legend2 != None:
@@ -337,22 +418,57 @@ def drawStack(name, ylabel, legend, leftText, rightText,
     canvas.Modified()
     canvas.Update()
 
-    printCanvas(canvas, name, formats, directory)
+    return printCanvas(canvas, name, formats, directory)
 
 
 #____________________________________________________
 def printCanvas(canvas, name, formats, directory):
 
+    files = []
     if format != "":
         if not os.path.exists(directory) :
                 os.system("mkdir -p "+directory)
         for f in formats:
             outFile = os.path.join(directory, name) + "." + f
             canvas.SaveAs(outFile)
+            files.append(outFile)
+    return files
+
 
+# plot script parameters changing the look of a plot
+PLOT_PARAMS = ['ana_tex', 'energy', 'customLabel', 'legendCoord', 'formats', 'yaxis',
+               'stacksig', 'outputDir', 'splitLeg', 'legend', 'colors', 'plots', 'systematics']
 
 #__________________________________________________________
-def ana_plot(param):
+def plotDigest(var, label, sel, param, hsignal, hbackgrounds, band=None) -> str:
+    '''
+    Digest of everything one (variable, label, selection) plot is drawn from:
+    the content of its merged histograms, systematic band and the plot script parameters.
+    '''
+    h = hashlib.sha256(json.dumps([var, label, sel, param.extralabel[sel]]).encode())
+    for p in PLOT_PARAMS:
+        h.update(json.dumps(getattr(param, p, None), sort_keys=True, default=str).encode())
+    for group in list(hsignal.items()) + list(hbackgrounds.items()):
+        h.update(group[0].encode())
+        h.update(str(ROOT.TBufferJSON.ConvertToJSON(group[1][0])).encode())
+    if band is not None:
+        h.update(str(ROOT.TBufferJSON.ConvertToJSON(band)).encode())
+    return h.hexdigest()
+
+#__________________________________________________________
+def renderPlot(var, label, sel, param, hsignal, hbackgrounds, band, splitLeg):
+    '''
+    Draw all the stack modes, axis scales and formats of one plot, return the written files.
+    The histograms and band are those of plotDigest, mapped once in the parent process.
+    '''
+    return runPlots(var+"_"+label,sel,param,hsignal,hbackgrounds,param.extralabel[sel],splitLeg,band)
+
+#__________________________________________________________
+def ana_plot(param, jobs: int=1, force: bool=False):
+    '''
+    Render all plots, in jobs forked worker processes (0 for one per core).
+    Plots whose histograms and parameters did not change since the last run are skipped.
+    '''
     ROOT.gROOT.SetBatch(True)
     ROOT.gErrorIgnoreLevel = ROOT.kWarning
 
@@ -361,8 +477,28 @@ def ana_plot(param):
     else:
         splitLeg = False
 
+    store = buildStore(param)
+    os.makedirs(param.outputDir, exist_ok=True)
+    cache = StageCache(param.outputDir)
+
+    tasks, labels, digests = [], [], []
     for var in param.variables:
         for label, sels in param.selections.items():
             for sel in sels:
-                hsignal,hbackgrounds=mapHistos(var,label,sel, param)
-                runPlots(var+"_"+label,sel,param,hsignal,hbackgrounds,param.extralabel[sel],splitLeg)
+                name = f'{sel}/{var}_{label}'
+                hsignal,hbackgrounds=mapHistos(var,label,sel,param,store)
+                band=systematicBand(var,label,sel,param,store)
+                digest = plotDigest(var, label, sel, param, hsignal, hbackgrounds, band)
+                if not force and cache.lookup(name, digest):
+                    print (f'----> Info: {name} is up-to-date, skip')
+                    continue
+                tasks.append((var, label, sel, param, hsignal, hbackgrounds, band, splitLeg))
+                labels.append(name)
+                digests.append(digest)
+
+    def onDone(index, files):
+        cache.record(labels[index], digests[index],
+                     [os.path.relpath(f, param.outputDir) for f in files])
+
+    workers, _ = split_core_budget(os.cpu_count() or 1, len(tasks), jobs)
+    run_tasks(renderPlot, tasks, workers, labels, onDone)
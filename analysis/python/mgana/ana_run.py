@@ -1,11 +1,35 @@
 import os, sys
 import glob, time, json
+import tempfile
+import shutil
 import importlib.util
+import copy
 from array import array
 
-import ROOT, megat
+import ROOT
 from .utility import is_absolute_path, expand_absolute_directory
 from .utility import megat_geometry_path, mgana_lib_path, mgana_workspace_path, get_io_directory
+from .utility import temporary_path, commit_path
+from .index import scan_files, register_file
+from .histstore import variation_name
+from .scheduler import split_core_budget, run_tasks, run_tasks_dask
+from .memory import available_cores, memory_budget, probe_memory, fit_budget, run_forked, rss, peak_rss, format_size, parse_size
+from .chunking import full_ranges, plan_chunks, truncate_ranges, processed_events
+from .dataset import make_dataframe
+from .skim import book_skim, write_skim, skim_dataframe
+from .storage import get_profile, snapshot_options
+from .columnar import COLUMNAR_FORMATS, columnar_path, write_columnar
+from .cache import runtime_key, output_key, file_digest, StageCache
+from .manifest import write_manifest, read_manifest, manifest_path
+from .watch import WatchState, DirectoryWatcher
+from .prefetch import configure_tree_cache, scratch_cache
+from .pyfunc import declare_functions
+from .rdfwrap import ExpressionCache, library_headers, set_expression_cache, wrap_node, unwrap_node
+from .rdfwrap import record_expressions, compile_expressions
+from .rdfwrap import Profiler, set_profiler
+from . import rdfwrap
+from .timing import startupTimer, process_io, LoopMeter, limiting_factor
+from .ana_parser import setup_run_parser, setup_run_parser_final, setup_run_parser_plots
 from .logger import rootLogger
 
 #__________________________________________________________
@@ -29,8 +53,9 @@ def getElement(rdfModule, element, isFinal=False):
             return ""
 
         elif element=='nCPUS':
-            print(f'Warn: Variable <{element}> not specified in your analysis script, will use 4')
-            return 4
+            ncores = available_cores()
+            print(f'Warn: Variable <{element}> not specified in your analysis script, will use the {ncores} available cores')
+            return ncores
 
         elif element=='cutList':
             if isFinal:
@@ -56,12 +81,36 @@ def getElement(rdfModule, element, isFinal=False):
                 return False
             else: print('The option <{}> is not available in presel analysis'.format(element))
 
+        elif element=='saveCutSkim':
+            if isFinal:
+                print('The variable <{}> is optional in your analysis_final.py file return default value False'.format(element))
+                return False
+            else: print('The option <{}> is not available in presel analysis'.format(element))
+
+        elif element=='cutChain':
+            if isFinal:
+                print('The variable <{}> is optional in your analysis_final.py file return default value False'.format(element))
+                return False
+            else: print('The option <{}> is not available in presel analysis'.format(element))
+
+        elif element=='variationList':
+            if isFinal:
+                print('The variable <{}> is optional in your analysis_final.py file return empty dictionary'.format(element))
+                return {}
+            else: print('The option <{}> is not available in presel analysis'.format(element))
+
         elif element=='saveTabular':
             if isFinal:
                 print('The variable <{}> is optional in your analysis_final.py file return empty dictionary'.format(element))
                 return {}
             else: print('The option <{}> is not available in presel analysis'.format(element))
 
+        elif element=='storageProfile':
+            return 'default'
+
+        elif element=='friendOutput':
+            return False
+
         elif element=='cutLabels':
             if isFinal:
                 print('The variable <{}> is optional in your analysis_final.py file return empty dictionary'.format(element))
@@ -79,6 +128,23 @@ def getElementDict(d, element):
         rootLogger.debug(f'{element} not exist, using default value')
         return None
 
+#__________________________________________________________
+def getInputDir(inputDir):
+    '''
+    Absolute input directory of the stage, the workspace by default.
+    '''
+    if not inputDir:
+        return mgana_workspace_path()
+    return expand_absolute_directory(inputDir)
+
+#__________________________________________________________
+def getProcessInputs(process, inputDir):
+    '''
+    ROOT files of a process directory inputDir/process/, without opening them.
+    '''
+    dirtest = '{}/{}'.format(getInputDir(inputDir), process)
+    return sorted(glob.glob(dirtest+"/*.root")) if os.path.isdir(dirtest) else []
+
 #__________________________________________________________
 def getProcessInfoFiles(process, inputDir):
     '''
@@ -86,15 +152,10 @@ def getProcessInfoFiles(process, inputDir):
     If inputDir/process.root exist, return this file;
     otherwise, return all root files under inputDir/process/.
     '''
-    if not inputDir:
-        inputDir = mgana_workspace_path()
-    else:
-        inputDir = expand_absolute_directory(inputDir)
-
     filelist=[]
     eventlist=[]
-    filetest='{}/{}.root'.format(inputDir, process)
-    dirtest='{}/{}'.format(inputDir, process)
+    filetest='{}/{}.root'.format(getInputDir(inputDir), process)
+    dirtest='{}/{}'.format(getInputDir(inputDir), process)
 
     if os.path.isfile(filetest) and os.path.isdir(dirtest):
         print ("----> For process {} both a file {} and a directory {} exist".format(process,filetest,dirtest))
@@ -108,13 +169,12 @@ def getProcessInfoFiles(process, inputDir):
 
     if os.path.isfile(filetest):
         filelist.append(filetest)
-        eventlist.append(getEntries(filetest))
 
     if os.path.isdir(dirtest):
-        flist=glob.glob(dirtest+"/*.root")
-        for f in flist:
-            filelist.append(f)
-            eventlist.append(getEntries(f))
+        filelist+=sorted(glob.glob(dirtest+"/*.root"))
+
+    # entries are taken from the directory index, only new files are opened
+    eventlist=[info['entries'] for info in scan_files(filelist)]
 
     return filelist, eventlist
 
@@ -123,46 +183,7 @@ def getEntries(f):
     '''
     Return nentries in a ROOT file.
     '''
-    tf=ROOT.TFile.Open(f,"READ")
-    tf.cd()
-    tt=tf.Get("events")
-    nevents=tt.GetEntries()
-    tf.Close()
-    return nevents
-
-#__________________________________________________________
-def getsubfileList(fileList, eventList, fraction):
-    '''
-    Return the min list of files with sum nevents > fraction*total_nevents
-    '''
-    nevts=sum(eventList)
-    nevts_target=nevts*fraction
-    nevts_real=0
-    tmplist=[]
-    for ev in range(len(eventList)):
-        if nevts_real>=nevts_target:break
-        nevts_real+=eventList[ev]
-        tmplist.append(fileList[ev])
-    return tmplist
-
-#__________________________________________________________
-def getchunkList(fileList, chunks):
-    '''
-    Divide the fileList into 'chunks' list on average and return the chunked list
-    '''
-    chunklist=[]
-    if chunks>len(fileList):chunks=len(fileList)
-    nfilesperchunk=int(len(fileList)/chunks)
-    for ch in range(chunks):
-        filecount=0
-        listtmp=[]
-        for fileName in fileList:
-            if (filecount>=ch*nfilesperchunk and filecount<(ch+1)*nfilesperchunk) or (filecount>=ch*nfilesperchunk and ch==chunks-1):
-                listtmp.append(fileName)
-            filecount+=1
-        chunklist.append(listtmp)
-
-    return chunklist
+    return scan_files([f])[0]['entries']
 
 #__________________________________________________________
 def saveBenchmark(outfile, benchmark):
@@ -185,93 +206,185 @@ def saveBenchmark(outfile, benchmark):
         json.dump(benchmarks, benchout, indent=2)
 
 #__________________________________________________________
-def runRDF(rdfModule, inputlist, outFile, nevt, args):
-    # MT config
-    ncpus = 1
-    # cannot use MT with Range()
-    if args.nevents < 0:
-        if isinstance(args.ncpus, int) and args.ncpus >= 1:
-            ncpus = args.ncpus
-        else:
-            ncpus = getElement(rdfModule, "nCPUS")
-
+def runRDF(rdfModule, ranges, outFile, nevt, args, profileName=None):
+    '''
+    Run the analysers over ranges and snapshot the output() columns into outFile.
+    Return the number of written entries and the list of written columns.
+    '''
+    # MT config, also used with --nevents since the ranges are already truncated
+    if isinstance(args.ncpus, int) and args.ncpus >= 1:
+        ncpus = args.ncpus
+    else:
+        ncpus = getElement(rdfModule, "nCPUS")
+    # a MT snapshot does not keep the entry order, friend outputs are written
+    # sequentially and parallelised over the chunks with --jobs
+    friend = args.friend
+    if friend:
+        ncpus = 1
+        ROOT.ROOT.DisableImplicitMT()
+    else:
         ROOT.ROOT.EnableImplicitMT(ncpus)
 
     ROOT.EnableThreadSafety()
-    df = ROOT.RDataFrame("events", inputlist)
-
-    # limit number of events processed
-    if args.nevents > 0:
-      df = df.Range(0, args.nevents)
+    df = wrap_node(make_dataframe(ranges))
 
     # run RDF
     print("----> Init done:")
     print("      about to run {} events on {} CPUs".format(nevt, ncpus))
+    start_time = time.time()
     df1 = getElement(rdfModule.RDFanalysis, "analysers")(df)
+    print(f"----> Info: Computation graph built in {time.time()-start_time:.2f} s")
 
     # save snapshot
     branchList = getElement(rdfModule.RDFanalysis, "output")()
+    if friend:
+        # only the new columns, the input ones are read from the parent files
+        defined = set(str(c) for c in df1.GetDefinedColumnNames())
+        skipped = [b for b in branchList if b not in defined]
+        if skipped:
+            print(f"----> Info: friend output, input columns {', '.join(skipped)} are not copied")
+        branchList = [b for b in branchList if b in defined]
     branchListVec = ROOT.vector('string')()
     for branchName in branchList:
         branchListVec.push_back(branchName)
 
-    df1.Snapshot("events", outFile, branchListVec)
+    # storage profile from the command line or the analysis script
+    profile = get_profile(args.storage or getElement(rdfModule, "storageProfile"))
+    count = df1.Count()
+    df1.Snapshot("events", outFile, branchListVec, snapshot_options(profile))
+    record_expressions()
+
+    # timing of the string expressions and annotated computation graph
+    if rdfwrap.profiler and profileName:
+        rdfwrap.profiler.report(rdfwrap.profiler.take(), df, profileName)
+    return count.GetValue(), list(branchList)
 
 #__________________________________________________________
-def runLocal(rdfModule, fileList, outputDir, args):
+def runColumnar(rdfModule, ranges, outFile, profile, metadata, args):
     '''
-    Process a list of ROOT files.
+    Write the output() columns to Arrow/Parquet instead of a ROOT snapshot,
+    running the analysers once per row group so the memory use stays bounded.
     '''
-    # meta: the initial nevents in the analysis chain
-    nevents_meta = 0
+    if isinstance(args.ncpus, int) and args.ncpus >= 1:
+        ncpus = args.ncpus
+    else:
+        ncpus = getElement(rdfModule, "nCPUS")
+    ROOT.ROOT.EnableImplicitMT(ncpus)
+    ROOT.EnableThreadSafety()
+
+    analysers = getElement(rdfModule.RDFanalysis, "analysers")
+    branchList = list(getElement(rdfModule.RDFanalysis, "output")())
+    print(f"----> Init done: writing {profile['format']} row groups of {profile.get('rowGroupSize', 1000000)} input events on {ncpus} CPUs")
+    outn = write_columnar(lambda df: analysers(wrap_node(df)), ranges, branchList, outFile, profile, metadata)
+    record_expressions()
+    return outn
+
+#__________________________________________________________
+def runLocal(rdfModule, ranges, outputDir, args, nthreads=None):
+    '''
+    Process a list of (file, first, last) entry ranges.
+    The output is written under a temporary name and renamed once complete.
+    nthreads replaces args.ncpus when the scheduler lowers the threads to fit the memory budget.
+    Return the bookkeeping of the output file.
+    '''
+    if nthreads:
+        args.ncpus = nthreads
     # local: the nevents processed in the current analysis
     nevents_local = 0
 
     # create list of files to be Processed and aggregate total nevents
     print ("----> Create dataframe object from files: ", )
-    fileListRoot = ROOT.vector('string')()
-    for fileName in fileList:
-        fileListRoot.push_back(fileName)
-        print ("     ",fileName)
-        tf=ROOT.TFile.Open(str(fileName),"READ")
-        tf.cd()
-        for key in tf.GetListOfKeys():
-            if 'eventsProcessed' == key.GetName():
-                nevents_meta += tf.eventsProcessed.GetVal()
-                break
-        tt=tf.Get("events")
-        nevents_local+=tt.GetEntries()
-
-    # adjust number of events in case --nevents was specified
-    if args.nevents > 0:
-      nevents_local = args.nevents
+    for fileName, first, last in ranges:
+        print ("     ",fileName, f"[{first}, {last})")
+        nevents_local += last-first
+    # meta: the initial nevents in the analysis chain, pro rata for a partially processed file
+    nevents_meta = processed_events(ranges, scan_files([r[0] for r in ranges]))
+
     print ("----> nevents original={}  local={}".format(nevents_meta,nevents_local))
 
+    # the initial nevents passed down the analysis chain
+    n = array( "i", [ 0 ] )
+    n[0] = nevents_local
+    if nevents_meta > nevents_local: n[0] = nevents_meta
+
+    # inputs staged on local scratch are read from there, the upcoming ones are copied meanwhile
+    readRanges = ranges
+    scratch = None
+    if args.stage_dir:
+        scratch = scratch_cache(args.stage_dir, parse_size(args.stage_size))
+        infos = scan_files([f for f, _, _ in ranges])
+        # friend outputs locate their parents relative to themselves, they are read in place
+        local = {f: scratch.acquire(f) for (f, _, _), info in zip(ranges, infos) if not info.get('parents')}
+        readRanges = [(local.get(f) or f, first, last) for f, first, last in ranges]
+        print(f"----> Info: {sum(1 for c in local.values() if c)}/{len(ranges)} inputs read from {args.stage_dir}")
+        upcoming = getattr(args, 'upcoming', [])
+        scratch.prefetch([f for f, info in zip(upcoming, scan_files(upcoming)) if not info.get('parents')])
+    ioSettings = configure_tree_cache([f for f, _, _ in readRanges], scan_files([f for f, _, _ in readRanges]),
+                                      parse_size(args.tree_cache) if args.tree_cache else None,
+                                      args.cache_learn, args.prefetch)
+
     # run RDF
     start_time = time.time()
+    meter = LoopMeter()
     outFile = os.path.join(outputDir, args.output)
-    runRDF(rdfModule, fileListRoot, outFile, nevents_local, args)
+    profile = get_profile(args.storage or getElement(rdfModule, "storageProfile"))
+    parents = None
+    try:
+        if profile.get('format') in COLUMNAR_FORMATS:
+            outFile = columnar_path(outFile, profile)
+            tmpFile = temporary_path(outFile)
+            outn = runColumnar(rdfModule, readRanges, tmpFile, profile, {'eventsProcessed': n[0]}, args)
+            branches = list(getElement(rdfModule.RDFanalysis, "output")())
+        else:
+            tmpFile = temporary_path(outFile)
+            outn, branches = runRDF(rdfModule, readRanges, tmpFile, nevents_local, args, f'{os.path.splitext(outFile)[0]}_profile')
+        loop = meter.stop(1 if args.friend else ROOT.ROOT.GetThreadPoolSize() or 1)
+    finally:
+        if scratch:
+            scratch.release()
+    if profile.get('format') not in COLUMNAR_FORMATS:
+        if args.friend:
+            if outn != nevents_local:
+                os.remove(tmpFile)
+                raise RuntimeError(f'Friend output {outFile} has {outn} entries instead of {nevents_local}, '
+                                   'a friend stage can not filter events')
+            # parents relative to the output, read back by dataset.make_dataframe
+            parents = [os.path.relpath(f, os.path.dirname(outFile)) for f, _, _ in ranges]
+
+        # pass-down the initial nevents, and the parents of a friend output
+        outf = ROOT.TFile(tmpFile, "update")
+        ROOT.TParameter(int)("eventsProcessed", n[0]).Write()
+        if parents:
+            ROOT.TNamed("friendParents", json.dumps(parents)).Write()
+        outf.Close()
+    elapsed_time = time.time() - start_time
 
-    # pass-down the initial nevents
-    outf = ROOT.TFile( outFile, "update" )
-    outt = outf.Get("events")
-    outn = outt.GetEntries()
-    n = array( "i", [ 0 ] )
-    n[0] = nevents_local
-    if nevents_meta > nevents_local: n[0] = nevents_meta
-    p = ROOT.TParameter(int)( "eventsProcessed", n[0])
-    p.Write()
-    outf.Write()
-    outf.Close()
+    # a copy of the bookkeeping of the output and the rest of its provenance go to the manifest
+    write_manifest(outFile, {'format': profile.get('format', 'ttree'), 'entries': outn, 'eventsProcessed': n[0],
+                             'sources': [[os.path.abspath(f), first, last] for f, first, last in ranges],
+                             'parents': parents, 'branches': branches, 'trees': ['events'], 'keys': outputKeys(parents),
+                             'script': file_digest(args.pathToAnalysisScript), 'runtime': args.runtimeKey,
+                             'storage': profile,
+                             'timing': {'start': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time)),
+                                        'elapsed': elapsed_time, 'peakRSS': peak_rss(), 'io': dict(loop, **ioSettings)}},
+                   tmpFile)
+    commit_path(tmpFile, outFile)
 
     # print benchmarks
-    elapsed_time = time.time() - start_time
     print  ()
     print  ("==============================SUMMARY==============================")
     print  ("Output file              :  ",outFile)
     print  ("Elapsed time (H:M:S)     :  ",time.strftime("%H:%M:%S", time.gmtime(elapsed_time)))
     print  ("Events Processed/Second  :  ",int(nevents_local/elapsed_time))
     print  ("Total Events Processed   :  ",int(nevents_local))
+    print  ("Peak resident memory     :  ",format_size(peak_rss()))
+    print  ("CPU time                 :  ",f"{loop['cpu']:.1f} s, {100*loop['utilisation']:.0f}% of {loop['threads']} threads")
+    print  ("Waiting (I/O, idle)      :  ",f"{loop['wait']:.1f} s" + (f", block I/O {loop['blkio']:.1f} s" if loop['blkio'] > 0 else ''))
+    print  ("Read from inputs         :  ",f"{format_size(loop['bytesRead'])} in {loop['readCalls']} calls, "
+                                            f"{format_size(loop['bytesRead']/max(loop['wall'], 1e-9))}/s")
+    print  ("Tree cache / prefetch    :  ",f"{format_size(ioSettings['cacheSize'])} x {ioSettings['learnEntries']} learn entries, "
+                                            f"prefetch {'on' if ioSettings['prefetch'] else 'off'}")
+    print  ("Limited by               :  ",limiting_factor(loop, ioSettings['remote']))
     if (nevents_local>0): print  ("Reduction factor local   :  ",outn/nevents_local)
     if (nevents_meta>0):  print  ("Reduction factor total   :  ",outn/nevents_meta)
     print  ("===================================================================")
@@ -298,40 +411,218 @@ def runLocal(rdfModule, fileList, outputDir, args):
         bench_evt_per_sec['name'] += analysis_name
         bench_evt_per_sec['unit'] = 'Evt/s'
         bench_evt_per_sec['value'] = nevents_local / elapsed_time
-        bench_time['range'] = 1000
-        bench_time['extra'] = 'Analysis path: ' + expand_absolute_directory(args.pathToAnalysisScript)
+        bench_evt_per_sec['range'] = 1000
+        bench_evt_per_sec['extra'] = 'Analysis path: ' + expand_absolute_directory(args.pathToAnalysisScript)
         saveBenchmark('benchmarks_bigger_better.json', bench_evt_per_sec)
 
+    return {'output': outFile, 'entries': outn, 'eventsProcessed': n[0], 'format': profile.get('format', 'ttree'),
+            'parents': parents}
 
 #__________________________________________________________
-def runStages(rdfModule, args):
+def outputKeys(parents):
     '''
-    Load and run the analysis script for pre-processing stages.
-    New branches to be used for later usage are defined in this step.
-    Filtering and histogramming are the tasks done in runFinal.
-    There are two sources of input list of files (mutual exclusive):
-    1) specified in command line option '--files'
-    2) generated from the analysis script parameter 'processList'
+    Top-level keys of a stage output.
+    '''
+    return ['events', 'eventsProcessed'] + (['friendParents'] if parents else [])
+
+#__________________________________________________________
+def registerOutput(result):
+    '''
+    Index a stage output for the next stage.
+    '''
+    register_file(result['output'], {'entries': result['entries'], 'eventsProcessed': result['eventsProcessed'],
+                                     'clusters': [], 'trees': ['events'], 'keys': outputKeys(result.get('parents')),
+                                     'format': result.get('format', 'ttree'), 'parents': result.get('parents')})
+
+#__________________________________________________________
+def recordOutput(cache, outputDir, label, digest, result):
+    '''
+    Index a completed stage output and record it in the stage cache.
+    '''
+    registerOutput(result)
+    output = os.path.relpath(result['output'], outputDir)
+    cache.record(label, digest, [output, manifest_path(output)])
+
+#__________________________________________________________
+def getWorkers(rdfModule, args, ntasks):
+    '''
+    Return the number of worker processes and set args.ncpus to the implicit-MT threads of each.
+    Locally the --ncpus/nCPUS core budget is split between workers and threads,
+    on a remote dask scheduler --ncpus is the number of threads of each task.
+    '''
+    ncores = args.ncpus if isinstance(args.ncpus, int) and args.ncpus >= 1 else getElement(rdfModule, "nCPUS")
+    if args.executor == 'dask' and args.scheduler_address:
+        args.ncpus = ncores
+        return ntasks
+    if args.jobs == 1 and args.executor == 'local':
+        args.ncpus = ncores
+        return 1
+    workers, args.ncpus = split_core_budget(ncores, ntasks, args.jobs)
+    print(f'----> Info: {workers} workers x {args.ncpus} threads for {ntasks} tasks')
+    return workers
+
+#__________________________________________________________
+def probeRSS(nthreads, rdfModule, ranges, nevents):
+    '''
+    Run the analysers over the first nevents of ranges on nthreads, in a forked child of
+    the memory probe, and return the resident memory at the end of the event loop.
+    '''
+    ROOT.ROOT.EnableImplicitMT(nthreads)
+    df = wrap_node(make_dataframe(truncate_ranges(ranges, nevents)))
+    df1 = getElement(rdfModule.RDFanalysis, "analysers")(df)
+    branchListVec = ROOT.vector('string')()
+    for branchName in getElement(rdfModule.RDFanalysis, "output")():
+        branchListVec.push_back(branchName)
+    fd, tmpFile = tempfile.mkstemp(prefix='mgana_probe_', suffix='.root')
+    os.close(fd)
+    try:
+        df1.Snapshot("events", tmpFile, branchListVec)
+        return rss()
+    finally:
+        os.remove(tmpFile)
+
+#__________________________________________________________
+def fitMemory(rdfModule, args, tasks, workers, budget, cache):
+    '''
+    Estimate the memory of one worker from a probe on the first events of the first task
+    and lower workers and threads until the estimate fits in the memory budget.
+    The estimate is kept in the stage cache, later runs with the same script, libraries
+    and geometry (and --watch passes) reuse it, --force probes again.
+    Return the number of workers, args.ncpus is set to the threads of each.
+    '''
+    if not budget or args.memory_probe <= 0 or workers*args.ncpus <= 1:
+        return workers
+    key = f'{args.runtimeKey}:{args.memory_probe}'
+    estimate = None if args.force else cache.memory_estimate(key)
+    if estimate is None:
+        estimate = probe_memory(probeRSS, rdfModule, tasks[0][1], args.memory_probe)
+        cache.record_memory(key, *estimate)
+    base, perThread = estimate
+    fitted = fit_budget(budget, base, perThread, workers, args.ncpus)
+    print(f'----> Info: Memory of a worker ~ {format_size(base)} + {format_size(perThread)} per thread, '
+          f'budget {format_size(budget)}')
+    if fitted != (workers, args.ncpus):
+        print(f'----> Info: Concurrency lowered from {workers} workers x {args.ncpus} threads to {fitted[0]} x {fitted[1]}')
+    workers, args.ncpus = fitted
+    return workers
+
+#__________________________________________________________
+def processOutput(processList, process):
+    '''
+    Output name of a process of a stage script, the process name unless 'output' is set.
+    '''
+    try:
+        return getElementDict(processList[process], 'output') or process
+    except TypeError:
+        return process
+
+#__________________________________________________________
+def stageOutputDir(rdfModule, args):
+    '''
+    Output directory of a stage: --output-dir, else outputDir of the script.
+    '''
+    return get_io_directory(args.output_dir or getElement(rdfModule,"outputDir"))
+
+#__________________________________________________________
+def resetWatched(state, cache, outputDir, output):
+    '''
+    Forget the watch state of output before a run without --watch, which plans its chunks from
+    the process directory again. The chunks written in watch mode are removed with their cache
+    entries, otherwise the final stage would read their events twice.
+    '''
+    for path in sorted(glob.glob(f'{outputDir}/{output}/chunk*.root')):
+        for p in (path, manifest_path(path)):
+            if os.path.isfile(p):
+                os.remove(p)
+        cache.outputs.pop(os.path.relpath(path, outputDir), None)
+    cache.save()
+    state.reset(output)
+    print(f'----> Info: {output} was watched, its chunks are planned again from the process directory')
+
+#__________________________________________________________
+def planStage(rdfModule, args, processes=None, cache=None):
+    '''
+    Plan the chunks of a stage: the processes of processList (only those in processes if given)
+    or the --files inputs. Chunks whose outputs are up-to-date in cache are skipped.
+    Return (outputDir, cache, tasks, labels, digests), tasks are runLocal arguments.
     '''
     #check if outputDir exist and if not create it
-    outputDir = get_io_directory(getElement(rdfModule,"outputDir"))
+    outputDir = stageOutputDir(rdfModule, args)
 
     print("----> Info: Output top-level path:")
     print(f"      {outputDir}")
     print  ("===================================================================")
 
+    # friend outputs keep only the new columns, aligned entry by entry with their inputs
+    args.friend = args.friend or bool(getElement(rdfModule, "friendOutput"))
+    if args.friend:
+        profile = get_profile(args.storage or getElement(rdfModule, "storageProfile"))
+        if profile.get('format', 'ttree') != 'ttree':
+            print(f"----> Error: friend outputs are TTrees, storage profile {profile.get('format')} can not be used")
+            sys.exit(3)
+        if args.nevents > 0:
+            print('----> Error: friend outputs must cover whole input files, --nevents can not be used')
+            sys.exit(3)
+        print('----> Info: writing friend outputs with the new columns only')
+
+    # sizes of the input caches, checked before any worker starts
+    try:
+        for size in (args.tree_cache, args.stage_size):
+            if size: parse_size(size)
+    except ValueError as e:
+        print(f'----> Error: {e}')
+        sys.exit(3)
+
+    # outputs whose inputs, script, libraries, geometry and storage are unchanged are skipped
+    cache = cache or StageCache(outputDir)
+    storage = args.storage or getElement(rdfModule, "storageProfile")
+    profile = get_profile(storage)
+    options = {'friend': args.friend, 'storage': storage, 'format': profile.get('format', 'ttree'), 'profile': profile}
+    tasks = []
+    labels = []
+    digests = []
+
+    def addTask(ranges, output):
+        # --nevents: exact entry ranges of the first events of the output
+        if args.nevents > 0:
+            ranges = truncate_ranges(ranges, args.nevents)
+        digest = output_key(args.runtimeKey, ranges, options)
+        if not args.force and cache.lookup(output, digest):
+            print(f'----> {output} is up-to-date, skip')
+            return
+        taskArgs = copy.copy(args)
+        taskArgs.output = output
+        tasks.append((rdfModule, ranges, outputDir, taskArgs))
+        labels.append(output)
+        digests.append(digest)
+
     # option 1: files are specified in command line, then run rdf directly
     if len(args.files)>0:
         print("----> Running with user defined list of files")
-        runLocal(rdfModule, args.files, outputDir, args)
-        sys.exit(0)
+        fileList = [expand_absolute_directory(f) for f in args.files]
+        addTask(full_ranges(fileList, scan_files(fileList)), args.output)
 
     # option 2: files specified as process list
-    processList = getElement(rdfModule,"processList")
+    processList = getElement(rdfModule,"processList") if len(args.files)==0 else {}
+    # inputs of watched outputs are assigned by mgana run --watch
+    state = WatchState(outputDir)
 
     for process in processList:
-        fileList, eventList = getProcessInfoFiles(process, getElement(rdfModule, "inputDir"))
-        if len(fileList)==0:
+        if processes is not None and process not in processes:
+            continue
+        watched = state.regular(processOutput(processList, process))
+        if watched is not None and not args.watch:
+            resetWatched(state, cache, outputDir, processOutput(processList, process))
+            watched = None
+        if watched is not None:
+            fileList = [f for f in watched if os.path.isfile(f)]
+            assigned = state.assigned(processOutput(processList, process))
+            unassigned = [f for f in getProcessInputs(process, getElement(rdfModule, "inputDir")) if f not in assigned]
+            if unassigned:
+                print(f'----> Info: {len(unassigned)} new files of {process} are left to mgana run --watch')
+        else:
+            fileList, eventList = getProcessInfoFiles(process, getElement(rdfModule, "inputDir"))
+        if len(fileList)==0 and watched is None:
             print('----> ERROR: No files to process. Exit')
             sys.exit(3)
 
@@ -350,38 +641,569 @@ def runStages(rdfModule, args):
 
         print ('\n----> Running process {} with fraction={}, output={}, chunks={}'.format(process, fraction, output, chunks))
 
-        if fraction < 1: fileList = getsubfileList(fileList, eventList, fraction)
-        chunkList=[fileList]
-        if chunks > 1: chunkList = getchunkList(fileList, chunks)
+        # entry-balanced chunks cut on cluster boundaries, fraction is exact in entries (whole files for RNTuple)
+        infos = scan_files(fileList)
+        align = 'file' if args.friend or any(info.get('format') == 'rntuple' for info in infos) else 'cluster'
+        chunkList = plan_chunks(fileList, infos, chunks, fraction, align) if fileList else []
+        if args.friend and fraction < 1:
+            print(f'----> Error: friend outputs must cover whole input files, fraction={fraction} of {process} can not be used')
+            sys.exit(3)
+        if len(chunkList)==0 and not state.chunks(output):
+            print('----> Warning: No events to process for {}, skip'.format(process))
+            continue
 
-        #create dir if more than 1 chunk
-        if chunks > 1:
+        #create dir if more than 1 chunk, watched outputs always get new chunks
+        if len(chunkList) > 1 or watched is not None:
             outputdir = os.path.join(outputDir, output)
             if not os.path.exists(outputdir):
                 os.makedirs(outputdir)
 
         for ch in range(len(chunkList)):
             outputchunk=''
-            if len(chunkList) > 1: outputchunk = "{}/chunk{}.root".format(output,ch)
+            if len(chunkList) > 1 or watched is not None: outputchunk = "{}/chunk{}.root".format(output,ch)
             else:                outputchunk = "{}.root".format(output)
-            args.output = outputchunk
-            runLocal(rdfModule, chunkList[ch], outputDir, args)
+            addTask(chunkList[ch], outputchunk)
+
+        # chunks of the files arrived while watching, whole files each
+        for outputchunk, files in state.chunks(output).items():
+            files = [f for f in files if os.path.isfile(f)]
+            if files:
+                addTask(full_ranges(files, scan_files(files)), outputchunk)
+    return outputDir, cache, tasks, labels, digests
+
+#__________________________________________________________
+def runStages(rdfModule, args):
+    '''
+    Load and run the analysis script for pre-processing stages.
+    New branches to be used for later usage are defined in this step.
+    Filtering and histogramming are the tasks done in runFinal.
+    There are two sources of input list of files (mutual exclusive):
+    1) specified in command line option '--files'
+    2) generated from the analysis script parameter 'processList'
+    '''
+    outputDir, cache, tasks, labels, digests = planStage(rdfModule, args)
+    if len(tasks) == 0:
+        print('----> Info: All outputs are up-to-date')
+        return
+
+    # split the core budget between chunk workers and implicit-MT threads
+    workers = getWorkers(rdfModule, args, len(tasks))
+    # memory: probe the first events, fit the workers and threads in the budget
+    try:
+        budget = memory_budget(args.memory_budget)
+    except ValueError as e:
+        print(f'----> Error: {e}')
+        sys.exit(3)
+    if args.executor == 'local':
+        # the forked probes and workers inherit the geometry instead of building it each
+        buildGeometry(rdfModule)
+        workers = fitMemory(rdfModule, args, tasks, workers, budget, cache)
+    for i, task in enumerate(tasks):
+        task[3].ncpus = args.ncpus
+        # a worker stages the inputs of the chunk it is likely to run next
+        if i + workers < len(tasks):
+            task[3].upcoming = [f for f, _, _ in tasks[i + workers][1]]
+
+    # record each output as soon as it is complete, so an interrupted stage can resume
+    def onDone(index, result):
+        recordOutput(cache, outputDir, labels[index], digests[index], result)
+
+    if args.executor == 'dask':
+        remote = [(args.pathToAnalysisScript, os.getcwd(), 'run') + task[1:] for task in tasks]
+        run_tasks_dask(remoteTask, remote, workers, labels, onDone, args.scheduler_address)
+    else:
+        run_tasks(runLocal, tasks, workers, labels, onDone, budget, args.ncpus)
+        if workers > 1 or budget:
+            print(f'----> Info: Peak resident memory of a worker {format_size(peak_rss(children=True))}, '
+                  f'{workers} workers x {args.ncpus} threads')
+    # the new expressions of all chunks are compiled once, for the next runs
+    compile_expressions()
+
+#__________________________________________________________
+def watchPass(expressionCache, func, *args):
+    '''
+    One pass of the watch mode, run in a forked child so the watching process never starts
+    the implicit-MT thread pool and can fork the next passes safely.
+    '''
+    set_expression_cache(expressionCache)
+    return func(*args)
 
 #__________________________________________________________
-def runFinal(rdfModule):
+def loadWatchScript(script, setup, args):
+    '''
+    Load the final or plot script updated by the watch mode, with the default options of its command.
+    '''
+    import argparse
+    if not os.path.isfile(script):
+        print(f'----> Error: Script {script} not exist')
+        sys.exit(3)
+    parser = argparse.ArgumentParser()
+    setup(parser)
+    scriptArgs = parser.parse_args([os.path.abspath(script)])
+    scriptArgs.pathToAnalysisScript = os.path.abspath(script)
+    if setup == setup_run_parser_plots:
+        return loadScript(scriptArgs.pathToAnalysisScript), scriptArgs
+    scriptArgs.ncpus = args.ncpus
+    return loadRuntime(scriptArgs.pathToAnalysisScript, scriptArgs), scriptArgs
+
+#__________________________________________________________
+def watchStages(rdfModule, args):
+    '''
+    Keep the outputs of the stage up-to-date with the process directories of inputDir.
+    The files present at start are planned as usual, every file completed later is processed
+    into a new whole-file chunk; the final histograms (--watch-final) are updated by adding
+    the new partial results and the plots (--watch-plot) redrawn.
+    '''
+    if len(args.files) > 0:
+        print('----> Error: --watch follows the process directories of processList, --files can not be used')
+        sys.exit(3)
+    outputDir = stageOutputDir(rdfModule, args)
+    processList = getElement(rdfModule,"processList")
+    inputDir = getElement(rdfModule, "inputDir")
+    directories = {}
+    for process in processList:
+        d = '{}/{}'.format(getInputDir(inputDir), process)
+        if os.path.isdir(d):
+            directories[d] = process
+        else:
+            print(f'----> Warning: {process} is not a directory of inputDir, its inputs are not watched')
+    if not directories:
+        print('----> Error: No process directory to watch')
+        sys.exit(3)
+    watcher = DirectoryWatcher(directories, args.watch_interval, args.watch_settle)
+    stageCache = rdfwrap.expressionCache
+    # built once here, every forked pass inherits it
+    buildGeometry(rdfModule)
+
+    final = loadWatchScript(args.watch_final, setup_run_parser_final, args) if args.watch_final else None
+    if final:
+        buildGeometry(final[0])
+    finalCache = rdfwrap.expressionCache
+    plot = loadWatchScript(args.watch_plot, setup_run_parser_plots, args) if args.watch_plot else None
+
+    # files complete at the first watch of an output are its regular chunks
+    state = WatchState(outputDir)
+    cache = StageCache(outputDir)
+    for d, process in directories.items():
+        output = processOutput(processList, process)
+        if state.regular(output) is not None:
+            continue
+        state.start(output, [f for f in watcher.files() if os.path.dirname(f) == d and watcher.complete(f)])
+        # watched outputs are chunks in {output}/, move a single-file output there with its cache entry
+        single = f'{output}.root'
+        if os.path.isfile(os.path.join(outputDir, single)):
+            moved = f'{output}/chunk0.root'
+            os.makedirs(os.path.join(outputDir, output), exist_ok=True)
+            for src, dst in ((single, moved), (manifest_path(single), manifest_path(moved))):
+                if os.path.isfile(os.path.join(outputDir, src)):
+                    os.replace(os.path.join(outputDir, src), os.path.join(outputDir, dst))
+            entry = cache.outputs.pop(single, None)
+            if entry:
+                cache.record(moved, entry['digest'], [moved, manifest_path(moved)],
+                             **{k: v for k, v in entry.items() if k not in ('digest', 'files')})
+
+    print(f'----> Info: Watching the inputs of {len(directories)} processes, stop with Ctrl-C')
+    added = None
+    try:
+        while True:
+            if added is None or added:
+                try:
+                    run_forked(watchPass, stageCache, runStages, rdfModule, args)
+                    if final:
+                        run_forked(watchPass, finalCache, updateFinal, final[0], final[1], added or {})
+                    if plot:
+                        run_forked(runPlots, plot[0], plot[1])
+                except RuntimeError as e:
+                    print(f'----> Error: {e}, retried with the next files')
+                # later passes only rerun what changed
+                args.force = False
+                print(f'----> Info: Up-to-date at {time.strftime("%H:%M:%S")}, waiting for new files')
+
+            watcher.wait()
+            # complete new files, each process gets one new chunk
+            added = {}
+            state = WatchState(outputDir)
+            files = watcher.files()
+            for d, process in directories.items():
+                output = processOutput(processList, process)
+                known = state.assigned(output)
+                new = []
+                for f in files:
+                    if os.path.dirname(f) != d or f in known or not watcher.complete(f):
+                        continue
+                    try:
+                        scan_files([f])
+                    except Exception:
+                        rootLogger.debug(f'{f} can not be read yet')
+                        continue
+                    new.append(f)
+                if new:
+                    chunk = state.add(output, new)
+                    print(f'----> {len(new)} new files of {process}, processed into {chunk}')
+                    added.setdefault(output, []).append(os.path.join(outputDir, chunk))
+    except KeyboardInterrupt:
+        print('\n----> Info: Stopped watching')
+
+#__________________________________________________________
+def addHistoFile(target, partial, tmpFile):
+    '''
+    Write to tmpFile the histograms of target with those of the same name in partial added.
+    '''
+    fold = ROOT.TFile.Open(target, 'READ')
+    fadd = ROOT.TFile.Open(partial, 'READ')
+    fout = ROOT.TFile.Open(tmpFile, 'RECREATE')
+    names = [key.GetName() for key in fold.GetListOfKeys()]
+    names += [key.GetName() for key in fadd.GetListOfKeys() if key.GetName() not in names]
+    for name in names:
+        h = fold.Get(name)
+        p = fadd.Get(name)
+        if h and p:
+            h.Add(p)
+        fout.cd()
+        (h if h else p).Write(name)
+    fout.Close()
+    fadd.Close()
+    fold.Close()
+    return names
+
+#__________________________________________________________
+def updateFinal(rdfModule, args, added):
+    '''
+    Update the final outputs after the watch mode added stage outputs ({process: files}).
+    A process whose outputs were up-to-date with its other inputs only runs over the added
+    files, its histograms and counts are added to the existing ones. The others, and all of
+    them when trees or skims are saved, are rerun by runFinal.
+    '''
+    inputDir = get_io_directory(getElement(rdfModule,"inputDir", False))
+    outputDir = get_io_directory(getElement(rdfModule,"outputDir"))
+    cutList = getElement(rdfModule,"cutList", True)
+    incremental = not getElement(rdfModule,"saveCutTree", True) and not getElement(rdfModule,"saveCutSkim", True)
+
+    cache = StageCache(outputDir)
+    partial = {}
+    for pr in getElement(rdfModule,"processList"):
+        new = set(os.path.abspath(f) for f in added.get(pr, []))
+        files = getFinalFiles(pr, inputDir)
+        old = [f for f in files if os.path.abspath(f) not in new]
+        if not incremental or not new or len(old) == len(files):
+            continue
+        entry = cache.lookup(pr, output_key(args.runtimeKey, old))
+        if entry:
+            partial[pr] = (entry, files, [f for f in files if os.path.abspath(f) in new])
+
+    if partial:
+        getWorkers(rdfModule, args, 1)
+        tmpDir = tempfile.mkdtemp(prefix='.partial_', dir=outputDir)
+        try:
+            results = runFinalProcesses(rdfModule, {pr: partial[pr][2] for pr in partial}, tmpDir, args)
+            for pr, (entry, files, new) in partial.items():
+                result = results[pr]
+                counts = [a + b for a, b in zip(entry['counts'], result['counts'])]
+                for i, cut in enumerate(cutList):
+                    fhisto = f'{outputDir}/{pr}_{cut}_histo.root'
+                    tmpFile = temporary_path(fhisto)
+                    names = addHistoFile(fhisto, f'{tmpDir}/{pr}_{cut}_histo.root', tmpFile)
+                    data = dict(read_manifest(fhisto) or {}, sources=[os.path.abspath(f) for f in files],
+                                keys=names, count=counts[i])
+                    write_manifest(fhisto, data, tmpFile)
+                    commit_path(tmpFile, fhisto)
+                merged = {'all': entry['all'] + result['all'], 'counts': counts, 'files': entry['files']}
+                if entry.get('cutflow') and result.get('cutflow'):
+                    merged['cutflow'] = [[name, n1 + n2, a1 + a2] for (name, n1, a1), (_, n2, a2)
+                                         in zip(entry['cutflow'], result['cutflow'])]
+                recordFinal(cache, pr, output_key(args.runtimeKey, files), merged)
+                print(f'----> Process {pr} updated with {len(new)} new files')
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+
+    runFinal(rdfModule, args)
+
+#__________________________________________________________
+def bookHistos(df_cut, histoList):
+    '''
+    Book the histograms of histoList on a filtered dataframe.
+    '''
+    histos = []
+    for v in histoList:
+        if "variable" in histoList[v]: # default 1D histogram
+            model = ROOT.RDF.TH1DModel(v, ";{};".format(histoList[v]["title"]), histoList[v]["bin"], histoList[v]["xmin"], histoList[v]["xmax"])
+            histos.append(df_cut.Histo1D(model,histoList[v]["variable"]))
+        elif "cols" in histoList[v]: # multi dim histogram (1, 2 or 3D)
+            cols = histoList[v]['cols']
+            bins = histoList[v]['bins']
+            bins_unpacked = tuple([i for sub in bins for i in sub])
+            if len(bins) != len(cols):
+                print ('----> Amount of columns should be equal to the amount of bin configs.')
+                sys.exit(3)
+            if len(cols) == 1:
+                histos.append(df_cut.Histo1D((v, "", *bins_unpacked), cols[0]))
+            elif len(cols) == 2:
+                histos.append(df_cut.Histo2D((v, "", *bins_unpacked), cols[0], cols[1]))
+            elif len(cols) == 3:
+                histos.append(df_cut.Histo3D((v, "", *bins_unpacked), cols[0], cols[1], cols[2]))
+            else:
+                print ('----> Only 1, 2 or 3D histograms supported.')
+                sys.exit(3)
+        else:
+            print ('----> Error parsing the histogram config. Provide either name or cols.')
+            sys.exit(3)
+    return histos
+
+#__________________________________________________________
+def varyColumns(df, variationList, columns):
+    '''
+    Register the systematic variations of variationList acting on columns.
+    A variation is either {'column': c, 'exprs': {tag: expression, ...}} with one expression per tag,
+    or {'column': c (or 'columns': [...]), 'expr': expression returning the values of all tags, 'tags': [...]}.
+    '''
+    for name, var in variationList.items():
+        cols = var['columns'] if 'columns' in var else [var['column']]
+        if not set(cols) & set(columns):
+            continue
+        if 'exprs' in var:
+            ctype = str(unwrap_node(df).GetColumnType(cols[0]))
+            tags = list(var['exprs'])
+            expr = 'ROOT::RVec<{}>{{{}}}'.format(ctype, ', '.join(f'({e})' for e in var['exprs'].values()))
+        else:
+            tags, expr = list(var['tags']), var['expr']
+        df = df.Vary(cols[0] if len(cols) == 1 else cols, expr, tags, name)
+    return df
+
+#__________________________________________________________
+def bookFinal(fileList, defineList, cutList, histoList, saveCutTree, saveCutSkim, cutChain, variationList, outPrefix):
+    '''
+    Book defines, filters, counts, histograms, snapshots and skims of one process without running the event loop.
+    With cutChain each cut filters the survivors of the previous one and the cutflow report is booked.
+    The histograms of every systematic variation of variationList are booked in the same event loop.
+    Return the booked results and the list of handles to be triggered by RunGraphs.
+    '''
+    # friend outputs of the stages are attached to their parent files
+    infos = scan_files(fileList)
+    ranges = full_ranges(fileList, infos)
+    if any(info.get('format') == 'skim' for info in infos):
+        # a skim of an earlier final pass, only its entries are read
+        if len(fileList) != 1:
+            print('----> Error: a process can be read from one skim file only: {}'.format(fileList))
+            sys.exit(3)
+        df = wrap_node(skim_dataframe(fileList[0]))
+    elif ranges:
+        df = wrap_node(make_dataframe(ranges))
+    else:
+        fileListRoot = ROOT.vector('string')()
+        for f in fileList:
+            fileListRoot.push_back(f)
+        df = wrap_node(ROOT.ROOT.RDataFrame("events", fileListRoot))
+    root = df
+
+    # variations of the input columns, before the defines using them
+    if len(variationList)>0:
+        if not hasattr(ROOT.RDF.Experimental, 'VariationsFor'):
+            print ('----> Error: systematic variations need ROOT >= 6.26')
+            sys.exit(3)
+        print ('----> Registering {} systematic variations'.format(len(variationList)))
+        inputs = set(str(c) for c in df.GetColumnNames()) - set(defineList)
+        df=varyColumns(df, variationList, inputs)
+
+    # Define some new columns
+    if len(defineList)>0:
+        print ('----> Running extra Define')
+        for define in defineList:
+            df=df.Define(define, defineList[define])
+            df=varyColumns(df, variationList, [define])
+
+    # Create all histos, snapshots, etc...
+    booked = {'root': root, 'df': df, 'all': df.Count(), 'counts': [], 'histos': [], 'snapshots': [], 'snapshotFiles': [],
+              'skims': [], 'skimFiles': [], 'report': None, 'variations': []}
+
+    print ('----> Defining snapshots and histograms for each cut')
+    df_cut = df
+    for cut in cutList:
+        if cutChain:
+            # named filters, counted by Report()
+            df_cut = df_cut.Filter(cutList[cut], cut)
+        else:
+            df_cut = df.Filter(cutList[cut])
+        booked['counts'].append(df_cut.Count())
+        booked['histos'].append(bookHistos(df_cut, histoList))
+        if len(variationList)>0:
+            booked['variations'].append([ROOT.RDF.Experimental.VariationsFor(h) for h in booked['histos'][-1]])
+
+        # save the filtered input tree
+        if saveCutTree:
+            opts = ROOT.RDF.RSnapshotOptions()
+            opts.fLazy = True
+            fout = f'{outPrefix}_{cut}.root'
+            # Needed to avoid python garbage collector messing around with the snapshot
+            booked['snapshots'].append(df_cut.Snapshot("events", temporary_path(fout), "", opts))
+            booked['snapshotFiles'].append(fout)
+
+        # save only the numbers of the passing entries
+        if saveCutSkim:
+            booked['skims'].append(book_skim(unwrap_node(df_cut)))
+            booked['skimFiles'].append(f'{outPrefix}_{cut}_skim.root')
+
+    if cutChain and len(cutList)>0:
+        booked['report'] = df_cut.Report()
+
+    booked['handles'] = [booked['all']] + booked['counts'] + booked['snapshots'] + booked['skims']
+    if booked['report']:
+        booked['handles'].append(booked['report'])
+    for histos in booked['histos']:
+        booked['handles'] += histos
+    return booked
+
+#__________________________________________________________
+def runFinalProcesses(rdfModule, processFiles, outputDir, args):
+    '''
+    Book every process of processFiles ({process: files}), trigger all of them in one
+    RunGraphs pass so they share the thread pool, and write the outputs atomically.
+    Return {process: {'all', 'counts', 'files'}}.
+    '''
+    cutList = getElement(rdfModule,"cutList", True)
+    histoList = getElement(rdfModule,"histoList", True)
+    saveCutTree = getElement(rdfModule,"saveCutTree", True)
+    saveCutSkim = getElement(rdfModule,"saveCutSkim", True)
+    ROOT.ROOT.EnableImplicitMT(args.ncpus)
+    cutChain = getElement(rdfModule,"cutChain", True)
+    variationList = getElement(rdfModule,"variationList", True)
+    defineList = getElement(rdfModule,"defineList", True)
+
+    booked = {}
+    for pr in processFiles:
+        print ('\n---->  Booking process : ',pr)
+        booked[pr] = bookFinal(processFiles[pr], defineList, cutList, histoList, saveCutTree, False, cutChain, variationList, f'{outputDir}/{pr}')
+        if rdfwrap.profiler:
+            booked[pr]['probes'] = rdfwrap.profiler.take()
+
+    # trigger the event loops of all processes together
+    print ('\n----> Evaluating {} processes in one pass...'.format(len(booked)))
+    handles = []
+    for pr in booked:
+        handles += booked[pr]['handles']
+    ROOT.RDF.RunGraphs(handles)
+
+    # the skims are global entry numbers of the inputs, only a sequential event loop gives them:
+    # a second pass over the defines and cuts only, everything else kept implicit MT
+    if saveCutSkim:
+        print ('----> Collecting the entries of the skims in a sequential pass...')
+        ROOT.ROOT.DisableImplicitMT()
+        handles = []
+        for pr in booked:
+            skims = bookFinal(processFiles[pr], defineList, cutList, {}, False, True, cutChain, {}, f'{outputDir}/{pr}')
+            booked[pr]['skims'], booked[pr]['skimFiles'] = skims['skims'], skims['skimFiles']
+            handles += skims['skims']
+        ROOT.RDF.RunGraphs(handles)
+        ROOT.ROOT.EnableImplicitMT(args.ncpus)
+    record_expressions()
+    print ('----> Done')
+
+    if rdfwrap.profiler:
+        for pr in booked:
+            rdfwrap.profiler.report(booked[pr]['probes'], booked[pr]['root'], f'{outputDir}/{pr}_profile')
+
+    scriptDigest = file_digest(args.pathToAnalysisScript)
+    results = {}
+    for pr in booked:
+        # Write the histos into output root file
+        print ('----> Saving outputs of process : ',pr)
+        files = []
+        infos = scan_files(processFiles[pr])
+        eventsProcessed = sum(info['eventsProcessed'] or 0 for info in infos) or None
+
+        # manifest of each output, written before the rename like the stage outputs
+        def commit(fout, tmpFile, **data):
+            write_manifest(fout, dict(data, sources=[os.path.abspath(f) for f in processFiles[pr]], process=pr,
+                                      script=scriptDigest, runtime=args.runtimeKey), tmpFile)
+            commit_path(tmpFile, fout)
+            files.append(os.path.basename(fout))
+            files.append(manifest_path(os.path.basename(fout)))
+
+        for i, cut in enumerate(cutList):
+            fhisto = f'{outputDir}/{pr}_{cut}_histo.root'
+            tmpFile = temporary_path(fhisto)
+            tf    = ROOT.TFile.Open(tmpFile,'RECREATE')
+            names = []
+            for h in booked[pr]['histos'][i]:
+                h.Write()
+                names.append(h.GetName())
+            # varied histograms named {histo}__{variation}__{tag}, read by ana_plot
+            for h, varied in zip(booked[pr]['histos'][i], booked[pr]['variations'][i] if booked[pr]['variations'] else []):
+                for key in varied.GetKeys():
+                    if str(key) == 'nominal':
+                        continue
+                    name, tag = str(key).split(':', 1)
+                    varied[key].Write(variation_name(h.GetName(), name, tag))
+                    names.append(variation_name(h.GetName(), name, tag))
+            tf.Close()
+            commit(fhisto, tmpFile, format='histograms', entries=0, trees=[], keys=names, selection=cut,
+                   count=booked[pr]['counts'][i].GetValue())
+        for i, fout in enumerate(booked[pr]['snapshotFiles']):
+            tmpFile = temporary_path(fout)
+            keys = ['events']
+            if eventsProcessed is not None:
+                outf = ROOT.TFile(tmpFile, "update")
+                ROOT.TParameter(int)("eventsProcessed", int(eventsProcessed)).Write()
+                outf.Close()
+                keys.append('eventsProcessed')
+            commit(fout, tmpFile, format='ttree', entries=booked[pr]['counts'][i].GetValue(),
+                   eventsProcessed=eventsProcessed, trees=['events'], keys=keys)
+        for i, (skim, fout) in enumerate(zip(booked[pr]['skims'], booked[pr]['skimFiles'])):
+            tmpFile = temporary_path(fout)
+            n = write_skim(tmpFile, processFiles[pr], skim.GetValue(), eventsProcessed)
+            if n != booked[pr]['counts'][i].GetValue():
+                os.remove(tmpFile)
+                raise RuntimeError(f'Skim {fout} has {n} entries, {booked[pr]["counts"][i].GetValue()} events pass the cut')
+            commit(fout, tmpFile, format='skim', entries=n, eventsProcessed=eventsProcessed, trees=[],
+                   keys=['skim', 'skimInputs', 'eventsProcessed'])
+        results[pr] = {'all': booked[pr]['all'].GetValue(),
+                       'counts': [c.GetValue() for c in booked[pr]['counts']],
+                       'files': files}
+        if booked[pr]['report']:
+            results[pr]['cutflow'] = [[c.GetName(), c.GetPass(), c.GetAll()] for c in booked[pr]['report'].GetValue()]
+    return results
+
+#__________________________________________________________
+def getFinalFiles(pr, inputDir):
+    '''
+    Input files of a final process: {inputDir}/{pr}.root and/or the chunks in {inputDir}/{pr}/.
+    '''
+    # check if it's file
+    fin  = f'{inputDir}/{pr}.root'
+    flist = []
+    if not os.path.isfile(fin):
+        print ('----> file ',fin,'  does not exist. Try if it is a directory as it was processed with batch')
+    else:
+        print ('----> open file ',fin)
+        flist.append(fin)
+
+    # check if it's directory
+    fin  = f'{inputDir}/{pr}'
+    if os.path.isdir(fin):
+        print ('----> open directory ',fin)
+        flist+=sorted(glob.glob(f'{fin}/chunk*.root'))
+    return flist
+
+#__________________________________________________________
+def recordFinal(cache, pr, digest, result):
+    '''
+    Record the outputs and counts of a final process in the cache of the output directory.
+    '''
+    cache.record(pr, digest, result['files'], all=result['all'], counts=result['counts'],
+                 cutflow=result.get('cutflow'))
+
+#__________________________________________________________
+def runFinal(rdfModule, args):
     '''
     Run the analysis script for simple defining, filtering and histogramming.
     Generate an output root file for every cut specification of each input process.
     The output file contains the specified histograms and optionally the filtered tree.
+    Processes whose inputs, script, libraries and geometry are unchanged are not rerun.
     '''
-    ROOT.ROOT.EnableImplicitMT(getElement(rdfModule,"nCPUS", True))
-
-    #
     start_time = time.time()
     nevents_real=0
     processEvents={}
     eventsTTree={}
-    processList={}
+    processFiles={}
     saveTab=[]
     efficiencyList=[]
 
@@ -411,145 +1233,75 @@ def runFinal(rdfModule):
     for pr in getElement(rdfModule,"processList"):
         processEvents[pr]=0
         eventsTTree[pr]=0
-        fileListRoot = ROOT.vector('string')()
 
-        # check if it's file
-        fin  = f'{inputDir}/{pr}.root'
-        if not os.path.isfile(fin):
-            print ('----> file ',fin,'  does not exist. Try if it is a directory as it was processed with batch')
-        else:
-            print ('----> open file ',fin)
-            tfin = ROOT.TFile.Open(fin)
-            tfin.cd()
-            found=False
-            for key in tfin.GetListOfKeys():
-                if 'eventsProcessed' == key.GetName():
-                    events = tfin.eventsProcessed.GetVal()
-                    processEvents[pr]=events
-                    found=True
-            if not found:
-                processEvents[pr]=1
-            tt=tfin.Get("events")
-            eventsTTree[pr]=tt.GetEntries()
-            tfin.Close()
-            fileListRoot.push_back(fin)
-
-        # check if it's directory
-        fin  = f'{inputDir}/{pr}'
-        if os.path.isdir(fin):
-            print ('----> open directory ',fin)
-            flist=glob.glob(f'{fin}/chunk*.root')
-            for f in flist:
-                tfin = ROOT.TFile.Open(f)
-                print ('  ----> ',f)
-                tfin.cd()
-                found=False
-                for key in tfin.GetListOfKeys():
-                    if 'eventsProcessed' == key.GetName():
-                        events = tfin.eventsProcessed.GetVal()
-                        processEvents[pr]+=events
-                        found=True
-                if not found:
-                    processEvents[pr]=1
-                tt=tfin.Get("events")
-                eventsTTree[pr]+=tt.GetEntries()
-                tfin.Close()
-                fileListRoot.push_back(f)
+        flist = getFinalFiles(pr, inputDir)
+
+        # bookkeeping from the directory index instead of opening each file
+        for f, info in zip(flist, scan_files(flist)):
+            print ('  ----> ',f)
+            if info['eventsProcessed'] is None:
+                print(f'----> Error: {f} has no eventsProcessed, the processed events of {pr} are unknown')
+                print('      Inputs of mgana final are outputs of mgana run, rerun the stage with --force')
+                sys.exit(3)
+            processEvents[pr]+=info['eventsProcessed']
+            eventsTTree[pr]+=info['entries']
 
         # append
-        processList[pr]=fileListRoot
+        processFiles[pr]=flist
 
     print('processed events ',processEvents)
     print('events in ttree  ',eventsTTree)
 
-    # run the rdf for each process and each cut
-    histoList = getElement(rdfModule,"histoList", True)
-    saveCutTree = getElement(rdfModule,"saveCutTree", True)
+    # only processes with changed inputs, script, libraries or geometry are rerun
+    cache = StageCache(outputDir)
+    results = {}
+    digests = {}
+    stale = {}
+    for pr in getElement(rdfModule,"processList"):
+        digests[pr] = output_key(args.runtimeKey, processFiles[pr])
+        entry = None if args.force else cache.lookup(pr, digests[pr])
+        if entry:
+            print ('----> Process {} is up-to-date, skip'.format(pr))
+            results[pr] = entry
+        else:
+            stale[pr] = processFiles[pr]
+
+    def onDone(index, partial):
+        for pr in partial:
+            results[pr] = partial[pr]
+            recordFinal(cache, pr, digests[pr], partial[pr])
+
+    # book all stale processes in one pass, or partition them between distributed workers
+    if len(stale)>0:
+        if args.executor == 'dask':
+            workers = getWorkers(rdfModule, args, len(stale))
+            names = list(stale)
+            groups = [{pr: stale[pr] for pr in names[i::workers]} for i in range(workers)]
+            remote = [(args.pathToAnalysisScript, os.getcwd(), 'final', g, outputDir, args) for g in groups if g]
+            run_tasks_dask(remoteTask, remote, workers, [','.join(g[3]) for g in remote], onDone, args.scheduler_address)
+        else:
+            getWorkers(rdfModule, args, 1)
+            onDone(0, runFinalProcesses(rdfModule, stale, outputDir, args))
+        compile_expressions()
+    nevents_real = sum(results[pr]['all'] for pr in stale)
 
     for pr in getElement(rdfModule,"processList"):
-        print ('\n---->  Running over process : ',pr)
-        RDF = ROOT.ROOT.RDataFrame
-        df  = RDF("events", processList[pr])
-
-        # Define some new columns
-        defineList = getElement(rdfModule,"defineList", True)
-        if len(defineList)>0:
-            print ('----> Running extra Define')
-            for define in defineList:
-                df=df.Define(define, defineList[define])
-
-        # Create all histos, snapshots, etc...
-        fout_list = []
-        histos_list = []
-        tdf_list = []
-        count_list = []
+        all_events = results[pr]['all']
+        count_list = results[pr]['counts']
         cuts_list = []
         cuts_list.append(pr)
         eff_list=[]
         eff_list.append(pr)
 
-        print ('----> Defining snapshots and histograms for each cut')
-        for cut in cutList:
-            df_cut = df.Filter(cutList[cut])
-            count_list.append(df_cut.Count())
-
-            # define the histos
-            histos = []
-            for v in histoList:
-                if "variable" in histoList[v]: # default 1D histogram
-                    model = ROOT.RDF.TH1DModel(v, ";{};".format(histoList[v]["title"]), histoList[v]["bin"], histoList[v]["xmin"], histoList[v]["xmax"])
-                    histos.append(df_cut.Histo1D(model,histoList[v]["variable"]))
-                elif "cols" in histoList[v]: # multi dim histogram (1, 2 or 3D)
-                    cols = histoList[v]['cols']
-                    bins = histoList[v]['bins']
-                    bins_unpacked = tuple([i for sub in bins for i in sub])
-                    if len(bins) != len(cols):
-                        print ('----> Amount of columns should be equal to the amount of bin configs.')
-                        sys.exit(3)
-                    if len(cols) == 1:
-                        histos.append(df_cut.Histo1D((v, "", *bins_unpacked), cols[0]))
-                    elif len(cols) == 2:
-                        histos.append(df_cut.Histo2D((v, "", *bins_unpacked), cols[0], cols[1]))
-                    elif len(cols) == 3:
-                        histos.append(df_cut.Histo3D((v, "", *bins_unpacked), cols[0], cols[1], cols[2]))
-                    else:
-                        print ('----> Only 1, 2 or 3D histograms supported.')
-                        sys.exit(3)
-                else:
-                    print ('----> Error parsing the histogram config. Provide either name or cols.')
-                    sys.exit(3)
-            histos_list.append(histos)
-
-            # save the filtered input tree
-            fout = f'{outputDir}/{pr}_{cut}.root'
-            fout_list.append(fout)
-
-            if saveCutTree:
-                opts = ROOT.RDF.RSnapshotOptions()
-                opts.fLazy = True
-                snapshot_tdf = df_cut.Snapshot("events", fout, "", opts)
-                # Needed to avoid python garbage collector messing around with the snapshot
-                tdf_list.append(snapshot_tdf)
-
-        # Now perform the loop and evaluate everything at once.
-        print ('----> Evaluating...')
-        all_events = df.Count().GetValue()
-        print ('----> Done')
-
-        nevents_real += all_events
         uncertainty = ROOT.Math.sqrt(all_events)
 
-        print ('----> Cutflow')
+        print ('\n----> Cutflow of process : ',pr)
         print ('       {cutname:{width}} : {nevents}'.format(cutname='All events', width=16+length_cuts_names, nevents=all_events))
-
-        # Write the histos into output root file
-        print ('----> Saving outputs')
-        for i, cut in enumerate(cutList):
-            fhisto = f'{outputDir}/{pr}_{cut}_histo.root'
-            tf    = ROOT.TFile.Open(fhisto,'RECREATE')
-            for h in histos_list[i]:
-                h.Write()
-            tf.Close()
+        # cumulative cutflow of the chained cuts, from Report()
+        for name, npass, nall in results[pr].get('cutflow') or []:
+            print ('       {cutname:{width}} : {npass:>12} / {nall:<12} eff = {eff:.4f}  cumulative = {cum:.4f}'.format(
+                cutname=name, width=16+length_cuts_names, npass=npass, nall=nall,
+                eff=npass/nall if nall else 0., cum=npass/all_events if all_events else 0.))
 
         # append to tex tabular
         if saveTabular:
@@ -558,7 +1310,7 @@ def runFinal(rdfModule):
             eff_list.append(1.) #start with 100% efficiency
 
         for i, cut in enumerate(cutList):
-            neventsThisCut = count_list[i].GetValue()
+            neventsThisCut = count_list[i]
             neventsThisCut_raw = neventsThisCut
             uncertainty = ROOT.Math.sqrt(neventsThisCut_raw)
 
@@ -620,49 +1372,34 @@ def runFinal(rdfModule):
     print  ('===================================================================')
 
 #__________________________________________________________
-def runPlots(param):
+def runPlots(param, args):
     from .ana_plot import ana_plot
-    ana_plot(param)
+    ana_plot(param, args.jobs, args.force)
 
 #__________________________________________________________
-def setup_run_parser(parser):
-    publicOptions = parser.add_argument_group('User options')
-    publicOptions.add_argument("pathToAnalysisScript", help="path to analysis script")
-    publicOptions.add_argument("--loglevel", help="Specify the RDataFrame ELogLevel", type=str, default="kUnset", choices = ['kUnset','kFatal','kError','kWarning','kInfo','kDebug'])
-    publicOptions.add_argument("--files", help="Specify input file to bypass the processList", default=[], nargs='+')
-    publicOptions.add_argument("--output", help="Specify output file name to bypass the processList and or outputList, default output.root", type=str, default="output.root")
-    publicOptions.add_argument("--nevents", help="Specify max number of events to process", type=int, default=-1)
-    publicOptions.add_argument('--bench', action='store_true', help='Output benchmark results to a JSON file')
-    publicOptions.add_argument("--ncpus", help="Set number of threads", type=int)
-    #publicOptions.add_argument("--final", action='store_true', help="Run final analysis (produces final histograms and trees)")
-    #publicOptions.add_argument("--plots", action='store_true', help="Run analysis plots")
-
-def setup_run_parser_final(parser):
-    publicOptions = parser.add_argument_group('User final options')
-    publicOptions.add_argument("pathToAnalysisScript", help="path to analysis_final script")
-    publicOptions.add_argument("--loglevel", help="Specify the RDataFrame ELogLevel", type=str, default="kUnset", choices = ['kUnset','kFatal','kError','kWarning','kInfo','kDebug'])
-
-def setup_run_parser_plots(parser):
-    publicOptions = parser.add_argument_group('User plots options')
-    publicOptions.add_argument("pathToAnalysisScript", help="path to analysis_plots script")
+def loadScript(analysisFile):
+    """
+    Import an analysis script as the module 'rdfanalysis'.
+    """
+    rdfSpec   = importlib.util.spec_from_file_location("rdfanalysis", analysisFile)
+    rdfModule = importlib.util.module_from_spec(rdfSpec)
+    rdfSpec.loader.exec_module(rdfModule)
+    return rdfModule
 
 #__________________________________________________________
-def run_analysis(mainparser):
+def loadRuntime(analysisFile, args):
     """
-    Set things in motion.
+    Load the MegatAnalyzer runtime, the analysis script, its analyzer packages and geometry.
+    Return the loaded analysis module.
     """
-    args, _ = mainparser.parse_known_args()
-    analysisFile = args.pathToAnalysisScript
-    if not os.path.isfile(analysisFile):
-        rootLogger.error(f'Script {analysisFile} not exist')
-        sys.exit(3)
-
-    #
     print ("----> Info: Loading MegatAnalyzer Runtime... ",)
-    ROOT.gSystem.Load("libMegatAnalysis")
-    ROOT.gErrorIgnoreLevel = ROOT.kFatal
-    # force auto-loading [todo: ugly as a hack]
-    ROOT.LoadMegat()
+    import megat
+    with startupTimer.phase('libMegatAnalysis'):
+        ROOT.gSystem.Load("libMegatAnalysis")
+        ROOT.gErrorIgnoreLevel = ROOT.kFatal
+    with startupTimer.phase('LoadMegat'):
+        # force auto-loading [todo: ugly as a hack]
+        ROOT.LoadMegat()
 
     # set the RDF ELogLevel
     try:
@@ -675,75 +1412,173 @@ def run_analysis(mainparser):
     print('----> Info: Loading analysis file:')
     print('      ' + analysisFile)
 
-    rdfSpec   = importlib.util.spec_from_file_location("rdfanalysis", analysisFile)
-    rdfModule = importlib.util.module_from_spec(rdfSpec)
-    rdfSpec.loader.exec_module(rdfModule)
+    with startupTimer.phase('analysis script'):
+        rdfModule = loadScript(analysisFile)
 
     # load current pkg and dependency pkgs
     libPath = mgana_lib_path()
     analysesList = getElement(rdfModule, "analysesList")
-    if analysesList and len(analysesList) > 0:
-        _ana = []
-        for analysis in analysesList:
-            print(f'----> Info: Loading analyzer package {analysis}...')
-            if analysis.startswith('libMegatAnalyzer_'):
-                ROOT.gSystem.Load(os.path.join(libPath, analysis))
-            else:
-                ROOT.gSystem.Load(os.path.join(libPath, f'libMegatAnalyzer_{analysis}'))
-            if not hasattr(ROOT, analysis):
-                rootLogger.error(f'----> ERROR: analysis "{analysis}" not properly loaded. Exit')
-                sys.exit(4)
-            # todo: ugly hack to auto-load dictionary
-            _ana.append(getattr(ROOT, analysis).dictionary)
-
-    # for convenience
-    ROOT.gInterpreter.Declare("using namespace megat;")
-    ROOT.gInterpreter.Declare("using namespace ROOT;")
-    ROOT.gInterpreter.Declare("using namespace ROOT::VecOps;")
-
-    # load geometry (the 'default' one)
+    libraryFiles = [ROOT.gSystem.DynamicPathName("libMegatAnalysis", True)]
+    with startupTimer.phase('analyzer packages'):
+        if analysesList and len(analysesList) > 0:
+            _ana = []
+            for analysis in analysesList:
+                print(f'----> Info: Loading analyzer package {analysis}...')
+                if analysis.startswith('libMegatAnalyzer_'):
+                    libName = os.path.join(libPath, analysis)
+                else:
+                    libName = os.path.join(libPath, f'libMegatAnalyzer_{analysis}')
+                ROOT.gSystem.Load(libName)
+                libraryFiles.append(ROOT.gSystem.DynamicPathName(libName, True))
+                if not hasattr(ROOT, analysis):
+                    rootLogger.error(f'----> ERROR: analysis "{analysis}" not properly loaded. Exit')
+                    sys.exit(4)
+                # todo: ugly hack to auto-load dictionary
+                _ana.append(getattr(ROOT, analysis).dictionary)
+
+    with startupTimer.phase('declarations'):
+        # for convenience
+        ROOT.gInterpreter.Declare("using namespace megat;")
+        ROOT.gInterpreter.Declare("using namespace ROOT;")
+        ROOT.gInterpreter.Declare("using namespace ROOT::VecOps;")
+
+    # Python functions of the script, compiled with numba and callable as Numba::<name>
+    with startupTimer.phase('python functions'):
+        npyfunc = declare_functions()
+        if npyfunc:
+            print(f'----> Info: {npyfunc} Python functions declared in namespace Numba')
+
+    # register geometry (the 'default' one), it is only built when the first
+    # IdConverter/CellPosition of its tag is created or megat.requireGeometry(tag) is called
     geometryFile = getElement(rdfModule, "geometryFile")
     geomFileList = ROOT.vector('string')()
-    if geometryFile:
-        for geofile in geometryFile:
-            realfile = geofile if is_absolute_path(geofile) else os.path.join(megat_geometry_path(), geofile)
-            geomFileList.push_back(realfile)
-        # load default geometry, with default readout specification
-        megat.loadGeometry(geomFileList)
-
-    # load extra geometry for each separate readout specification of TPC
-    readoutName  = getElement(rdfModule, "readoutName")
-    readoutList = ROOT.vector('string')()
-    if readoutName:
-        for ro in readoutName:
-            # readout name is the tag of this geometry
-            megat.loadGeometry(geomFileList, ro, ro, "TPC")
-            readoutList.push_back(ro)
+    with startupTimer.phase('geometry'):
+        if geometryFile:
+            for realfile in geometryFiles(rdfModule):
+                geomFileList.push_back(realfile)
+            # default geometry, with default readout specification
+            megat.registerGeometry(geomFileList)
+
+        # extra geometry for each separate readout specification of TPC
+        readoutName  = getElement(rdfModule, "readoutName")
+        if readoutName:
+            for ro in readoutName:
+                # readout name is the tag of this geometry
+                megat.registerGeometry(geomFileList, ro, ro, "TPC")
+
+    # everything the outputs depend on besides their inputs, used by the stage cache
+    libraryFiles = [str(l) for l in libraryFiles if l]
+    args.runtimeKey = runtime_key(analysisFile, libraryFiles, [str(g) for g in geomFileList])
+
+    # compiled string expressions of this script, libraries and geometry
+    if not getattr(args, 'no_jit_cache', True):
+        with startupTimer.phase('expression cache'):
+            set_expression_cache(ExpressionCache(args.runtimeKey, library_headers(libraryFiles)))
+
+    if getattr(args, 'profile', False):
+        set_profiler(Profiler())
+
+    startupTimer.report('Startup time')
+    return rdfModule
+
+#__________________________________________________________
+def geometryFiles(rdfModule):
+    """
+    Compact files of the geometryFile of the script, relative ones are taken from the megat geometry directory.
+    """
+    return [geofile if is_absolute_path(geofile) else os.path.join(megat_geometry_path(), geofile)
+            for geofile in getElement(rdfModule, "geometryFile") or []]
+
+#__________________________________________________________
+def buildGeometry(rdfModule):
+    """
+    Build the registered geometries of the script (the 'default' one and one per readoutName),
+    so processes forked afterwards inherit them instead of each building its own copy.
+    """
+    if not getElement(rdfModule, "geometryFile"):
+        return
+    import megat
+    tags = ['default'] + list(getElement(rdfModule, "readoutName") or [])
+    with startupTimer.phase('geometry build'):
+        for tag in tags:
+            megat.requireGeometry(tag)
+    rootLogger.debug(f'Geometry {", ".join(tags)} built')
+
+# runtime loaded by a distributed worker process
+_remoteRuntime = {}
+
+#__________________________________________________________
+def remoteTask(analysisFile, workDir, command, *payload):
+    """
+    Entry point of a task on a distributed worker.
+    The runtime is loaded once per worker process, the last item of payload is the args namespace.
+    """
+    if _remoteRuntime.get('script') != analysisFile:
+        os.chdir(workDir)
+        _remoteRuntime['module'] = loadRuntime(analysisFile, copy.copy(payload[-1]))
+        buildGeometry(_remoteRuntime['module'])
+        _remoteRuntime['script'] = analysisFile
+    rdfModule = _remoteRuntime['module']
+    if command == 'run':
+        return runLocal(rdfModule, *payload)
+    elif command == 'final':
+        return runFinalProcesses(rdfModule, *payload)
+    raise ValueError(f'Unknown remote command {command}')
+
+#__________________________________________________________
+def run_analysis(mainparser):
+    """
+    Set things in motion.
+    """
+    args, _ = mainparser.parse_known_args()
+    analysisFile = args.pathToAnalysisScript
+    if not os.path.isfile(analysisFile):
+        rootLogger.error(f'Script {analysisFile} not exist')
+        sys.exit(3)
+
+    analysisFile = os.path.abspath(analysisFile)
+    args.pathToAnalysisScript = analysisFile
+    # plots only need the histograms, not the analyzer runtime nor the geometry
+    if getattr(args, 'command', None) == 'plot':
+        rdfModule = loadScript(analysisFile)
+    else:
+        rdfModule = loadRuntime(analysisFile, args)
 
     # execute specific command
     if hasattr(args, 'command'):
         if args.command == "run":
             try:
-                runStages(rdfModule, args)
+                if args.watch:
+                    watchStages(rdfModule, args)
+                else:
+                    runStages(rdfModule, args)
             except Exception as excp:
                 print('----> Error: During the execution of the stage file:')
                 print('      ' + analysisFile)
                 print('      exception occurred:')
                 print(excp)
+                sys.exit(3)
         elif args.command == "final":
             try:
-                runFinal(rdfModule)
+                runFinal(rdfModule, args)
             except Exception as excp:
                 print('----> Error: During the execution of the final stage file:')
                 print('      ' + analysisFile)
                 print('      exception occurred:')
                 print(excp)
+                sys.exit(3)
         elif args.command == "plot":
             try:
-                runPlots(rdfModule)
+                runPlots(rdfModule, args)
             except Exception as excp:
                 print('----> Error: During the execution of the plots file:')
                 print('      ' + analysisFile)
                 print('      exception occurred:')
                 print(excp)
-        return
+                sys.exit(3)
+
+    # I/O counters requested by mgana bench
+    if os.getenv('MGANA_IO_REPORT'):
+        with open(os.getenv('MGANA_IO_REPORT'), 'w') as f:
+            json.dump(process_io(), f)
+    return
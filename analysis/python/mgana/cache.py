@@ -0,0 +1,114 @@
+import os
+import json
+import hashlib
+
+from .logger import rootLogger
+
+# name of the cache file kept in every output directory
+CACHE_FILE = '.mgana_cache.json'
+CACHE_VERSION = 1
+
+# content digests of scripts, libraries and geometry files, keyed by (path, size, mtime)
+_digests = {}
+
+#__________________________________________________________
+def file_digest(path: str) -> str:
+    '''
+    Return the sha256 of the content of path.
+    '''
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+    if key not in _digests:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        _digests[key] = h.hexdigest()
+    return _digests[key]
+
+#__________________________________________________________
+def runtime_key(script: str, libraries: list, geometry: list) -> str:
+    '''
+    Digest of everything an output depends on besides its input files:
+    the analysis script, the loaded analyzer libraries and the geometry files.
+    '''
+    h = hashlib.sha256()
+    for path in [script] + sorted(libraries) + list(geometry):
+        h.update(path.encode())
+        if os.path.isfile(path):
+            h.update(file_digest(path).encode())
+        else:
+            rootLogger.debug(f'{path} not found, only its name is hashed')
+    return h.hexdigest()
+
+#__________________________________________________________
+def output_key(runtime: str, inputs: list, extra=None) -> str:
+    '''
+    Digest of one output: runtime key, identities of the input files
+    (path, size, mtime and entry range) and extra options affecting the result.
+    inputs is a list of (file, first, last) or plain file names.
+    '''
+    h = hashlib.sha256(runtime.encode())
+    for item in inputs:
+        path, rng = (item[0], item[1:]) if isinstance(item, (tuple, list)) else (item, ())
+        st = os.stat(path)
+        h.update(json.dumps([os.path.abspath(path), st.st_size, st.st_mtime_ns, list(rng)]).encode())
+    h.update(json.dumps(extra, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+#__________________________________________________________
+class StageCache:
+    '''
+    Digests of the outputs written in one output directory.
+    An output is up-to-date when all its files exist and its recorded digest matches.
+    The memory estimates of the stage are kept too, keyed by runtime.
+    '''
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, CACHE_FILE)
+        self.outputs = {}
+        self.memory = {}
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == CACHE_VERSION:
+                self.outputs = data['outputs']
+                self.memory = data.get('memory', {})
+        except (OSError, ValueError, KeyError):
+            rootLogger.debug(f'No valid stage cache in {directory}')
+
+    def lookup(self, name: str, digest: str):
+        '''
+        Return the recorded entry of name if it is still valid, otherwise None.
+        '''
+        entry = self.outputs.get(name)
+        if entry is None or entry['digest'] != digest:
+            return None
+        if not all(os.path.isfile(os.path.join(self.directory, f)) for f in entry['files']):
+            return None
+        return entry
+
+    def record(self, name: str, digest: str, files: list, **meta):
+        '''
+        Record a completed output and save the cache atomically.
+        files are relative to the output directory, meta is kept for skipped reruns.
+        '''
+        self.outputs[name] = dict(meta, digest=digest, files=files)
+        self.save()
+
+    def memory_estimate(self, key: str):
+        '''
+        Return the recorded (base, per-thread) memory of a worker for key, None if not probed yet.
+        '''
+        entry = self.memory.get(key)
+        return (entry['base'], entry['perThread']) if entry else None
+
+    def record_memory(self, key: str, base: int, perThread: int):
+        self.memory[key] = {'base': base, 'perThread': perThread}
+        self.save()
+
+    def save(self):
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'outputs': self.outputs, 'memory': self.memory}, f, indent=1)
+        os.replace(tmp, self.path)
@@ -0,0 +1,173 @@
+import bisect
+
+#__________________________________________________________
+def full_ranges(fileList, infos) -> list:
+    '''
+    Return one (file, first, last) range covering every entry of each file.
+    '''
+    return [(f, 0, info['entries']) for f, info in zip(fileList, infos) if info['entries'] > 0]
+
+#__________________________________________________________
+class _Boundaries:
+    '''
+    Global entry numbers in [0, target] where a chunk is allowed to start.
+    align='cluster': TTree cluster starts (any entry of a file whose clusters are unknown)
+    align='file':    file starts only
+    '''
+    def __init__(self, infos, target: int, align: str):
+        self.target = target
+        bounds = {0, target}
+        self.free = []
+        offset = 0
+        for info in infos:
+            if offset >= target:
+                break
+            bounds.add(offset)
+            clusters = info.get('clusters')
+            if align == 'cluster' and not clusters:
+                self.free.append((offset, offset + info['entries']))
+            elif align == 'cluster':
+                bounds.update(offset + c for c in clusters if offset + c < target)
+            offset += info['entries']
+        self.bounds = sorted(b for b in bounds if b <= target)
+        self.freeStarts = [lo for lo, _ in self.free]
+
+    def floor(self, x: int) -> int:
+        '''
+        Largest boundary <= x.
+        '''
+        x = min(x, self.target)
+        j = bisect.bisect_right(self.freeStarts, x) - 1
+        if j >= 0 and x < self.free[j][1]:
+            return x
+        return self.bounds[bisect.bisect_right(self.bounds, x) - 1]
+
+    def needed(self, start: int, size: int, limit: int) -> int:
+        '''
+        Fewest chunks of at most size entries from start to target, limit+1 if more than limit.
+        '''
+        n = 0
+        while start < self.target:
+            nxt = self.floor(start + size)
+            if nxt <= start or n == limit:
+                return limit + 1
+            start, n = nxt, n + 1
+        return n
+
+#__________________________________________________________
+def _balanced_edges(bounds: _Boundaries, chunks: int) -> list:
+    '''
+    Chunk edges on allowed boundaries minimising the largest chunk, at most chunks of them.
+    Each edge is the boundary nearest to an equal split of the entries left that still lets
+    the remaining chunks stay within the smallest feasible largest chunk.
+    '''
+    target = bounds.target
+    # smallest feasible largest chunk
+    lo, hi = -(-target//chunks), target
+    while lo < hi:
+        mid = (lo + hi)//2
+        if bounds.needed(0, mid, chunks) <= chunks:
+            hi = mid
+        else:
+            lo = mid + 1
+    size = lo
+
+    edges = [0]
+    for k in range(1, chunks):
+        start, left = edges[-1], chunks - k
+        ideal = start + (target - start)/(left + 1)
+        feasible = lambda b: start < b < target and bounds.needed(b, size, left) <= left
+        # smallest x >= ideal whose boundary leaves a feasible remainder (x = start+size always does)
+        a, z = int(ideal), start + size
+        while a < z:
+            mid = (a + z)//2
+            if start < bounds.floor(mid) and bounds.needed(bounds.floor(mid), size, left) <= left:
+                z = mid
+            else:
+                a = mid + 1
+        candidates = [b for b in (bounds.floor(int(ideal)), bounds.floor(a)) if feasible(b)]
+        if not candidates:
+            break
+        edges.append(min(candidates, key=lambda b: (abs(b - ideal), b)))
+    edges.append(target)
+    return edges
+
+#__________________________________________________________
+def plan_chunks(fileList, infos, chunks: int=1, fraction: float=1., align: str='cluster') -> list:
+    '''
+    Split the entries of fileList into at most chunks chunks on allowed boundaries (see
+    _Boundaries), the largest chunk as small as the boundaries allow and the others close to
+    an equal share. The first round(fraction*total) entries are used; with align='file' the
+    fraction is rounded to the nearest file boundary, at least the first file.
+    Each chunk is a list of (file, first, last) with the half-open entry range [first, last).
+    '''
+    total = sum(info['entries'] for info in infos)
+    target = int(round(total*fraction)) if fraction < 1 else total
+    if target == 0:
+        return []
+    if align == 'file' and target < total:
+        offsets = [0]
+        for info in infos:
+            offsets.append(offsets[-1] + info['entries'])
+        target = min((o for o in offsets if o > 0), key=lambda o: (abs(o - target), o))
+
+    edges = _balanced_edges(_Boundaries(infos, target, align), max(1, chunks))
+
+    # map the global edges back to per-file ranges
+    chunkList = []
+    for begin, end in zip(edges[:-1], edges[1:]):
+        ranges = []
+        offset = 0
+        for f, info in zip(fileList, infos):
+            first = max(begin, offset) - offset
+            last = min(end, offset + info['entries']) - offset
+            if first < last:
+                ranges.append((f, first, last))
+            offset += info['entries']
+        chunkList.append(ranges)
+    return chunkList
+
+#__________________________________________________________
+def truncate_ranges(ranges, nevents: int) -> list:
+    '''
+    Keep only the first nevents entries of a list of (file, first, last) ranges.
+    Used for --nevents, the result is read through a global entry range so
+    implicit MT stays enabled (RDataFrame.Range is single-threaded only).
+    '''
+    truncated = []
+    for f, first, last in ranges:
+        if nevents <= 0:
+            break
+        last = min(last, first + nevents)
+        truncated.append((f, first, last))
+        nevents -= last - first
+    return truncated
+
+#__________________________________________________________
+def processed_events(ranges, infos) -> int:
+    '''
+    Initial events behind a list of (file, first, last) ranges: the eventsProcessed of each file,
+    taken pro rata of the entries of its range. Files without eventsProcessed count 0.
+    '''
+    return sum(int(round(info['eventsProcessed']*(last-first)/info['entries']))
+               for (_, first, last), info in zip(ranges, infos)
+               if info['eventsProcessed'] is not None and info['entries'])
+
+#__________________________________________________________
+def split_ranges(ranges, size: int) -> list:
+    '''
+    Split a list of (file, first, last) ranges into consecutive slices of at most size entries.
+    '''
+    slices, current, left = [], [], size
+    for f, first, last in ranges:
+        while first < last:
+            end = min(last, first + left)
+            current.append((f, first, end))
+            left -= end - first
+            first = end
+            if left == 0:
+                slices.append(current)
+                current, left = [], size
+    if current:
+        slices.append(current)
+    return slices
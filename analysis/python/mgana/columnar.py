@@ -0,0 +1,151 @@
+import os
+import re
+import ROOT
+
+from .chunking import split_ranges
+from .logger import rootLogger
+
+# storage formats written by this module instead of a ROOT snapshot
+COLUMNAR_FORMATS = {'arrow': '.arrow', 'parquet': '.parquet'}
+
+# flattening of jagged columns into Arrow list layout (offsets + values), done in C++
+_FLATTEN_CODE = '''
+#include <cstdint>
+#include <type_traits>
+#include <vector>
+namespace mgana_columnar {
+  template <typename C>
+  struct Flat {
+    using T = typename C::value_type;
+    std::vector<std::int64_t> offsets;
+    std::vector<typename std::conditional<std::is_same<T, bool>::value, char, T>::type> values;
+  };
+  template <typename C>
+  Flat<C> flatten( const std::vector<C>& in ) {
+    Flat<C> out;
+    out.offsets.reserve( in.size() + 1 );
+    out.offsets.push_back( 0 );
+    for ( const auto& row : in ) {
+      out.values.insert( out.values.end(), row.begin(), row.end() );
+      out.offsets.push_back( out.values.size() );
+    }
+    return out;
+  }
+  template <typename T>
+  std::vector<char> bools( const std::vector<T>& in ) { return std::vector<char>( in.begin(), in.end() ); }
+}
+'''
+
+_SCALARS = {'bool', 'char', 'unsigned char', 'short', 'unsigned short', 'int', 'unsigned int',
+            'long', 'unsigned long', 'long long', 'unsigned long long', 'float', 'double',
+            'Bool_t', 'Char_t', 'UChar_t', 'Short_t', 'UShort_t', 'Int_t', 'UInt_t',
+            'Long_t', 'ULong_t', 'Long64_t', 'ULong64_t', 'Float_t', 'Double_t',
+            'int8_t', 'uint8_t', 'int16_t', 'uint16_t', 'int32_t', 'uint32_t', 'int64_t', 'uint64_t',
+            'std::int32_t', 'std::uint32_t', 'std::int64_t', 'std::uint64_t', 'size_t', 'std::size_t'}
+_COLLECTION = re.compile(r'^(?:ROOT::VecOps::RVec|ROOT::RVec|RVec|std::vector|vector)<\s*(.+?)\s*>$')
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError('Arrow/Parquet outputs need pyarrow, install it with "pip install pyarrow"')
+    return pyarrow
+
+#__________________________________________________________
+def columnar_path(path: str, profile: dict) -> str:
+    '''
+    Output path of a columnar profile, the .root extension is replaced.
+    '''
+    return os.path.splitext(path)[0] + COLUMNAR_FORMATS[profile['format']]
+
+#__________________________________________________________
+def supported_type(ctype: str) -> bool:
+    '''
+    Column types written to Arrow: numbers and vectors of numbers.
+    '''
+    m = _COLLECTION.match(ctype)
+    return ctype in _SCALARS or bool(m and m.group(1) in _SCALARS)
+
+def _book(node, columns: list) -> dict:
+    '''
+    Book a Take of every column, return {column: (type, result)}.
+    '''
+    booked = {}
+    for c in columns:
+        ctype = str(node.GetColumnType(c))
+        if not supported_type(ctype):
+            raise TypeError(f'Column {c} of type {ctype} can not be written to Arrow, only numbers and vectors of numbers')
+        booked[c] = (ctype, node.Take[ctype](c))
+    return booked
+
+def _to_arrow(pa, ctype: str, values):
+    import numpy as np
+    if _COLLECTION.match(ctype):
+        flat = ROOT.mgana_columnar.flatten(values)
+        offsets = np.asarray(flat.offsets)
+        data = np.asarray(flat.values)
+        if _COLLECTION.match(ctype).group(1) in ('bool', 'Bool_t'):
+            data = data.astype(bool)
+        return pa.LargeListArray.from_arrays(pa.array(offsets), pa.array(data))
+    if ctype in ('bool', 'Bool_t'):
+        return pa.array(np.asarray(ROOT.mgana_columnar.bools(values)).astype(bool))
+    return pa.array(np.asarray(values))
+
+#__________________________________________________________
+def write_columnar(build, ranges, columns: list, outFile: str, profile: dict, metadata: dict) -> int:
+    '''
+    Run build(df) over the entry ranges in slices of profile['rowGroupSize'] input entries
+    and write the columns of each slice as one Arrow record batch / Parquet row group,
+    so the memory use is bounded by the slice size. The computation graph is built and
+    jitted once, each slice is one event loop on it. Return the number of written rows.
+    '''
+    pa = _import_pyarrow()
+    ROOT.gInterpreter.Declare(_FLATTEN_CODE)
+    from .dataset import make_dataframe, make_sliced_dataframe
+
+    slices = split_ranges(ranges, profile.get('rowGroupSize', 1000000))
+    sliced = make_sliced_dataframe(ranges) if len(slices) > 1 else None
+    if sliced:
+        df, select = sliced
+        graph = build(df)
+    elif len(slices) > 1:
+        rootLogger.warning('The computation graph is rebuilt for each row group (RNTuple inputs or ROOT < 6.32)')
+
+    writer = None
+    nrows = 0
+    try:
+        for batch in slices:
+            if sliced:
+                select(batch)
+                booked = _book(graph, columns)
+            else:
+                booked = _book(build(make_dataframe(batch)), columns)
+            table = pa.table({c: _to_arrow(pa, ctype, result.GetValue()) for c, (ctype, result) in booked.items()})
+            if writer is None:
+                schema = table.schema.with_metadata({k: str(v) for k, v in metadata.items()})
+                if profile['format'] == 'parquet':
+                    writer = pa.parquet.ParquetWriter(outFile, schema,
+                                                      compression=profile.get('compression', 'zstd'),
+                                                      compression_level=profile.get('level'))
+                else:
+                    options = pa.ipc.IpcWriteOptions(compression=profile.get('compression'))
+                    writer = pa.ipc.new_file(outFile, schema, options=options)
+            writer.write_table(table.replace_schema_metadata(schema.metadata))
+            nrows += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return nrows
+
+#__________________________________________________________
+def read_columnar(path: str):
+    '''
+    Open an Arrow or Parquet stage output as a pyarrow Table.
+    Arrow IPC files are memory-mapped: uncompressed columns are used in place, without copy.
+    '''
+    pa = _import_pyarrow()
+    if path.endswith('.parquet'):
+        return pa.parquet.read_table(path, memory_map=True)
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
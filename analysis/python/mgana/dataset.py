@@ -0,0 +1,123 @@
+import os
+import ROOT
+
+from .index import scan_files
+from .logger import rootLogger
+
+#__________________________________________________________
+def _vector(items):
+    vec = ROOT.vector('string')()
+    for item in items:
+        vec.push_back(item)
+    return vec
+
+#__________________________________________________________
+def friend_levels(files: list, infos: list) -> list:
+    '''
+    Follow the parents of friend outputs down to plain files.
+    Return the list of file levels, files first and the base files last;
+    every level has the same entries, in the same order, as the base files.
+    '''
+    levels = [list(files)]
+    while any(info.get('parents') for info in infos):
+        if not all(info.get('parents') for info in infos):
+            raise RuntimeError(f'Friend outputs can not be mixed with plain files: {levels[-1]}')
+        # parents are stored relative to the directory of the friend output
+        parents = [os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(f)), p))
+                   for f, info in zip(levels[-1], infos) for p in info['parents']]
+        levels.append(parents)
+        infos = scan_files(parents)
+    return levels
+
+#__________________________________________________________
+def alias_friends(df, nfriends: int):
+    '''
+    Columns of the friend trees are usable without their 'friend<i>.' prefix,
+    the newest stage (lowest i) wins when a name exists in several of them.
+    '''
+    names = set(str(c) for c in df.GetColumnNames())
+    for i in range(nfriends):
+        prefix = f'friend{i}.'
+        for full in sorted(n for n in names if n.startswith(prefix)):
+            short = full[len(prefix):]
+            if short not in names and not df.HasColumn(short):
+                df = df.Alias(short, full)
+                names.add(short)
+    return df
+
+#__________________________________________________________
+def make_dataframe(ranges, treeName: str='events'):
+    '''
+    Build a RDataFrame over a list of contiguous (file, first, last) ranges,
+    as produced by chunking.plan_chunks.
+    Whole files are read with a plain RDataFrame, partial ones through a
+    RDatasetSpec global entry range, which keeps implicit MT usable.
+    Friend outputs of earlier stages are read on top of their parent files.
+    '''
+    files = [f for f, _, _ in ranges]
+    infos = scan_files(files)
+    partial = any(first != 0 or last != info['entries']
+                  for (_, first, last), info in zip(ranges, infos))
+    levels = friend_levels(files, infos)
+    if not partial and len(levels) == 1:
+        return ROOT.RDataFrame(treeName, _vector(files))
+
+    # global entry range over the chain of the chunk files
+    begin = ranges[0][1]
+    end = sum(info['entries'] for info in infos[:-1]) + ranges[-1][2]
+    if any(info.get('format') == 'rntuple' for info in infos):
+        if len(levels) > 1:
+            raise RuntimeError('Friend outputs need TTree inputs')
+        # dataset specs are TTree-only, Range() needs a single thread
+        rootLogger.warning('Partial RNTuple inputs are read single-threaded')
+        ROOT.ROOT.DisableImplicitMT()
+        return ROOT.RDataFrame(treeName, _vector(files)).Range(begin, end)
+
+    df = ROOT.RDataFrame(_dataset_spec(levels, (begin, end) if partial else None, treeName))
+    if len(levels) > 1:
+        df = alias_friends(df, len(levels) - 1)
+    return df
+
+def _dataset_spec(levels: list, entryRange=None, treeName: str='events'):
+    '''
+    RDatasetSpec of the base files of levels, the outputs of each later stage a friend,
+    restricted to the global entry range (begin, end) if given.
+    '''
+    spec = ROOT.RDF.Experimental.RDatasetSpec()
+    spec.AddSample(ROOT.RDF.Experimental.RSample('chunk', treeName, _vector(levels[-1])))
+    for i, level in enumerate(levels[:-1]):
+        spec.WithGlobalFriends(treeName, _vector(level), f'friend{i}')
+    if entryRange:
+        spec.WithGlobalRange(ROOT.RDF.Experimental.RDatasetSpec.REntryRange(*entryRange))
+    return spec
+
+#__________________________________________________________
+def make_sliced_dataframe(ranges, treeName: str='events'):
+    '''
+    RDataFrame over ranges whose computation graph is run slice by slice: return (df, select),
+    select(slice) restricts the next event loop to slice, a contiguous part of ranges
+    (see chunking.split_ranges). The graph built on df is jitted once for all slices.
+    None if the inputs are RNTuples or ROOT (< 6.32) can not change the dataset of a dataframe.
+    '''
+    change = getattr(ROOT.Internal.RDF, 'ChangeSpec', None)
+    files = [f for f, _, _ in ranges]
+    infos = scan_files(files)
+    if change is None or any(info.get('format') == 'rntuple' for info in infos):
+        return None
+    levels = friend_levels(files, infos)
+    offsets = {}
+    offset = 0
+    for f, info in zip(files, infos):
+        offsets[f] = offset
+        offset += info['entries']
+
+    def entry_range(part):
+        return offsets[part[0][0]] + part[0][1], offsets[part[-1][0]] + part[-1][2]
+
+    df = ROOT.RDataFrame(_dataset_spec(levels, entry_range(ranges), treeName))
+    node = ROOT.RDF.AsRNode(df)
+    def select(part):
+        change(node, ROOT.std.move(_dataset_spec(levels, entry_range(part), treeName)))
+    if len(levels) > 1:
+        df = alias_friends(df, len(levels) - 1)
+    return df, select
@@ -0,0 +1,27 @@
+import re
+
+# string literals or (dotted) identifiers of an expression
+_token = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)*')
+
+#__________________________________________________________
+def parse_expression(expr: str, columns: set):
+    '''
+    Return the columns used by expr (order of appearance) and expr with each of them
+    replaced by the parameter _c<i>, the same matching as RDataFrame (longest dotted prefix).
+    '''
+    used = []
+    def repl(m):
+        tok = m.group(0)
+        start = m.start()
+        # literals, members and scoped names are not columns
+        if tok[0] in '"\'' or expr[max(0, start-1):start] in ('.', ':') or expr[max(0, start-2):start] == '->':
+            return tok
+        parts = tok.split('.')
+        for n in range(len(parts), 0, -1):
+            name = '.'.join(parts[:n])
+            if name in columns:
+                if name not in used:
+                    used.append(name)
+                return f'_c{used.index(name)}' + tok[len(name):]
+        return tok
+    return used, _token.sub(repl, expr)
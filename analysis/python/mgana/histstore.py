@@ -0,0 +1,140 @@
+import os
+import json
+
+# separator of the systematic variations in histogram names: {variable}__{variation}__{tag}
+VARIATION_SEP = '__'
+
+def variation_name(variable: str, variation: str, tag: str) -> str:
+    return VARIATION_SEP.join([variable, variation, tag])
+
+def split_variation(name: str):
+    '''
+    Return (variable, variation, tag) of a histogram name, variation and tag are None for a nominal one.
+    '''
+    parts = name.split(VARIATION_SEP)
+    if len(parts) < 3:
+        return name, None, None
+    return VARIATION_SEP.join(parts[:-2]), parts[-2], parts[-1]
+
+#__________________________________________________________
+class HistoStore:
+    '''
+    In-memory histograms keyed by (process, selection, variable).
+    Every input file is opened once, histograms are detached from their files.
+    Merged sample groups are stored like processes, under their group name.
+    '''
+    def __init__(self):
+        self.histos = {}
+        # identities (path, size, mtime) of the input files, to validate a cache file
+        self.inputs = {}
+
+    def __contains__(self, key):
+        return key in self.histos
+
+    def get(self, process: str, selection: str, variable: str):
+        return self.histos.get((process, selection, variable))
+
+    def keys(self):
+        return self.histos.keys()
+
+    def read(self, path: str, process: str, selection: str, variables=None):
+        '''
+        Read the histograms of one *_histo.root file, all of them if variables is None.
+        The systematic variations of the variables are read with them.
+        '''
+        import ROOT
+        tf = ROOT.TFile.Open(path, 'READ')
+        for key in tf.GetListOfKeys():
+            name = key.GetName()
+            if variables is not None and split_variation(name)[0] not in variables:
+                continue
+            if not ROOT.TClass.GetClass(key.GetClassName()).InheritsFrom(ROOT.TH1.Class()):
+                continue
+            h = key.ReadObj()
+            h.SetDirectory(ROOT.nullptr)
+            self.histos[(process, selection, name)] = h
+        tf.Close()
+        st = os.stat(path)
+        self.inputs[os.path.abspath(path)] = [st.st_size, st.st_mtime_ns]
+
+    def variations(self, selection: str, variable: str) -> list:
+        '''
+        Names of the systematic variations of variable read for selection.
+        '''
+        return sorted(set(v for _, sel, v in self.histos
+                          if sel == selection and v != variable and split_variation(v)[0] == variable))
+
+    def merge(self, name: str, processes: list, selection: str, variable: str, fallback: str=None):
+        '''
+        Sum the histograms of processes into a group stored under (name, selection, variable).
+        Processes without variable contribute their fallback histogram (the nominal one of a variation).
+        Return the merged histogram, None if no process has it.
+        '''
+        import ROOT
+        merged = None
+        for pr in processes:
+            h = self.get(pr, selection, variable)
+            if h is None and fallback is not None:
+                h = self.get(pr, selection, fallback)
+            if h is None:
+                continue
+            if merged is None:
+                merged = h.Clone(variable)
+                merged.SetDirectory(ROOT.nullptr)
+            else:
+                merged.Add(h)
+        if merged is not None:
+            self.histos[(name, selection, variable)] = merged
+        return merged
+
+    def is_current(self) -> bool:
+        '''
+        True if none of the input files changed since they were read.
+        '''
+        for path, ident in self.inputs.items():
+            if not os.path.isfile(path):
+                return False
+            st = os.stat(path)
+            if [st.st_size, st.st_mtime_ns] != ident:
+                return False
+        return True
+
+    def save(self, path: str):
+        '''
+        Write the whole store into a single ROOT file, as process/selection/variable.
+        '''
+        import ROOT
+        tmp = f'{path}.{os.getpid()}.tmp'
+        tf = ROOT.TFile.Open(tmp, 'RECREATE')
+        for (pr, sel, var), h in self.histos.items():
+            d = tf.GetDirectory(f'{pr}/{sel}')
+            if not d:
+                d = tf.GetDirectory(pr) or tf.mkdir(pr)
+                d = d.mkdir(sel)
+            d.WriteObject(h, var)
+        ROOT.TNamed('inputs', json.dumps(self.inputs)).Write()
+        tf.Close()
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str):
+        '''
+        Restore a store written by save.
+        Process names may contain '/' (merged groups), so directories are walked recursively.
+        '''
+        import ROOT
+        store = cls()
+        tf = ROOT.TFile.Open(path, 'READ')
+        store.inputs = json.loads(tf.Get('inputs').GetTitle())
+
+        def walk(d, names):
+            for key in d.GetListOfKeys():
+                if key.GetClassName() == 'TDirectoryFile':
+                    walk(key.ReadObj(), names + [key.GetName()])
+                elif len(names) >= 2:
+                    h = key.ReadObj()
+                    h.SetDirectory(ROOT.nullptr)
+                    store.histos[('/'.join(names[:-1]), names[-1], key.GetName())] = h
+        walk(tf, [])
+        tf.Close()
+        return store
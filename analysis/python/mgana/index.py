@@ -0,0 +1,180 @@
+import os
+import json
+
+from .manifest import read_manifest
+from .logger import rootLogger
+
+# name of the index file kept in every indexed directory
+INDEX_FILE = '.mgana_index.json'
+# bump when the layout of an index entry changes, old indices are then rebuilt
+INDEX_VERSION = 3
+
+#__________________________________________________________
+def _file_stat(path: str) -> dict:
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime': st.st_mtime_ns}
+
+#__________________________________________________________
+def _scan_file(path: str) -> dict:
+    '''
+    Open a ROOT file once and collect the metadata used by mgana:
+    entries and cluster starts of the 'events' tree, 'eventsProcessed', names of trees and top-level keys,
+    the parent files of a friend output, and the entries of a skim ('skim' format).
+    '''
+    import ROOT
+
+    tf = ROOT.TFile.Open(path, 'READ')
+    if not tf or tf.IsZombie():
+        raise OSError(f'Can not open ROOT file {path}')
+
+    info = {'entries': 0, 'clusters': [], 'eventsProcessed': None, 'trees': [], 'keys': [], 'format': 'ttree', 'parents': None}
+    for key in tf.GetListOfKeys():
+        name = key.GetName()
+        info['keys'].append(name)
+        cls = ROOT.TClass.GetClass(key.GetClassName())
+        if key.GetClassName().endswith('RNTuple'):
+            info['trees'].append(name)
+            if name == 'events':
+                info['format'] = 'rntuple'
+        elif cls and cls.InheritsFrom(ROOT.TTree.Class()):
+            info['trees'].append(name)
+        elif name == 'eventsProcessed':
+            info['eventsProcessed'] = tf.Get(name).GetVal()
+        elif name == 'friendParents':
+            info['parents'] = json.loads(tf.Get(name).GetTitle())
+        elif name == 'skim' and key.GetClassName() == 'TEntryList':
+            info['format'] = 'skim'
+            info['entries'] = tf.Get(name).GetN()
+
+    if info['format'] == 'skim':
+        tf.Close()
+        return info
+
+    if info['format'] == 'rntuple':
+        # no TTree clusters, chunks of RNTuple inputs are cut on file boundaries
+        reader = getattr(ROOT, 'RNTupleReader', None) or ROOT.Experimental.RNTupleReader
+        info['entries'] = reader.Open('events', path).GetNEntries()
+        tf.Close()
+        return info
+
+    if 'events' in info['trees']:
+        tt = tf.Get('events')
+        info['entries'] = tt.GetEntries()
+        # cluster starts, used to cut chunks on basket boundaries
+        it = tt.GetClusterIterator(0)
+        start = it.Next()
+        while start < info['entries']:
+            info['clusters'].append(start)
+            start = it.Next()
+    tf.Close()
+    return info
+
+#__________________________________________________________
+def _manifest_info(path: str) -> dict:
+    '''
+    Metadata of an mgana output from its manifest, without opening the file. None without manifest.
+    '''
+    m = read_manifest(path)
+    if m is None:
+        return None
+    return {'entries': m['entries'], 'clusters': m.get('clusters', []), 'eventsProcessed': m.get('eventsProcessed'),
+            'trees': m.get('trees', ['events']), 'keys': m.get('keys', ['events']),
+            'format': m.get('format', 'ttree'), 'parents': m.get('parents')}
+
+#__________________________________________________________
+class FileIndex:
+    '''
+    On-disk metadata index of the ROOT files in one directory.
+    Entries are validated against file size and mtime, only changed files are rescanned;
+    outputs of mgana are indexed from their manifest, without being opened.
+    '''
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, INDEX_FILE)
+        self.files = {}
+        self.dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == INDEX_VERSION:
+                self.files = data['files']
+        except (OSError, ValueError, KeyError):
+            rootLogger.debug(f'No valid index in {self.directory}, will build a new one')
+
+    def lookup(self, path: str) -> dict:
+        '''
+        Return the metadata of path, rescan the file if it is new or modified.
+        '''
+        name = os.path.basename(path)
+        stat = _file_stat(path)
+        info = self.files.get(name)
+        if info is None or info['size'] != stat['size'] or info['mtime'] != stat['mtime']:
+            rootLogger.debug(f'Indexing {path}')
+            info = _manifest_info(path) or _scan_file(path)
+            info.update(stat)
+            self.files[name] = info
+            self.dirty = True
+        return info
+
+    def register(self, path: str, info: dict):
+        '''
+        Record the metadata of a file written by mgana, so it is not rescanned later.
+        '''
+        info = dict(info)
+        info.update(_file_stat(path))
+        self.files[os.path.basename(path)] = info
+        self.dirty = True
+
+    def save(self):
+        '''
+        Write the index atomically, entries of removed files are dropped.
+        '''
+        if not self.dirty:
+            return
+        self.files = {k: v for k, v in self.files.items()
+                      if os.path.exists(os.path.join(self.directory, k))}
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({'version': INDEX_VERSION, 'files': self.files}, f)
+            os.replace(tmp, self.path)
+            self.dirty = False
+        except OSError:
+            # read-only input area, keep the index in memory for this run
+            rootLogger.debug(f'Can not write index {self.path}')
+
+# one index per directory for the lifetime of the process
+_indices = {}
+
+def get_index(directory: str) -> FileIndex:
+    directory = os.path.abspath(directory)
+    if directory not in _indices:
+        _indices[directory] = FileIndex(directory)
+    return _indices[directory]
+
+#__________________________________________________________
+def scan_files(files) -> list:
+    '''
+    Return the metadata dict of each file in files (same order).
+    Only new or modified files are opened, updated indices are saved on disk.
+    '''
+    infos = []
+    touched = set()
+    for f in files:
+        idx = get_index(os.path.dirname(os.path.abspath(f)))
+        infos.append(idx.lookup(f))
+        touched.add(idx)
+    for idx in touched:
+        idx.save()
+    return infos
+
+def register_file(path: str, info: dict):
+    '''
+    Add an output file produced by mgana to the index of its directory.
+    '''
+    idx = get_index(os.path.dirname(os.path.abspath(path)))
+    idx.register(path, info)
+    idx.save()
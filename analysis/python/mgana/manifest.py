@@ -0,0 +1,45 @@
+import os
+import json
+
+from .logger import rootLogger
+
+# sidecar of every mgana output: <output>.manifest.json
+MANIFEST_SUFFIX = '.manifest.json'
+MANIFEST_VERSION = 1
+
+#__________________________________________________________
+def manifest_path(output: str) -> str:
+    return output + MANIFEST_SUFFIX
+
+#__________________________________________________________
+def write_manifest(output: str, data: dict, written: str=None):
+    '''
+    Write the manifest of a completed output atomically.
+    The size and mtime of the output are recorded, so a manifest is ignored
+    once its output is rewritten by another tool. written is the file holding
+    the output if it is not yet renamed to output (size and mtime survive the rename).
+    '''
+    st = os.stat(written or output)
+    data = dict(data, version=MANIFEST_VERSION, output=os.path.basename(output),
+                size=st.st_size, mtime=st.st_mtime_ns)
+    path = manifest_path(output)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, path)
+
+#__________________________________________________________
+def read_manifest(output: str) -> dict:
+    '''
+    Return the manifest of output, None if it is missing or does not match the output file.
+    '''
+    try:
+        with open(manifest_path(output), 'r') as f:
+            data = json.load(f)
+        st = os.stat(output)
+    except (OSError, ValueError):
+        return None
+    if data.get('version') != MANIFEST_VERSION or data.get('size') != st.st_size or data.get('mtime') != st.st_mtime_ns:
+        rootLogger.debug(f'Manifest of {output} is out of date')
+        return None
+    return data
@@ -0,0 +1,139 @@
+import os
+import re
+import resource
+import multiprocessing
+
+from .logger import rootLogger
+
+_UNITS = {'': 1, 'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+
+#__________________________________________________________
+def parse_size(text: str) -> int:
+    '''
+    Bytes of a size such as '16G', '512M' or '1073741824'.
+    '''
+    m = re.fullmatch(r'\s*([0-9.]+)\s*([KMGT]?)i?B?\s*', str(text), re.IGNORECASE)
+    if not m:
+        raise ValueError(f'Invalid memory size {text}, use e.g. 16G or 512M')
+    return int(float(m.group(1))*_UNITS[m.group(2).upper()])
+
+def format_size(nbytes: float) -> str:
+    return f'{nbytes/2**30:.2f} GB' if nbytes >= 2**30 else f'{nbytes/2**20:.0f} MB'
+
+#__________________________________________________________
+def available_cores() -> int:
+    '''
+    Cores this process may run on (CPU affinity of batch slots), os.cpu_count() elsewhere.
+    '''
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def available_memory() -> int:
+    '''
+    Memory available to this process: MemAvailable of the node, capped by a cgroup limit.
+    0 if unknown.
+    '''
+    avail = 0
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    avail = int(line.split()[1])*1024
+    except OSError:
+        pass
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path, 'r') as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 2**60:
+            avail = min(avail, int(value)) if avail else int(value)
+    return avail
+
+def memory_budget(spec=None) -> int:
+    '''
+    Memory budget in bytes: spec ('16G', ...) or 80% of the available memory, 0 if unknown.
+    '''
+    if spec:
+        return parse_size(spec)
+    return int(0.8*available_memory())
+
+#__________________________________________________________
+def rss(pid: int=None) -> int:
+    '''
+    Current resident memory of a process (this one by default), 0 if it is gone.
+    '''
+    try:
+        with open(f'/proc/{pid or "self"}/statm', 'r') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (OSError, IndexError, ValueError):
+        return 0
+
+def peak_rss(children: bool=False) -> int:
+    '''
+    Peak resident memory of this process, or of its largest finished child process.
+    '''
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    return resource.getrusage(who).ru_maxrss*1024
+
+#__________________________________________________________
+def _forked(conn, func, args):
+    try:
+        conn.send((True, func(*args)))
+    except Exception as e:
+        conn.send((False, repr(e)))
+    conn.close()
+
+def run_forked(func, *args):
+    '''
+    Return func(*args) run in a forked child process, so the parent state
+    (thread pool, memory) is not touched. Raise RuntimeError if it fails.
+    '''
+    ctx = multiprocessing.get_context('fork')
+    recv, send = ctx.Pipe(duplex=False)
+    p = ctx.Process(target=_forked, args=(send, func, args))
+    p.start()
+    send.close()
+    try:
+        ok, result = recv.recv()
+    except EOFError:
+        ok, result = False, f'exit code {p.exitcode}'
+    p.join()
+    if not ok:
+        raise RuntimeError(f'{getattr(func, "__name__", func)} failed in a forked child: {result}')
+    return result
+
+def probe_memory(func, *args) -> tuple:
+    '''
+    Sample the memory growth of func(nthreads, *args), an event loop over the first events,
+    run once with 1 and once with 2 threads in forked children.
+    Return (base, per-thread) resident memory in bytes of one worker process.
+    '''
+    rss1 = run_forked(func, 1, *args)
+    rss2 = run_forked(func, 2, *args)
+    perThread = max(rss2 - rss1, 0)
+    return max(rss1 - perThread, 0), perThread
+
+#__________________________________________________________
+def fit_budget(budget: int, base: int, perThread: int, workers: int, threads: int) -> tuple:
+    '''
+    Largest workers x threads (at most the requested ones) whose estimated memory
+    workers*(base + threads*perThread) fits in budget. Workers are traded for threads
+    first, since each worker process also costs base. Return (workers, threads).
+    '''
+    ncores = workers*threads
+    best = (1, 1)
+    for w in range(workers, 0, -1):
+        t = ncores // w
+        if perThread > 0:
+            t = min(t, int((budget/w - base) // perThread))
+        elif w*base > budget:
+            t = 0
+        if t >= 1 and w*t > best[0]*best[1]:
+            best = (w, t)
+    if best == (1, 1) and base + perThread > budget:
+        rootLogger.warning(f'One thread needs about {format_size(base + perThread)}, more than the memory budget {format_size(budget)}')
+    return best
@@ -0,0 +1,222 @@
+import os
+import time
+import fcntl
+import atexit
+import shutil
+import hashlib
+import threading
+import multiprocessing.util
+
+from .manifest import manifest_path
+from .memory import format_size
+from .logger import rootLogger
+
+# file systems whose reads are network round trips
+NETWORK_FS = {'nfs', 'nfs4', 'cifs', 'smb3', 'lustre', 'gpfs', 'ceph', 'beegfs', 'glusterfs',
+              'fuse.glusterfs', 'fuse.eos', 'fuse.sshfs', 'fuse.cvmfs2', 'afs'}
+# auto-flush of ROOT trees, bytes of one cluster when the index has no cluster starts
+DEFAULT_CLUSTER_BYTES = 30*2**20
+
+#__________________________________________________________
+def filesystem_type(path: str) -> str:
+    '''
+    Type of the file system holding path, from the longest matching mount point of /proc/mounts.
+    '''
+    path = os.path.realpath(path)
+    best, fstype = '', ''
+    try:
+        with open('/proc/mounts', 'r') as f:
+            for line in f:
+                fields = line.split()
+                mount = fields[1].replace('\\040', ' ')
+                if (path == mount or path.startswith(mount.rstrip('/') + '/')) and len(mount) >= len(best):
+                    best, fstype = mount, fields[2]
+    except OSError:
+        pass
+    return fstype
+
+def is_remote(path: str) -> bool:
+    return '://' in path or filesystem_type(path) in NETWORK_FS
+
+#__________________________________________________________
+def configure_tree_cache(files: list, infos: list, cacheSize: int=None, learnEntries: int=None, prefetch: str='auto') -> dict:
+    '''
+    Set the TTreeCache and asynchronous prefetching of the trees opened afterwards by RDataFrame.
+    cacheSize is in bytes per tree and thread (0 disables the cache), by default two clusters
+    on network storage and ROOT's default of one cluster elsewhere. ROOT sizes the cache as a
+    factor (TTreeCache.Size) of the cluster bytes, estimated from the file sizes and cluster starts.
+    prefetch is 'on', 'off' or 'auto' (on for network storage). Return the settings.
+    '''
+    import ROOT
+    remote = any(is_remote(f) for f in files)
+    clusters = [info['size']/len(info['clusters']) for info in infos if info.get('clusters') and info.get('size')]
+    clusterBytes = sum(clusters)/len(clusters) if clusters else DEFAULT_CLUSTER_BYTES
+    if cacheSize is None:
+        factor = 2. if remote else 1.
+    else:
+        factor = cacheSize/clusterBytes
+    asyncPrefetch = prefetch == 'on' or (prefetch == 'auto' and remote)
+
+    ROOT.gEnv.SetValue('TTreeCache.Size', factor)
+    ROOT.gEnv.SetValue('TFile.AsyncPrefetching', 1 if asyncPrefetch else 0)
+    if learnEntries:
+        ROOT.TTreeCache.SetLearnEntries(learnEntries)
+    return {'remote': remote, 'cacheSize': int(factor*clusterBytes), 'cacheFactor': factor,
+            'learnEntries': int(ROOT.TTreeCache.GetLearnEntries()), 'prefetch': asyncPrefetch}
+
+#__________________________________________________________
+class ScratchCache:
+    '''
+    Local copies of input files in a scratch directory bounded to size bytes, the least recently
+    used copies are evicted first. Copies are named after the path, size and mtime of the
+    original, so a modified input is copied again; copies in use are share-locked and never evicted.
+    Several worker processes may share the directory.
+    '''
+    def __init__(self, directory: str, size: int):
+        self.directory = os.path.abspath(directory)
+        self.size = size
+        self.locks = []
+        self.thread = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _copy_path(self, path: str) -> str:
+        st = os.stat(path)
+        key = hashlib.sha1(f'{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}'.encode()).hexdigest()[:16]
+        return os.path.join(self.directory, f'{key}_{os.path.basename(path)}')
+
+    def _copies(self) -> list:
+        copies = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.root') and not name.startswith('.'):
+                try:
+                    copies.append((os.stat(path), path))
+                except OSError:
+                    pass
+            elif name.endswith('.tmp'):
+                # copy of a killed worker
+                try:
+                    if time.time() - os.path.getmtime(path) > 3600:
+                        os.remove(path)
+                except OSError:
+                    pass
+        return copies
+
+    def _evict(self, needed: int) -> bool:
+        '''
+        Remove least recently used copies not in use until needed bytes fit. False if they can not.
+        '''
+        copies = sorted(self._copies(), key=lambda c: c[0].st_atime)
+        used = sum(st.st_size for st, _ in copies)
+        for st, path in copies:
+            if used + needed <= self.size:
+                break
+            try:
+                with open(path, 'rb') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    for p in (path, manifest_path(path)):
+                        if os.path.exists(p):
+                            os.remove(p)
+            except OSError:
+                # in use by another worker, or already evicted
+                continue
+            used -= st.st_size
+        return used + needed <= self.size
+
+    def fetch(self, path: str) -> str:
+        '''
+        Copy path to the scratch directory if it is not there yet, with its manifest.
+        Return the copy, None if it does not fit.
+        '''
+        copy = self._copy_path(path)
+        if os.path.exists(copy):
+            return copy
+        if not self._evict(os.path.getsize(path)):
+            rootLogger.debug(f'{path} does not fit in the scratch directory')
+            return None
+        tmp = f'{copy}.{os.getpid()}.tmp'
+        start_time = time.time()
+        # size and mtime are kept, so the manifest stays valid for the copy
+        shutil.copy2(path, tmp)
+        if os.path.isfile(manifest_path(path)):
+            shutil.copy2(manifest_path(path), manifest_path(copy))
+        os.replace(tmp, copy)
+        rootLogger.debug(f'Staged {path} ({format_size(os.path.getsize(copy))}) in {time.time()-start_time:.1f}s')
+        return copy
+
+    def acquire(self, path: str) -> str:
+        '''
+        Local copy of path locked for reading until release(), None if it is not staged.
+        The background copies of the previous prefetch() are waited for first.
+        '''
+        self.wait()
+        copy = self._copy_path(path)
+        try:
+            f = open(copy, 'rb')
+        except OSError:
+            return None
+        fcntl.flock(f, fcntl.LOCK_SH)
+        if not os.path.exists(copy):
+            # evicted between open and lock
+            f.close()
+            return None
+        st = os.stat(copy)
+        os.utime(copy, ns=(time.time_ns(), st.st_mtime_ns))
+        self.locks.append(f)
+        return copy
+
+    def prefetch(self, paths: list):
+        '''
+        Copy paths in a background thread, e.g. the inputs of the next chunk while this one runs.
+        '''
+        self.wait()
+        def run():
+            for path in paths:
+                try:
+                    self.fetch(path)
+                except OSError as e:
+                    rootLogger.warning(f'Can not stage {path}: {e}')
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+
+    def release(self):
+        '''
+        Unlock the acquired copies, the background copies go on.
+        '''
+        for f in self.locks:
+            f.close()
+        self.locks = []
+
+    def wait(self):
+        '''
+        Wait for the background copies.
+        '''
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        self.release()
+        self.wait()
+
+# scratch caches of this process, kept between the chunks so the copies overlap the next one
+_caches = {}
+
+def _close_caches():
+    for cache in _caches.values():
+        cache.close()
+    _caches.clear()
+
+def scratch_cache(directory: str, size: int) -> ScratchCache:
+    '''
+    ScratchCache of directory shared by the chunks run in this process.
+    Its background copies are waited for when the process exits, worker processes included.
+    '''
+    key = (os.path.abspath(directory), size)
+    if key not in _caches:
+        if not _caches:
+            atexit.register(_close_caches)
+            # forked workers exit without the atexit handlers
+            multiprocessing.util.Finalize(None, _close_caches, exitpriority=10)
+        _caches[key] = ScratchCache(directory, size)
+    return _caches[key]
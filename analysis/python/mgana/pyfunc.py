@@ -0,0 +1,247 @@
+import os
+import re
+import sys
+import inspect
+import hashlib
+import importlib.util
+
+from .logger import rootLogger
+
+# numba types of the supported C++ scalars, bool crosses the C boundary as a byte
+_SCALARS = {'float': 'float32', 'Float_t': 'float32', 'double': 'float64', 'Double_t': 'float64',
+            'short': 'int16', 'unsigned short': 'uint16', 'int': 'int32', 'Int_t': 'int32',
+            'unsigned int': 'uint32', 'UInt_t': 'uint32', 'long': 'int64', 'long long': 'int64',
+            'Long64_t': 'int64', 'unsigned long': 'uint64', 'ULong64_t': 'uint64', 'bool': 'uint8'}
+_ALIASES = {'RVecF': 'float', 'RVecD': 'double', 'RVecI': 'int', 'RVecU': 'unsigned int',
+            'RVecL': 'long', 'RVecUL': 'unsigned long', 'RVecB': 'bool'}
+_RVEC = re.compile(r'^(?:ROOT::(?:VecOps::)?)?RVec<\s*(.+?)\s*>$')
+
+# functions registered by the analysis scripts {name: (function, argument types, return type)}
+_registry = {}
+# declared C++ wrappers {name: key}
+_declared = {}
+
+#__________________________________________________________
+def _parse_type(ctype: str) -> tuple:
+    '''
+    (element type, is RVec) of a C++ argument or return type.
+    '''
+    ctype = ' '.join(ctype.replace('const ', ' ').replace('&', ' ').split())
+    if ctype in _ALIASES:
+        return _ALIASES[ctype], True
+    m = _RVEC.match(ctype)
+    elem, vec = (m.group(1), True) if m else (ctype, False)
+    if elem not in _SCALARS:
+        raise TypeError(f'Type {ctype} is not supported for Python functions, use one of '
+                        f'{", ".join(_SCALARS)} or an RVec of them')
+    return elem, vec
+
+#__________________________________________________________
+def declare(inputs: list, output: str, name: str=None):
+    '''
+    Decorator registering a Python function of the analysis script, compiled with numba
+    when the runtime is loaded and callable in Define/Filter expressions as Numba::<name>(...).
+    inputs are the C++ types of the arguments, output the return type: scalars or RVec of
+    scalars, RVec arguments are passed as numpy arrays without copy.
+    '''
+    def register(func):
+        fname = name or func.__name__
+        _registry[fname] = (func, [_parse_type(t) for t in inputs], _parse_type(output))
+        return func
+    return register
+
+#__________________________________________________________
+def _nbtype(elem: str, vec: bool=False) -> str:
+    nbtype = f'nb.types.{_SCALARS[elem]}'
+    return f'nb.types.CPointer({nbtype})' if vec else nbtype
+
+# calls the C++ function at address fn(out, n) from compiled code, it resizes the RVec
+# result out to n elements and returns its data
+_GROW_SOURCE = '''
+@intrinsic
+def _grow(typingctx, fn, out, n):
+    def codegen(context, builder, signature, args):
+        ptr = ir.IntType(8).as_pointer()
+        fnty = ir.FunctionType(ptr, [ptr, ir.IntType(64)])
+        return builder.call(builder.inttoptr(args[0], fnty.as_pointer()), [args[1], args[2]])
+    return nb.types.voidptr(nb.types.int64, nb.types.voidptr, nb.types.int64), codegen
+'''
+
+def _python_source(functions: dict) -> str:
+    '''
+    numba cfuncs with a C signature (RVec as pointer and size) around the registered functions.
+    An RVec result is copied into the RVec of the caller, resized through a callback once its
+    size is known, so the function runs once per call.
+    '''
+    code = ['# generated by mgana from the Python functions of an analysis script, do not edit',
+            'import numpy as np', 'import numba as nb', 'from numba import carray',
+            'from numba.extending import intrinsic', 'from llvmlite import ir', _GROW_SOURCE]
+    for fname, (_, types, (relem, rvec)) in functions.items():
+        params, sig, call = [], [], []
+        for i, (elem, vec) in enumerate(types):
+            if vec:
+                params += [f'_p{i}', f'_n{i}']
+                sig += [_nbtype(elem, True), 'nb.types.int64']
+                call.append(f'carray(_p{i}, (_n{i},))')
+            else:
+                params.append(f'_a{i}')
+                sig.append(_nbtype(elem))
+                call.append(f'_a{i}')
+        if rvec:
+            params += ['_out', '_grow_fn']
+            sig += ['nb.types.voidptr', 'nb.types.int64']
+            ret = 'nb.types.void'
+        else:
+            ret = _nbtype(relem)
+        code.append(f'@nb.cfunc({ret}({", ".join(sig)}), cache=True)')
+        code.append(f'def _mgana_{fname}({", ".join(params)}):')
+        code.append(f'    _r = {fname}({", ".join(call)})')
+        if rvec:
+            code += ['    _n = len(_r)',
+                     f'    _o = carray(_grow(_grow_fn, _out, _n), (_n,), np.{_SCALARS[relem]})',
+                     '    for _i in range(_n):',
+                     '        _o[_i] = _r[_i]']
+        elif relem == 'bool':
+            code.append('    return 1 if _r else 0')
+        else:
+            code.append('    return _r')
+        code.append('')
+    return '\n'.join(code)
+
+# callback resizing an RVec result, declared once per process
+_GROW_CPP = '''#ifndef MGANA_NUMBA_GROW
+#define MGANA_NUMBA_GROW
+namespace Numba {
+  namespace detail {
+    template <typename T>
+    void* grow( void* out, long long n ) {
+      auto v = static_cast<ROOT::RVec<T>*>( out );
+      v->resize( n );
+      return v->data();
+    }
+  }
+}
+#endif'''
+
+def _cpp_source(fname: str, address: int, types: list, result: tuple) -> str:
+    '''
+    C++ wrapper Numba::<fname> calling the cfunc at address.
+    '''
+    def ctype(elem):
+        return 'unsigned char' if elem == 'bool' else elem
+    relem, rvec = result
+    params, cparams, args = [], [], []
+    for i, (elem, vec) in enumerate(types):
+        if vec:
+            params.append(f'const ROOT::RVec<{elem}>& x{i}')
+            cparams += [f'const {ctype(elem)}*', 'long long']
+            args += [f'reinterpret_cast<const {ctype(elem)}*>(x{i}.data())', f'(long long)x{i}.size()']
+        else:
+            params.append(f'{elem} x{i}')
+            cparams.append(ctype(elem))
+            args.append(f'x{i}')
+    if rvec:
+        cparams += ['void*', 'long long']
+        args += ['&out', f'reinterpret_cast<long long>(&detail::grow<{relem}>)']
+        body = [f'  ROOT::RVec<{relem}> out;',
+                f'  fn({", ".join(args)});',
+                f'  return out;']
+        ret = f'ROOT::RVec<{relem}>'
+        cret = 'void'
+    else:
+        body = [f'  return ({relem})fn({", ".join(args)});']
+        ret = relem
+        cret = ctype(relem)
+    return '\n'.join(['#include "ROOT/RVec.hxx"', _GROW_CPP, f'namespace Numba {{',
+                      f'inline {ret} {fname}({", ".join(params)}) {{',
+                      f'  auto fn = reinterpret_cast<{cret} (*)({", ".join(cparams)})>({address}ULL);'] +
+                     body + ['}', '}'])
+
+#__________________________________________________________
+def _global_names(code) -> list:
+    names = list(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names += _global_names(const)
+    return names
+
+def _function_source(func, seen: set=None) -> str:
+    '''
+    Source of func and of the module functions it calls, recursively, with the numbers and
+    strings it reads from its module: what numba compiles into the function.
+    '''
+    pyfunc = getattr(func, 'py_func', func)
+    seen = set() if seen is None else seen
+    if pyfunc in seen:
+        return ''
+    seen.add(pyfunc)
+    try:
+        parts = [inspect.getsource(pyfunc)]
+    except (TypeError, OSError):
+        parts = [repr((pyfunc.__code__.co_code, pyfunc.__code__.co_consts))]
+    for name in sorted(set(_global_names(pyfunc.__code__))):
+        value = pyfunc.__globals__.get(name)
+        if inspect.isfunction(getattr(value, 'py_func', value)):
+            parts.append(_function_source(value, seen))
+        elif isinstance(value, (bool, int, float, str, tuple)):
+            parts.append(f'{name} = {value!r}')
+    return '\n'.join(parts)
+
+#__________________________________________________________
+def declare_functions() -> int:
+    '''
+    Compile the registered functions with numba and declare their C++ wrappers.
+    The compiled code is cached under $MGANA_CACHE_DIR/numba, keyed by the sources of the
+    functions, so later runs only load it. Return the number of newly declared functions.
+    '''
+    pending = {}
+    for fname, (func, types, result) in _registry.items():
+        # scripts of a pipeline may declare the same function, only a different definition conflicts
+        key = hashlib.sha256(repr((fname, _function_source(func), types, result)).encode()).hexdigest()[:16]
+        if fname in _declared:
+            if _declared[fname] != key:
+                print(f'----> Error: Python function {fname} is declared with different definitions, '
+                      f'rename one of them with declare(..., name=...)')
+                sys.exit(3)
+            continue
+        pending[fname] = key
+    if not pending:
+        return 0
+
+    from .rdfwrap import cache_root
+    cacheDir = os.path.join(cache_root(), 'numba')
+    os.makedirs(cacheDir, exist_ok=True)
+    # read when numba is imported
+    os.environ.setdefault('NUMBA_CACHE_DIR', cacheDir)
+    try:
+        import numba
+    except ImportError:
+        raise RuntimeError('Python functions need numba, install it with "pip install numba"')
+    import ROOT
+
+    functions = {fname: _registry[fname] for fname in pending}
+    source = _python_source(functions)
+    key = hashlib.sha256((source + numba.__version__ + ''.join(pending.values())).encode()).hexdigest()[:16]
+    path = os.path.join(cacheDir, f'mgana_pyfunc_{key}.py')
+    if not os.path.isfile(path):
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(source)
+        os.replace(tmp, path)
+
+    # the registered functions, jitted with numba unless they already are, are globals of the cfuncs
+    spec = importlib.util.spec_from_file_location(f'mgana_pyfunc_{key}', path)
+    module = importlib.util.module_from_spec(spec)
+    for fname, (func, _, _) in functions.items():
+        jitted = func if isinstance(func, numba.core.dispatcher.Dispatcher) else numba.njit(cache=True)(func)
+        setattr(module, fname, jitted)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+
+    for fname, (_, types, result) in functions.items():
+        cfunc = getattr(module, f'_mgana_{fname}')
+        if not ROOT.gInterpreter.Declare(_cpp_source(fname, cfunc.address, types, result)):
+            raise RuntimeError(f'Can not declare the C++ wrapper of Python function {fname}')
+        _declared[fname] = pending[fname]
+        rootLogger.debug(f'Python function Numba::{fname} declared')
+    return len(functions)
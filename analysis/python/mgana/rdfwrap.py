@@ -0,0 +1,432 @@
+import os
+import re
+import glob
+import json
+import fcntl
+import hashlib
+import ROOT
+
+from .expressions import parse_expression
+from .logger import rootLogger
+
+# bump when the layout of the manifest or of the generated code changes
+CACHE_VERSION = 2
+
+#__________________________________________________________
+def cache_root() -> str:
+    '''
+    Top directory of the per-user mgana caches, MGANA_CACHE_DIR or ~/.cache/mgana.
+    '''
+    return os.environ.get('MGANA_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'mgana'))
+
+#__________________________________________________________
+def library_headers(libraries) -> list:
+    '''
+    Headers declared in the rootmap files next to the loaded libraries,
+    needed to compile expressions calling the analyzers.
+    '''
+    headers = []
+    for lib in libraries:
+        rootmap = os.path.splitext(lib)[0] + '.rootmap'
+        if not os.path.isfile(rootmap):
+            continue
+        with open(rootmap, 'r') as f:
+            for line in f:
+                if line.startswith('header '):
+                    header = line.split(None, 1)[1].strip()
+                    if header not in headers:
+                        headers.append(header)
+        include = os.path.join(os.path.dirname(os.path.dirname(lib)), 'include')
+        if os.path.isdir(include):
+            ROOT.gSystem.AddIncludePath(f'-I{include}')
+    return headers
+
+#__________________________________________________________
+class ExpressionCache:
+    '''
+    Compiled wrappers of the string Define/Filter expressions of an analysis.
+    New expressions are jitted as usual and recorded; build() compiles all of them
+    into one ACLiC library, which later runs load instead of jitting the expressions:
+    the nodes are booked by compiled code (mgana_book) with the wrapper as callable.
+    Only the expressions of the loaded library are used, a library built while it is
+    loaded serves the next runs.
+    Worker processes only record() their new expressions, the parent builds once after them.
+    Libraries are named after the digest of their source and share-locked while loaded,
+    a build removes the older ones no process holds.
+    The cache directory is keyed by the runtime key (script, libraries and geometry).
+    '''
+    def __init__(self, key: str, headers=()):
+        self.directory = os.path.join(cache_root(), 'expressions', key[:16])
+        self.manifest = os.path.join(self.directory, 'manifest.json')
+        self.headers = list(headers)
+        self.functions = {}
+        self.pending = {}
+        self.library = None
+        # share lock on the loaded library, inherited by forked workers
+        self.hold = None
+        # signatures exported by the loaded library
+        self.loaded = set()
+        data = self._read()
+        self._load(data.get('library'), self.functions)
+
+    def _load(self, lib: str, functions: dict):
+        if not lib:
+            return
+        try:
+            hold = open(lib, 'rb')
+        except OSError:
+            return
+        fcntl.flock(hold, fcntl.LOCK_SH)
+        # removed between open and lock
+        if not os.path.exists(lib) or ROOT.gSystem.Load(lib) < 0:
+            hold.close()
+            return
+        self.library = lib
+        self.hold = hold
+        self.loaded = set(s for s, f in functions.items() if f['compiled'])
+        rootLogger.debug(f'Compiled expressions loaded from {lib}')
+
+    def _collect(self, keep: str):
+        '''
+        Remove the libraries other than keep which no process has loaded, with their sources.
+        '''
+        suffix = f'_C.{ROOT.gSystem.GetSoExt()}'
+        for lib in glob.glob(os.path.join(self.directory, f'MganaExpressions_*{suffix}')):
+            if lib == keep:
+                continue
+            try:
+                with open(lib, 'rb') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    stem = lib[:-len(suffix)]
+                    for path in glob.glob(f'{stem}_C*') + [f'{stem}.C']:
+                        if os.path.exists(path):
+                            os.remove(path)
+            except OSError:
+                # loaded by a running process
+                continue
+
+    def _read(self) -> dict:
+        try:
+            with open(self.manifest, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == CACHE_VERSION:
+                self.functions = data['functions']
+                return data
+        except (OSError, ValueError, KeyError):
+            rootLogger.debug(f'No valid expression cache in {self.directory}')
+        return {}
+
+    def lookup(self, kind: str, node, expr: str):
+        '''
+        Return (signature, columns used, compiled) of expr on node; a new expression is recorded for build().
+        '''
+        columns = set(str(c) for c in node.GetColumnNames()) | {'rdfentry_', 'rdfslot_'}
+        used, body = parse_expression(expr, columns)
+        types = [str(node.GetColumnType(c)) for c in used]
+        sig = hashlib.sha256(json.dumps([kind, expr, used, types]).encode()).hexdigest()[:16]
+        # Python functions are only declared in the interpreter, such expressions stay jitted
+        if re.search(r'\bNumba::', expr):
+            return sig, used, False
+        if sig in self.loaded:
+            return sig, used, True
+        if sig not in self.functions:
+            self.pending[sig] = {'kind': kind, 'expr': expr, 'body': body, 'types': types,
+                                 'ret': 'bool' if kind == 'Filter' else None}
+        return sig, used, False
+
+    def call(self, sig: str, used: list) -> str:
+        '''
+        Call of the compiled wrapper of an expression, jitted in place of the expression.
+        '''
+        return f'mgana_expr_{sig}({", ".join(used)})'
+
+    def book(self, node, sig: str, used: list, name: str=''):
+        '''
+        Return node with the compiled Define (of column name) or Filter (named name) sig booked
+        by the library, nothing is jitted for it.
+        '''
+        columns = ROOT.std.vector['std::string']()
+        for c in used:
+            columns.push_back(c)
+        return ROOT.mgana_book(ROOT.RDF.AsRNode(node), sig, name, columns)
+
+    def set_type(self, sig: str, ret: str):
+        if sig in self.pending:
+            self.pending[sig]['ret'] = ret
+
+    def _source(self, functions: dict) -> str:
+        code = ['// generated by mgana from the expressions of an analysis script, do not edit',
+                '#include <functional>', '#include <string>', '#include <unordered_map>',
+                '#include "ROOT/RVec.hxx"', '#include "ROOT/RDataFrame.hxx"']
+        code += [f'#include "{h}"' for h in self.headers]
+        code += ['namespace megat {}',
+                 'using namespace megat;', 'using namespace ROOT;', 'using namespace ROOT::VecOps;', '']
+        bookers = []
+        for sig, f in functions.items():
+            params = ', '.join(f'const {t}& _c{i}' for i, t in enumerate(f['types']))
+            body = f['body'] if re.search(r'\breturn\b', f['body']) else f'return {f["body"]};'
+            code.append(f'// {f["expr"]}')
+            code.append(f'{f["ret"]} mgana_expr_{sig}({params}) {{ {body} }}')
+            call = (f'n.Define(name, mgana_expr_{sig}, c)' if f['kind'] == 'Define' else
+                    f'n.Filter(mgana_expr_{sig}, c, name)')
+            bookers.append(f'    {{"{sig}", [](ROOT::RDF::RNode n, const std::string& name, const ROOT::RDF::ColumnNames_t& c) '
+                           f'{{ return ROOT::RDF::RNode({call}); }}}},')
+        # one entry point, the nodes are instantiated here instead of being jitted at run time
+        code += ['',
+                 'using MganaBooker = std::function<ROOT::RDF::RNode(ROOT::RDF::RNode, const std::string&, const ROOT::RDF::ColumnNames_t&)>;',
+                 'ROOT::RDF::RNode mgana_book(ROOT::RDF::RNode n, const std::string& sig, const std::string& name,',
+                 '                            const ROOT::RDF::ColumnNames_t& c) {',
+                 '  static const std::unordered_map<std::string, MganaBooker> bookers = {'] + bookers + [
+                 '  };',
+                 '  return bookers.at(sig)(n, name, c);',
+                 '}']
+        return '\n'.join(code) + '\n'
+
+    def record(self):
+        '''
+        Save the new expressions of the last event loop in the cache directory, for build().
+        '''
+        pending = {s: f for s, f in self.pending.items() if f['ret']}
+        self.pending = {}
+        if not pending:
+            return
+        directory = os.path.join(self.directory, 'pending')
+        os.makedirs(directory, exist_ok=True)
+        for sig, f in pending.items():
+            path = os.path.join(directory, f'{sig}.json')
+            if os.path.exists(path):
+                continue
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as out:
+                json.dump(f, out)
+            os.replace(tmp, path)
+
+    def _recorded(self) -> dict:
+        directory = os.path.join(self.directory, 'pending')
+        records = {}
+        for name in (os.listdir(directory) if os.path.isdir(directory) else []):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, name), 'r') as f:
+                    records[name[:-len('.json')]] = json.load(f)
+            except (OSError, ValueError):
+                continue
+        return records
+
+    def build(self):
+        '''
+        Compile the expressions recorded by this process and its workers together with the cached ones.
+        Expressions that do not compile are remembered and stay jitted.
+        '''
+        self.record()
+        os.makedirs(self.directory, exist_ok=True)
+        # several processes may finish the same analysis at once
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            records = self._recorded()
+            if not records:
+                return
+            data = self._read()
+            new = {s: f for s, f in records.items() if s not in self.functions}
+            library = data.get('library')
+            functions = dict(self.functions)
+            if new:
+                compiled = {s: f for s, f in self.functions.items() if f['compiled']}
+                compiled.update({s: dict(f, compiled=True) for s, f in new.items()})
+                code = self._source(compiled)
+
+                print(f'----> Info: Compiling {len(new)} new expressions into the cache {self.directory}')
+                source = os.path.join(self.directory, f'MganaExpressions_{hashlib.sha256(code.encode()).hexdigest()[:16]}.C')
+                with open(source, 'w') as f:
+                    f.write(code)
+                # k: keep the library, O: optimized, c: compile only, s: silent
+                if ROOT.gSystem.CompileMacro(source, 'kOcs'):
+                    library = f'{os.path.splitext(source)[0]}_C.{ROOT.gSystem.GetSoExt()}'
+                    functions = compiled
+                else:
+                    rootLogger.warning('Expressions could not be compiled, they stay jitted')
+                    functions.update({s: dict(f, compiled=False) for s, f in new.items()})
+
+                tmp = f'{self.manifest}.{os.getpid()}.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump({'version': CACHE_VERSION, 'library': library, 'functions': functions}, f, indent=1)
+                os.replace(tmp, self.manifest)
+                self.functions = functions
+            for sig in records:
+                os.remove(os.path.join(self.directory, 'pending', f'{sig}.json'))
+            if library:
+                self._collect(library)
+            # a second library would declare the loaded wrappers again, it is used by the next runs
+            if self.library is None:
+                self._load(library, functions)
+
+# expression cache of the loaded analysis, None when disabled
+expressionCache = None
+
+def set_expression_cache(cache):
+    global expressionCache
+    expressionCache = cache
+
+# timing probes of the string expressions, kept in C++ so they can be updated from every thread
+_PROBES_CODE = '''
+#include <atomic>
+#include <chrono>
+#include <deque>
+namespace mgana_prof {
+  struct Counter { std::atomic<long long> ns{0}; std::atomic<long long> calls{0}; };
+  inline std::deque<Counter>& counters() { static std::deque<Counter> c; return c; }
+  inline unsigned add() { counters().emplace_back(); return counters().size() - 1; }
+  inline long long ns( unsigned id ) { return counters()[id].ns.load(); }
+  inline long long calls( unsigned id ) { return counters()[id].calls.load(); }
+  struct Probe {
+    Counter& c;
+    std::chrono::steady_clock::time_point t0;
+    Probe( unsigned id ) : c( counters()[id] ), t0( std::chrono::steady_clock::now() ) {}
+    ~Probe() {
+      c.ns += std::chrono::duration_cast<std::chrono::nanoseconds>( std::chrono::steady_clock::now() - t0 ).count();
+      ++c.calls;
+    }
+  };
+}
+'''
+
+#__________________________________________________________
+class Profiler:
+    '''
+    Time spent in each string Define/Filter expression and number of calls.
+    Each expression is evaluated inside a C++ probe object; since the inputs of an
+    expression are evaluated before it, the time of a node excludes its dependencies.
+    '''
+    def __init__(self):
+        ROOT.gInterpreter.Declare(_PROBES_CODE)
+        self.probes = []
+
+    def wrap(self, kind: str, label: str, expr: str) -> str:
+        pid = ROOT.mgana_prof.add()
+        self.probes.append((pid, kind, label))
+        body = expr if re.search(r'\breturn\b', expr) else f'return {expr};'
+        return f'mgana_prof::Probe _mgana_probe({pid}); {body}'
+
+    def take(self) -> list:
+        '''
+        Return and forget the probes booked since the last call.
+        '''
+        probes, self.probes = self.probes, []
+        return probes
+
+    def report(self, probes: list, root, prefix: str):
+        '''
+        Print the probes sorted by time, save the table in {prefix}.txt and
+        the computation graph of root, annotated with the timings, in {prefix}.dot.
+        '''
+        rows = {}
+        for pid, kind, label in probes:
+            ns, calls = rows.get((kind, label), (0, 0))
+            rows[(kind, label)] = (ns + ROOT.mgana_prof.ns(pid), calls + ROOT.mgana_prof.calls(pid))
+        total = sum(ns for ns, _ in rows.values()) or 1
+        table = [f'{"kind":8} {"time [s]":>10} {"share":>7} {"calls":>12} {"ns/call":>10}  node']
+        for (kind, label), (ns, calls) in sorted(rows.items(), key=lambda r: -r[1][0]):
+            table.append(f'{kind:8} {ns*1e-9:10.3f} {ns/total:7.1%} {calls:12d} {ns/max(calls, 1):10.0f}  {label}')
+
+        print(f'----> Info: Profile of the string expressions ({prefix})')
+        for line in table:
+            print('      ' + line)
+        with open(f'{prefix}.txt', 'w') as f:
+            f.write('\n'.join(table) + '\n')
+
+        # annotate the Define/Filter nodes of the graph with their timing
+        dot = str(ROOT.RDF.SaveGraph(unwrap_node(root)))
+        for (kind, label), (ns, calls) in rows.items():
+            dot = dot.replace(f'label="{kind}\\n{label}"', f'label="{kind}\\n{label}\\n{ns*1e-9:.3f} s / {calls} calls"')
+            dot = dot.replace(f'label="{label}"', f'label="{label}\\n{ns*1e-9:.3f} s / {calls} calls"')
+        with open(f'{prefix}.dot', 'w') as f:
+            f.write(dot)
+        print(f'      graph saved in {prefix}.dot')
+
+# profiler of the current command, None without --profile
+profiler = None
+
+def set_profiler(prof):
+    global profiler
+    profiler = prof
+
+#__________________________________________________________
+class NodeProxy:
+    '''
+    Wrapper of a RDataFrame node passed to the analysis script: string Define/Filter
+    expressions are replaced by calls to their compiled wrappers when available,
+    and wrapped into timing probes with --profile.
+    Every other attribute is forwarded to the wrapped node.
+    '''
+    def __init__(self, node):
+        self._node = node
+
+    def _wrap(self, result):
+        # only dataframe nodes, results (including lazy snapshots) are returned as they are
+        name = getattr(type(result), '__cpp_name__', '')
+        if name.startswith('ROOT::RDF::RInterface') or name == 'ROOT::RDataFrame':
+            return NodeProxy(result)
+        return result
+
+    def __getattr__(self, name):
+        attr = getattr(self._node, name)
+        if not callable(attr):
+            return attr
+        return lambda *args, **kwargs: self._wrap(attr(*args, **kwargs))
+
+    def _expression(self, kind: str, label: str, expr: str, name: str=''):
+        '''
+        Return (node, code, sig): the node booked by the compiled library, otherwise
+        the code to jit and the signature of a new expression.
+        '''
+        if not expressionCache:
+            return None, profiler.wrap(kind, label, expr), None
+        sig, used, compiled = expressionCache.lookup(kind, self._node, expr)
+        if compiled and not profiler:
+            return expressionCache.book(self._node, sig, used, name), None, None
+        code = expressionCache.call(sig, used) if compiled else expr
+        # timing probes are jitted around the expression
+        if profiler:
+            code = profiler.wrap(kind, label, code)
+        return None, code, (None if compiled else sig)
+
+    def Define(self, name, expr, *args):
+        if not isinstance(expr, str) or args:
+            return self._wrap(self._node.Define(name, expr, *args))
+        node, code, sig = self._expression('Define', name, expr, name)
+        if node is None:
+            node = self._node.Define(name, code)
+            if sig:
+                expressionCache.set_type(sig, str(node.GetColumnType(name)))
+        return NodeProxy(node)
+
+    def Filter(self, expr, *args):
+        if not isinstance(expr, str):
+            return self._wrap(self._node.Filter(expr, *args))
+        node, code, _ = self._expression('Filter', args[0] if args and args[0] else expr, expr, args[0] if args else '')
+        return NodeProxy(node if node is not None else self._node.Filter(code, *args))
+
+#__________________________________________________________
+def wrap_node(node):
+    '''
+    Return node behind a NodeProxy when the expression cache or the profiler is enabled.
+    '''
+    return NodeProxy(node) if expressionCache or profiler else node
+
+def unwrap_node(node):
+    return node._node if isinstance(node, NodeProxy) else node
+
+def record_expressions():
+    '''
+    Record the new expressions of the last event loop, if any, compiled later by compile_expressions().
+    '''
+    if expressionCache:
+        expressionCache.record()
+
+def compile_expressions():
+    '''
+    Compile the expressions recorded by this process and its workers, once they are all done.
+    '''
+    if expressionCache:
+        expressionCache.build()
@@ -0,0 +1,212 @@
+import os
+import time
+import traceback
+import multiprocessing
+import multiprocessing.connection
+
+from .memory import rss, format_size
+from .logger import rootLogger
+
+#__________________________________________________________
+def split_core_budget(ncores: int, ntasks: int, jobs: int=0):
+    '''
+    Split a global core budget between worker processes and implicit-MT threads.
+    jobs <= 0 means one worker per task as long as cores are available.
+    Return (workers, threads per worker).
+    '''
+    ncores = max(1, ncores)
+    workers = jobs if jobs > 0 else ncores
+    workers = max(1, min(workers, ntasks, ncores))
+    threads = max(1, ncores // workers)
+    return workers, threads
+
+# work shared with forked workers, only task indices cross the process boundary
+_context = {}
+
+def _worker(conn):
+    '''
+    Loop of a forked worker: run the (index, nthreads) tasks received on conn until None,
+    send back (index, ok, result or exception, elapsed time).
+    '''
+    func, tasks = _context['func'], _context['tasks']
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        index, nthreads = message
+        start_time = time.time()
+        try:
+            reply = (index, True, func(*tasks[index], nthreads=nthreads) if nthreads else func(*tasks[index]))
+        except Exception as e:
+            traceback.print_exc()
+            reply = (index, False, e)
+        try:
+            conn.send(reply + (time.time() - start_time,))
+        except Exception as e:
+            # result or exception that cannot be pickled
+            conn.send((index, False, RuntimeError(f'{e}: {reply[2]!r}'), time.time() - start_time))
+    conn.close()
+
+def _start_worker(ctx, pool, threads):
+    conn, child = ctx.Pipe()
+    process = ctx.Process(target=_worker, args=(child,))
+    process.start()
+    child.close()
+    pool[conn] = {'process': process, 'threads': threads, 'task': None}
+    return conn
+
+def _stop_worker(worker, conn):
+    '''
+    Let an idle worker exit, kill a busy one.
+    '''
+    if worker['task'] is None:
+        try:
+            conn.send(None)
+        except OSError:
+            pass
+    else:
+        worker['process'].terminate()
+    worker['process'].join()
+    conn.close()
+
+#__________________________________________________________
+def run_tasks(func, tasks: list, workers: int, labels: list=None, callback=None,
+              memory_budget: int=0, threads: int=0) -> list:
+    '''
+    Run func(*task) for every task in a pool of forked worker processes.
+    Workers inherit the loaded libraries and geometry of the parent process,
+    so the parent must not have started the implicit-MT thread pool yet.
+    Progress is reported when each task finishes, results keep the task order.
+    callback(index, result) is called in the parent process as soon as a task is done.
+    With memory_budget (bytes), the resident memory of the workers is sampled and, when it
+    gets close to the budget, fewer tasks are run at once and the idle workers beyond that
+    limit exit. Once a single task runs at a time, the threads (implicit-MT threads of each
+    task) are halved instead: the next tasks run as func(*task, nthreads=n) in new workers.
+    The peak is reported.
+    '''
+    labels = labels or [str(i) for i in range(len(tasks))]
+    results = [None]*len(tasks)
+
+    # nothing to gain from a pool, unless the memory of a single worker is watched
+    if workers <= 1 and not memory_budget:
+        for i, task in enumerate(tasks):
+            start_time = time.time()
+            results[i] = func(*task)
+            print(f'----> [{i+1}/{len(tasks)}] {labels[i]} done in {time.time()-start_time:.1f}s')
+            if callback: callback(i, results[i])
+        return results
+
+    _context['func'] = func
+    _context['tasks'] = tasks
+    print(f'----> Info: Running {len(tasks)} tasks on {workers} worker processes')
+    ctx = multiprocessing.get_context('fork')
+    pool = {}
+    try:
+        # tasks are sent as workers free up, so the concurrency and the threads can be lowered
+        limit, nthreads, peak = workers, threads, 0
+        adjusted = False
+        pending = list(range(len(tasks)))
+        ndone = 0
+        while pending or any(w['task'] is not None for w in pool.values()):
+            # idle workers beyond the limit, or started with more threads than allowed now, exit
+            for conn, w in list(pool.items()):
+                if w['task'] is None and (len(pool) > limit or w['threads'] > nthreads):
+                    _stop_worker(pool.pop(conn), conn)
+            running = sum(w['task'] is not None for w in pool.values())
+            while pending and running < limit:
+                conn = next((c for c, w in pool.items() if w['task'] is None), None) or _start_worker(ctx, pool, nthreads)
+                i = pending.pop(0)
+                pool[conn]['task'] = i
+                conn.send((i, nthreads if nthreads < threads else None))
+                running += 1
+            ready = multiprocessing.connection.wait(list(pool), timeout=2)
+
+            # lowered at most once between two finished tasks, the memory of running ones does not go down
+            if memory_budget:
+                used = sum(rss(w['process'].pid) for w in pool.values())
+                peak = max(peak, used)
+                if used > 0.9*memory_budget and not adjusted:
+                    if limit > 1:
+                        limit = max(1, min(limit, running) - 1)
+                        rootLogger.warning(f'Workers use {format_size(used)} of the {format_size(memory_budget)} memory budget, '
+                                           f'running at most {limit} tasks at once')
+                        adjusted = True
+                    elif nthreads > 1:
+                        nthreads = max(1, nthreads // 2)
+                        rootLogger.warning(f'Workers use {format_size(used)} of the {format_size(memory_budget)} memory budget, '
+                                           f'running the next tasks on {nthreads} threads')
+                        adjusted = True
+
+            for conn in ready:
+                w = pool[conn]
+                try:
+                    index, ok, result, elapsed = conn.recv()
+                except EOFError:
+                    w['process'].join()
+                    raise RuntimeError(f'Worker of task {labels[w["task"]]} died with exit code {w["process"].exitcode}')
+                w['task'] = None
+                adjusted = False
+                if not ok:
+                    rootLogger.error(f'Task {labels[index]} failed')
+                    raise result
+                results[index] = result
+                ndone += 1
+                print(f'----> [{ndone}/{len(tasks)}] {labels[index]} done in {elapsed:.1f}s')
+                if callback: callback(index, result)
+        if memory_budget:
+            print(f'----> Info: Peak memory of the workers {format_size(peak)} (budget {format_size(memory_budget)})')
+    finally:
+        for conn, w in pool.items():
+            _stop_worker(w, conn)
+        _context.clear()
+    return results
+
+#__________________________________________________________
+def run_tasks_dask(func, tasks: list, workers: int, labels: list=None,
+                   callback=None, address=None) -> list:
+    '''
+    Run func(*task) for every task on a dask.distributed cluster.
+    Without address a LocalCluster of 'workers' processes is started on this machine,
+    otherwise the tasks are sent to the scheduler at address (e.g. tcp://host:8786),
+    or to a cluster object started by the caller, which is left running.
+    func and tasks must be picklable, the workers share the file system of the submitting process.
+    '''
+    try:
+        from dask.distributed import Client, LocalCluster, as_completed as dask_completed
+    except ImportError:
+        raise RuntimeError('The dask executor needs dask.distributed, install it with "pip install dask distributed"')
+
+    labels = labels or [str(i) for i in range(len(tasks))]
+    results = [None]*len(tasks)
+    if len(tasks) == 0:
+        return results
+
+    cluster = None
+    if address:
+        client = Client(address)
+    else:
+        # one single-threaded dask worker per process, RDF implicit MT provides the threads
+        cluster = LocalCluster(n_workers=workers, threads_per_worker=1, processes=True)
+        client = Client(cluster)
+    print(f'----> Info: Running {len(tasks)} tasks on dask scheduler {client.scheduler.address}')
+
+    try:
+        futures = {}
+        for i, task in enumerate(tasks):
+            fut = client.submit(func, *task, key=f'mgana-{labels[i]}-{time.time_ns()}', pure=False)
+            futures[fut.key] = (i, fut, time.time())
+        ndone = 0
+        for fut in dask_completed([f for _, f, _ in futures.values()]):
+            index, _, submit_time = futures[fut.key]
+            try:
+                results[index] = fut.result()
+            except Exception:
+                rootLogger.error(f'Task {labels[index]} failed')
+                raise
+            ndone += 1
+            print(f'----> [{ndone}/{len(tasks)}] {labels[index]} done after {time.time()-submit_time:.1f}s')
+            if callback: callback(index, results[index])
+    finally:
+        client.close()
+        if cluster: cluster.close()
+    return results
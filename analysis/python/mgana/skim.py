@@ -0,0 +1,104 @@
+import os
+import json
+import ROOT
+
+from .index import scan_files
+from .dataset import friend_levels, alias_friends
+
+# conversion of the passing global entries into per-file entry lists, done in C++
+_SKIM_CODE = '''
+#include <algorithm>
+#include <string>
+#include <vector>
+#include "TEntryList.h"
+namespace mgana_skim {
+  TEntryList* build( std::vector<ULong64_t> entries, const std::vector<std::string>& files,
+                     const std::vector<Long64_t>& offsets, const char* treeName ) {
+    std::sort( entries.begin(), entries.end() );
+    auto list = new TEntryList( "skim", "", treeName, "" );
+    std::size_t ifile = 0;
+    auto it = entries.begin();
+    for ( ; ifile < files.size(); ++ifile ) {
+      TEntryList sub( "", "", treeName, files[ifile].c_str() );
+      for ( ; it != entries.end() && (Long64_t)*it < offsets[ifile + 1]; ++it ) sub.Enter( *it - offsets[ifile] );
+      if ( sub.GetN() > 0 ) list->Add( &sub );
+    }
+    return list;
+  }
+}
+'''
+
+# chains read through an entry list, kept alive as long as their dataframes
+_chains = []
+
+#__________________________________________________________
+def book_skim(node):
+    '''
+    Book the global entry numbers of the events passing a filtered node.
+    rdfentry_ is the entry of the input chain only in a sequential event loop,
+    the dataframe must be created with implicit MT disabled.
+    '''
+    if ROOT.ROOT.IsImplicitMTEnabled():
+        raise RuntimeError('Skims need a sequential event loop, disable implicit MT before creating the dataframe')
+    return node.Take['ULong64_t']('rdfentry_')
+
+#__________________________________________________________
+def write_skim(path: str, fileList: list, entries, eventsProcessed: int=None, treeName: str='events') -> int:
+    '''
+    Write the passing entries (global entries of the chain of fileList) as a TEntryList
+    'skim' over the plain input files, next to the list of inputs 'skimInputs'
+    and the initial number of events. Return the number of entries.
+    '''
+    ROOT.gInterpreter.Declare(_SKIM_CODE)
+    # entries refer to the base files when the inputs are friend outputs
+    base = friend_levels(fileList, scan_files(fileList))[-1]
+    files = ROOT.vector('string')()
+    offsets = ROOT.vector('Long64_t')()
+    offsets.push_back(0)
+    for f, info in zip(base, scan_files(base)):
+        files.push_back(os.path.abspath(f))
+        offsets.push_back(offsets[offsets.size() - 1] + info['entries'])
+
+    elist = ROOT.mgana_skim.build(entries, files, offsets, treeName)
+    tf = ROOT.TFile.Open(path, 'RECREATE')
+    elist.Write('skim')
+    ROOT.TNamed('skimInputs', json.dumps([os.path.abspath(f) for f in fileList])).Write()
+    if eventsProcessed is not None:
+        ROOT.TParameter(int)('eventsProcessed', eventsProcessed).Write()
+    n = elist.GetN()
+    tf.Close()
+    elist.Delete()
+    return n
+
+#__________________________________________________________
+def skim_dataframe(path: str, treeName: str='events'):
+    '''
+    RDataFrame reading only the entries of a skim written by write_skim,
+    with the friend outputs of its inputs attached as in dataset.make_dataframe.
+    '''
+    tf = ROOT.TFile.Open(path, 'READ')
+    if not tf or tf.IsZombie():
+        raise OSError(f'Can not open skim {path}')
+    elist = tf.Get('skim')
+    elist.SetDirectory(ROOT.nullptr)
+    inputs = json.loads(tf.Get('skimInputs').GetTitle())
+    tf.Close()
+
+    levels = friend_levels(inputs, scan_files(inputs))
+    chain = ROOT.TChain(treeName)
+    for f in levels[-1]:
+        chain.Add(f)
+    chain.SetEntryList(elist)
+    friends = []
+    for i, level in enumerate(levels[:-1]):
+        friend = ROOT.TChain(treeName)
+        for f in level:
+            friend.Add(f)
+        chain.AddFriend(friend, f'friend{i}')
+        friends.append(friend)
+    _chains.append((chain, elist, friends))
+
+    df = ROOT.RDataFrame(chain)
+    if len(levels) > 1:
+        df = alias_friends(df, len(levels) - 1)
+    return df
@@ -0,0 +1,179 @@
+import os
+import time
+import tempfile
+
+# named storage profiles of the stage snapshots, missing keys keep the ROOT defaults
+#   compression: 'zstd', 'lz4', 'zlib' or 'lzma', with level 1-9 (0 for none)
+#   basketSize:  initial basket size in bytes (TTree only)
+#   autoFlush:   > 0 entries per cluster, < 0 bytes per cluster
+#   splitLevel:  split level of the branches (TTree only)
+#   format:      'ttree', 'rntuple', or 'arrow'/'parquet' (see columnar.py, needs pyarrow)
+#   rowGroupSize: input entries per Arrow record batch / Parquet row group
+STORAGE_PROFILES = {
+    'default':   {},
+    # stage outputs are read many times: cheap decompression, large clusters
+    'fast-read': {'compression': 'lz4',  'level': 4, 'basketSize': 256*1024, 'autoFlush': -50*1000*1000, 'splitLevel': 99},
+    'balanced':  {'compression': 'zstd', 'level': 5, 'basketSize': 128*1024, 'autoFlush': -30*1000*1000, 'splitLevel': 99},
+    'small':     {'compression': 'lzma', 'level': 8, 'autoFlush': -30*1000*1000},
+    'rntuple':   {'format': 'rntuple', 'compression': 'zstd', 'level': 5},
+    # for python/ML tooling: uncompressed Arrow IPC is memory-mapped without copy
+    'arrow':     {'format': 'arrow', 'rowGroupSize': 1000000},
+    'parquet':   {'format': 'parquet', 'compression': 'zstd', 'level': 3, 'rowGroupSize': 1000000},
+}
+
+_ALGORITHMS = {'zlib': 'kZLIB', 'lzma': 'kLZMA', 'lz4': 'kLZ4', 'zstd': 'kZSTD'}
+
+#__________________________________________________________
+def get_profile(spec) -> dict:
+    '''
+    Resolve a storage profile: a name of STORAGE_PROFILES or a dict,
+    whose optional 'base' names the profile it extends.
+    '''
+    if isinstance(spec, str):
+        if spec not in STORAGE_PROFILES:
+            raise ValueError(f'Unknown storage profile {spec}, choose from {", ".join(STORAGE_PROFILES)}')
+        return dict(STORAGE_PROFILES[spec])
+    profile = get_profile(spec.get('base', 'default'))
+    profile.update({k: v for k, v in spec.items() if k != 'base'})
+    return profile
+
+#__________________________________________________________
+def snapshot_options(profile: dict, lazy: bool=False):
+    '''
+    RSnapshotOptions implementing a storage profile.
+    '''
+    import ROOT
+    opts = ROOT.RDF.RSnapshotOptions()
+    opts.fLazy = lazy
+    if 'compression' in profile:
+        algo = _ALGORITHMS[profile['compression']]
+        opts.fCompressionAlgorithm = getattr(ROOT.ROOT.RCompressionSetting.EAlgorithm, algo)
+    if 'level' in profile:
+        opts.fCompressionLevel = profile['level']
+    if 'autoFlush' in profile:
+        opts.fAutoFlush = profile['autoFlush']
+    if 'splitLevel' in profile:
+        opts.fSplitLevel = profile['splitLevel']
+    if 'basketSize' in profile:
+        opts.fBasketSize = profile['basketSize']
+    if profile.get('format', 'ttree') == 'rntuple':
+        if not hasattr(ROOT.RDF, 'ESnapshotOutputFormat'):
+            raise RuntimeError('RNTuple snapshots need ROOT >= 6.34')
+        opts.fOutputFormat = ROOT.RDF.ESnapshotOutputFormat.kRNTuple
+    return opts
+
+# full reading of every entry, the same work for both formats
+_READ_CODE = '''
+#include "ROOT/RVersion.hxx"
+#include "TFile.h"
+#include "TTree.h"
+#if ROOT_VERSION_CODE >= ROOT_VERSION(6,34,0)
+#include "ROOT/RNTupleReader.hxx"
+#endif
+namespace mgana_storage {
+#if ROOT_VERSION_CODE >= ROOT_VERSION(6,36,0)
+  using ROOT::RNTupleReader;
+#elif ROOT_VERSION_CODE >= ROOT_VERSION(6,34,0)
+  using ROOT::Experimental::RNTupleReader;
+#endif
+  long long readTree( const char* path, const char* name ) {
+    auto f = TFile::Open( path );
+    auto t = f->Get<TTree>( name );
+    long long bytes = 0;
+    for ( Long64_t i = 0; i < t->GetEntries(); ++i ) bytes += t->GetEntry( i );
+    delete f;
+    return bytes;
+  }
+  long long readNTuple( const char* path, const char* name ) {
+#if ROOT_VERSION_CODE >= ROOT_VERSION(6,34,0)
+    auto reader = RNTupleReader::Open( name, path );
+    for ( auto i : *reader ) reader->LoadEntry( i );
+    return reader->GetNEntries();
+#else
+    return -1;
+#endif
+  }
+}
+'''
+
+#__________________________________________________________
+def compare_profiles(files: list, profiles: list, columns: list=None, repeat: int=1, treeName: str='events') -> list:
+    '''
+    Write the columns (all of them by default) of files with each storage profile,
+    then read every entry back. Return one row per profile with size, write and read times
+    (best of repeat reads, the page cache is warm after the first one).
+    '''
+    import ROOT
+    ROOT.gInterpreter.Declare(_READ_CODE)
+    fileList = ROOT.vector('string')()
+    for f in files:
+        fileList.push_back(f)
+    colList = ROOT.vector('string')()
+    for c in (columns or []):
+        colList.push_back(c)
+
+    rows = []
+    workDir = tempfile.mkdtemp(prefix='mgana_storage_')
+    for name in profiles:
+        profile = get_profile(name)
+        if profile.get('format') in ('arrow', 'parquet'):
+            rows.append(_compare_columnar(files, fileList, name, profile, columns, repeat, workDir, treeName))
+            continue
+        outFile = os.path.join(workDir, f'{name}.root')
+        df = ROOT.RDataFrame(treeName, fileList)
+        start_time = time.perf_counter()
+        if columns:
+            df.Snapshot(treeName, outFile, colList, snapshot_options(profile))
+        else:
+            df.Snapshot(treeName, outFile, "", snapshot_options(profile))
+        write = time.perf_counter() - start_time
+
+        reads = []
+        for i in range(repeat):
+            start_time = time.perf_counter()
+            if profile.get('format', 'ttree') == 'rntuple':
+                ROOT.mgana_storage.readNTuple(outFile, treeName)
+            else:
+                ROOT.mgana_storage.readTree(outFile, treeName)
+            reads.append(time.perf_counter() - start_time)
+        rows.append({'profile': name, 'size': os.path.getsize(outFile), 'write': write, 'read': min(reads)})
+        os.remove(outFile)
+    os.rmdir(workDir)
+
+    print(f'----> Info: Storage profiles on {len(files)} files')
+    print(f'      {"profile":12} {"size [MB]":>10} {"write [s]":>10} {"read [s]":>10}')
+    for r in rows:
+        print(f'      {r["profile"]:12} {r["size"]/2**20:10.2f} {r["write"]:10.2f} {r["read"]:10.2f}')
+    return rows
+
+def _compare_columnar(files: list, fileList, name: str, profile: dict, columns: list, repeat: int, workDir: str, treeName: str) -> dict:
+    '''
+    Size, write and read times of a columnar profile, the row groups written by columnar.write_columnar.
+    Without columns, the columns of supported types are written.
+    '''
+    import ROOT
+    import pyarrow.compute as pc
+    from .columnar import write_columnar, read_columnar, columnar_path, supported_type
+    from .chunking import full_ranges
+    from .index import scan_files
+
+    if not columns:
+        df = ROOT.RDataFrame(treeName, fileList)
+        columns = [str(c) for c in df.GetColumnNames() if supported_type(str(df.GetColumnType(c)))]
+    outFile = columnar_path(os.path.join(workDir, f'{name}.root'), profile)
+    start_time = time.perf_counter()
+    write_columnar(lambda df: df, full_ranges(files, scan_files(files)), columns, outFile, profile, {})
+    write = time.perf_counter() - start_time
+
+    reads = []
+    for i in range(repeat):
+        start_time = time.perf_counter()
+        # every value is touched, memory-mapped columns are not read until then
+        for col in read_columnar(outFile).itercolumns():
+            while hasattr(col.type, 'value_type'):
+                col = pc.list_flatten(col)
+            pc.sum(col)
+        reads.append(time.perf_counter() - start_time)
+    row = {'profile': name, 'size': os.path.getsize(outFile), 'write': write, 'read': min(reads)}
+    os.remove(outFile)
+    return row
@@ -15,12 +15,25 @@ nCPUS = 2
 #produces ROOT TTrees, default is False
 saveCutTree = False
 
+#produces entry lists <outputDir>/<process>_<cut>_skim.root of the passing events, default is False
+#read them back with 'batch_sel0_skim':{} in the processList of a final script on <outputDir>
+saveCutSkim = False
+
+#apply the cuts one after the other (each on the survivors of the previous one) and print the cutflow, default is False
+cutChain = False
+
 #Optinally Define new variables
 defineList = {"strip_stdx":"StdDev(strip_x)",
               "strip_meanx":"Mean(strip_x)",
               "pixel_meanx":"Mean(pixel_x)"
               }
 
+#Optional: systematic variations, every histogram is also filled for each variation in the same event loop
+#and saved as <histo>__<variation>__<tag>, drawn by mgana plot as an uncertainty band
+# variationList = {"strip_scale":{"column":"strip_meanx", "exprs":{"down":"0.98*strip_meanx", "up":"1.02*strip_meanx"}},
+#                  "pixel_shift":{"column":"pixel_x", "expr":"ROOT::RVec<ROOT::RVecD>{pixel_x-0.1, pixel_x+0.1}", "tags":["down","up"]},
+#                 }
+
 #Dictionnay of the list of cuts. The key is the name of the selection that will be added to the output file
 cutList = {"sel0":"strip_meanx > -5 && strip_meanx < 10",
            "sel1":"pixel_meanx < 10",
@@ -12,6 +12,10 @@ stacksig       = ['stack','nostack']
 #IO directory
 inputDir       = 'final'
 outputDir      = 'plots'
+# optional: keep all merged histograms in one file, reused while the inputs are unchanged
+# histoCache     = 'plots/histos.root'
+# optional: draw the systematic variations of the final histograms as a band on the stack, default True
+# systematics    = False
 
 #List of 1D histogram names to be assembled (usually represents one physical variable)
 variables = ['pixel_X','strip_1D']
@@ -17,6 +17,8 @@ outputDir = "stage1"
 #Mandatory: List of processes (files)
 # key: string, input file name (without .root) or directory name
 # value: map, 'fraction', 'chunks', 'output' is output filename (without .root)
+#        chunks hold equal numbers of entries (cut on TTree cluster boundaries),
+#        fraction is the exact fraction of entries to process
 processList = {
     'batch':{}, # option1: key is directory name
     # 'dummy_process':{}, # option2: key is file name
@@ -26,10 +28,23 @@ processList = {
 #Optional: number of threads
 nCPUS       = 4
 
+#Optional: storage of the outputs, a profile name of mgana/storage.py or a dict
+# storageProfile = 'fast-read'
+# storageProfile = {'base': 'balanced', 'level': 7}
+# write only the new columns, read later together with the input files
+# friendOutput = True
+
 #Optional: geometry and readout
 geometryFile = ['Megat.xml', 'TPC_readout.xml']
 readoutName = ['TpcStripHits', 'TpcPixelHits']
 
+#Optional: Python functions compiled with numba (needs numba), called as Numba::<name> in Define
+# import numpy as np
+# from mgana.pyfunc import declare
+# @declare(['RVec<float>', 'RVec<float>'], 'RVec<float>')
+# def hit_r(x, y):
+#     return np.sqrt(x*x + y*y)
+
 #Mandatory: RDFanalysis class where the use defines the operations on the TTree
 class RDFanalysis():
     #__________________________________________________________
@@ -40,6 +55,7 @@ class RDFanalysis():
                # .Define("dummy_collection", "__pkgname__::dummy_collection(TpcSegStripHits)")
                .Define("strip_x", "__pkgname__::dummy_collection(TpcSegStripHits)")
                .Define("pixel_x", "__pkgname__::dummy_collection(TpcSegPixelHits)")
+               # .Define("strip_r", "Numba::hit_r(strip_x, strip_y)")
               )
         return df2
 
@@ -0,0 +1,8 @@
+#Stages of the analysis run by 'mgana pipeline pipeline.py', scripts are relative to this file
+#command is run (default), final or plot, options are those of that mgana command
+stages = {
+    'stage1': {'script': 'analysis_stage1.py', 'options': []},
+    #each process of the final stage starts as soon as the stage1 output of the same name is complete
+    'final':  {'script': 'analysis_final.py', 'command': 'final', 'after': ['stage1']},
+    'plot':   {'script': 'analysis_plot.py', 'command': 'plot', 'after': ['final']},
+}
@@ -0,0 +1,99 @@
+import os
+import time
+from contextlib import contextmanager
+
+#__________________________________________________________
+class PhaseTimer:
+    '''
+    Wall time spent in named phases, reported in the order they were first entered.
+    '''
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.) + time.perf_counter() - start_time
+
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+    def report(self, title: str):
+        width = max([len(n) for n in self.phases] + [5])
+        print(f'----> Info: {title}')
+        for name, elapsed in self.phases.items():
+            print(f'      {name:{width}} : {elapsed:7.2f} s')
+        print(f'      {"total":{width}} : {self.total():7.2f} s')
+
+# phases of the startup of the current mgana command
+startupTimer = PhaseTimer()
+
+#__________________________________________________________
+def process_io() -> dict:
+    '''
+    Bytes read and written by this process so far (Linux /proc/self/io), empty if unavailable.
+    rchar/wchar count every read/write call, read_bytes/write_bytes the storage layer only.
+    '''
+    io = {}
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                key, value = line.split(':')
+                io[key.strip()] = int(value)
+    except OSError:
+        pass
+    return io
+
+def blkio_delay() -> float:
+    '''
+    Seconds this process waited for block I/O (delay accounting of /proc/self/stat),
+    0 if the kernel does not account it.
+    '''
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return int(fields[39])/os.sysconf('SC_CLK_TCK')
+    except (OSError, IndexError, ValueError):
+        return 0.
+
+#__________________________________________________________
+class LoopMeter:
+    '''
+    CPU time, waiting time and bytes read by ROOT files of this process during an event loop.
+    The waiting time is the part of wall time x threads not spent on a CPU: I/O, or threads idle.
+    '''
+    def __init__(self):
+        import ROOT
+        self.ROOT = ROOT
+        self.start = (time.perf_counter(), time.process_time(), blkio_delay(),
+                      ROOT.TFile.GetFileBytesRead(), ROOT.TFile.GetFileReadCalls())
+
+    def stop(self, threads: int) -> dict:
+        wall, cpu, blkio, nbytes, calls = self.start
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        threads = max(1, threads)
+        return {'wall': wall, 'cpu': cpu, 'threads': threads,
+                'wait': max(0., wall*threads - cpu), 'blkio': blkio_delay() - blkio,
+                'utilisation': cpu/(wall*threads) if wall > 0 else 0.,
+                'bytesRead': int(self.ROOT.TFile.GetFileBytesRead() - nbytes),
+                'readCalls': int(self.ROOT.TFile.GetFileReadCalls() - calls)}
+
+#__________________________________________________________
+def limiting_factor(loop: dict, remote: bool=False) -> str:
+    '''
+    What limited an event loop measured by LoopMeter: 'CPU' when the threads spent more time
+    on a CPU than waiting, 'I/O' when the block I/O delay is most of the waiting, 'idle threads'
+    when it is accounted and small. Reads of remote inputs are not block I/O, so with remote
+    inputs or without delay accounting a small delay gives 'I/O or idle threads'.
+    '''
+    if loop['cpu'] >= loop['wait']:
+        return 'CPU'
+    if loop['blkio'] >= 0.5*loop['wait']:
+        return 'I/O'
+    if loop['blkio'] > 0 and not remote:
+        return 'idle threads'
+    return 'I/O or idle threads'
@@ -1,6 +1,7 @@
 import os,sys
 import subprocess, shlex
 import json
+import functools
 
 from .logger import rootLogger
 
@@ -30,14 +31,30 @@ def _find_containing_dir(tgt_file: str='.mgana',
         contain_dir = _find_containing_dir(tgt_file, parent_dir)
     return contain_dir
 
+@functools.lru_cache(maxsize=None)
+def _package_path(cur_dir: str) -> str:
+    return _find_containing_dir(tgt_file='.mgana', cur_dir=cur_dir)
+
 def current_mgana_path() -> str:
+    '''
+    Top directory of the package containing the working directory, resolved once per directory.
+    '''
     try:
-        path = _find_containing_dir(tgt_file='.mgana', cur_dir=os.getcwd())
-        return path
+        return _package_path(os.getcwd())
     except FileNotFoundError as e:
         rootLogger.exception(f"Can not .mgana find in any parent directory of {os.getcwd()}\n\n")
         sys.exit(1)
 
+@functools.lru_cache(maxsize=None)
+def _package_env(pkg_dir: str) -> dict:
+    return parse_meta(get_absolute_directory('.mgana/env.json', pkg_dir))
+
+def package_env() -> dict:
+    '''
+    Metadata of the current package (.mgana/env.json), parsed once per package.
+    '''
+    return _package_env(current_mgana_path())
+
 def replace_all(input: str, repl) -> str:
     '''
     Utility to replace each appearance of corresponding variable in
@@ -151,8 +168,7 @@ def setup_megat():
     Update k4megat run environment
     '''
     # get current run environ
-    pkg_dir = current_mgana_path()
-    envs = parse_meta(get_absolute_directory('.mgana/env.json', pkg_dir))
+    envs = package_env()
     old_root = os.getenv('MEGAT_ROOT')
 
     # update run environ from current pkg metadata
@@ -171,25 +187,34 @@ def setup_megat():
         ''')
 
 def megat_geometry_path() -> str:
-    pkg_dir = current_mgana_path()
-    envs = parse_meta(get_absolute_directory('.mgana/env.json', pkg_dir))
+    envs = package_env()
     return os.path.join(envs['megat'],'geometry/compact')
 
 def mgana_lib_path() -> str:
-    pkg_dir = current_mgana_path()
-    envs = parse_meta(get_absolute_directory('.mgana/env.json', pkg_dir))
+    envs = package_env()
     return os.path.join(envs['install'],'lib')
 
 def mgana_script_path() -> str:
-    pkg_dir = current_mgana_path()
-    envs = parse_meta(get_absolute_directory('.mgana/env.json', pkg_dir))
+    envs = package_env()
     return envs['script']
 
 def mgana_workspace_path() -> str:
-    pkg_dir = current_mgana_path()
-    envs = parse_meta(get_absolute_directory('.mgana/env.json', pkg_dir))
+    envs = package_env()
     return envs['workspace']
 
+def temporary_path(path: str) -> str:
+    '''
+    Return a process-unique temporary name next to path, used to write outputs atomically.
+    '''
+    return f'{path}.{os.getpid()}.tmp'
+
+def commit_path(tmp_path: str,
+                path: str):
+    '''
+    Atomically move a completed temporary output to its final name.
+    '''
+    os.replace(tmp_path, path)
+
 def get_io_directory(ioDir: str,
                      create: bool=True) -> str:
     if not ioDir:
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+
+from .logger import rootLogger
+
+# assignment of the watched input files, kept in the stage output directory
+WATCH_FILE = '.mgana_watch.json'
+
+#__________________________________________________________
+class WatchState:
+    '''
+    Input files of the outputs processed by mgana run --watch: the files of the regular chunks,
+    fixed when the output is first watched, and the files of each chunk added afterwards.
+    Reruns with --watch plan the same chunks from it, so their outputs stay cached; a run
+    without --watch resets the outputs it plans.
+    '''
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, WATCH_FILE)
+        self.outputs = {}
+        try:
+            with open(self.path, 'r') as f:
+                self.outputs = json.load(f)['outputs']
+        except (OSError, ValueError, KeyError):
+            rootLogger.debug(f'No watch state in {directory}')
+
+    def regular(self, output: str) -> list:
+        '''
+        Input files of the regular chunks of output, None if output is not watched.
+        '''
+        return self.outputs[output]['files'] if output in self.outputs else None
+
+    def chunks(self, output: str) -> dict:
+        '''
+        Chunks added by the watch mode, {chunk output: input files}.
+        '''
+        return self.outputs[output]['chunks'] if output in self.outputs else {}
+
+    def assigned(self, output: str) -> set:
+        files = set(self.regular(output) or [])
+        for chunk in self.chunks(output).values():
+            files.update(chunk)
+        return files
+
+    def start(self, output: str, files: list):
+        self.outputs[output] = {'files': sorted(files), 'chunks': {}}
+        self.save()
+
+    def add(self, output: str, files: list) -> str:
+        '''
+        Assign new input files to a new chunk of output, return the chunk output name.
+        '''
+        chunks = self.outputs[output]['chunks']
+        name = f'{output}/chunk_w{len(chunks)}.root'
+        chunks[name] = sorted(files)
+        self.save()
+        return name
+
+    def reset(self, output: str):
+        '''
+        Forget output, its chunks are planned from the process directory again.
+        '''
+        if self.outputs.pop(output, None) is not None:
+            self.save()
+
+    def save(self):
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'outputs': self.outputs}, f, indent=1)
+        os.replace(tmp, self.path)
+
+#__________________________________________________________
+class DirectoryWatcher:
+    '''
+    ROOT files arriving in a set of directories. With inotify_simple installed the directories
+    are watched with inotify, otherwise they are polled every interval seconds.
+    A file is complete once it was closed after writing (inotify) or not modified for settle seconds.
+    '''
+    def __init__(self, directories, interval: float=30., settle: float=60.):
+        self.directories = list(directories)
+        self.interval = interval
+        self.settle = settle
+        self.closed = set()
+        self.inotify = None
+        try:
+            from inotify_simple import INotify, flags
+            self.inotify = INotify()
+            self.wds = {self.inotify.add_watch(d, flags.CLOSE_WRITE | flags.MOVED_TO): d for d in self.directories}
+            print(f'----> Info: Watching {len(self.directories)} directories with inotify')
+        except (ImportError, OSError):
+            self.inotify = None
+            print(f'----> Info: Polling {len(self.directories)} directories every {interval:.0f}s '
+                  '(install inotify_simple to be notified of new files)')
+
+    def files(self) -> list:
+        '''
+        ROOT files currently in the watched directories, temporary and hidden files excluded.
+        '''
+        files = []
+        for d in self.directories:
+            for name in sorted(os.listdir(d)):
+                if name.endswith('.root') and not name.startswith('.'):
+                    files.append(os.path.join(d, name))
+        return files
+
+    def complete(self, path: str) -> bool:
+        if path in self.closed:
+            return True
+        try:
+            return time.time() - os.path.getmtime(path) >= self.settle
+        except OSError:
+            return False
+
+    def wait(self):
+        '''
+        Block until a file is written in a watched directory or interval seconds passed.
+        '''
+        if self.inotify is None:
+            time.sleep(self.interval)
+            return
+        for event in self.inotify.read(timeout=int(self.interval*1000)):
+            self.closed.add(os.path.join(self.wds[event.wd], event.name))
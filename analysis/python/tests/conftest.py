@@ -0,0 +1,45 @@
+import os
+import sys
+import json
+
+import pytest
+
+# mgana is imported from the source tree
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+#__________________________________________________________
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    '''
+    An analysis package in tmp_path (.mgana/env.json) with tmp_path as working directory,
+    outputs go to tmp_path/workspace and the compiled caches to tmp_path/cache.
+    '''
+    os.makedirs(tmp_path / '.mgana')
+    os.makedirs(tmp_path / 'workspace')
+    env = {'megat': os.environ.get('MEGAT_ROOT', ''), 'workspace': str(tmp_path / 'workspace'),
+           'script': str(tmp_path), 'build': str(tmp_path / '.build'), 'install': str(tmp_path / '.install')}
+    with open(tmp_path / '.mgana' / 'env.json', 'w') as f:
+        json.dump(env, f)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('MGANA_CACHE_DIR', str(tmp_path / 'cache'))
+    return tmp_path
+
+#__________________________________________________________
+@pytest.fixture
+def make_events():
+    '''
+    Return a function writing a ROOT file with an 'events' tree of n entries,
+    columns x (entry number as double) and hits (RVec<float> of x % 5 values).
+    '''
+    ROOT = pytest.importorskip('ROOT')
+    def make(path, n, cluster=None):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        opts = ROOT.RDF.RSnapshotOptions()
+        if cluster:
+            opts.fAutoFlush = cluster
+        (ROOT.RDataFrame(n)
+             .Define('x', 'double(rdfentry_)')
+             .Define('hits', 'ROOT::RVecF(int(rdfentry_) % 5, float(rdfentry_))')
+             .Snapshot('events', str(path), ['x', 'hits'], opts))
+        return str(path)
+    return make
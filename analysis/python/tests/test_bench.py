@@ -0,0 +1,44 @@
+import sys
+
+import pytest
+
+from mgana.ana_bench import measure, compare
+
+# stands for an mgana run writing bench.root and its manifest, then exiting with status
+RUN = '''
+import sys
+for name in sys.argv[2:]:
+    open(name, 'w').close()
+sys.exit(int(sys.argv[1]))
+'''
+
+def _command(tmp_path, status, *files):
+    return [sys.executable, '-c', RUN, str(status)] + [str(tmp_path / f) for f in files]
+
+#__________________________________________________________
+def test_measure(tmp_path):
+    result = measure(_command(tmp_path, 0, 'bench.root', 'bench.root.manifest.json'),
+                     str(tmp_path), str(tmp_path / 'run.log'), ['bench.*'])
+    assert result['wall'] > 0 and result['maxrss'] > 0
+
+def test_failed_run(tmp_path):
+    with pytest.raises(RuntimeError, match='failed'):
+        measure(_command(tmp_path, 3, 'bench.root', 'bench.root.manifest.json'),
+                str(tmp_path), str(tmp_path / 'run.log'), ['bench.*'])
+
+def test_run_without_outputs(tmp_path):
+    # exit status 0 but no completed output, e.g. a stage error swallowed by the command
+    with pytest.raises(RuntimeError, match='wrote no bench'):
+        measure(_command(tmp_path, 0, 'bench.root'), str(tmp_path), str(tmp_path / 'run.log'), ['bench.*'])
+
+def test_outputs_of_previous_runs_removed(tmp_path):
+    measure(_command(tmp_path, 0, 'bench.root', 'bench.root.manifest.json'),
+            str(tmp_path), str(tmp_path / 'run.log'), ['bench.*'])
+    with pytest.raises(RuntimeError):
+        measure(_command(tmp_path, 0), str(tmp_path), str(tmp_path / 'run.log'), ['bench.*'])
+
+#__________________________________________________________
+def test_compare():
+    baseline = {'1': {'wall': 10.}, '4': {'wall': 4.}}
+    current = {'1': {'wall': 10.5}, '4': {'wall': 5.}, '8': {'wall': 2.}}
+    assert compare(current, baseline, 0.1) == ['4']
@@ -0,0 +1,61 @@
+import os
+import time
+
+from mgana.cache import output_key, runtime_key, StageCache, CACHE_FILE
+
+#__________________________________________________________
+def _write(path, data=b'0123456789'):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+def test_output_key(tmp_path):
+    a = _write(tmp_path / 'a.root')
+    key = output_key('runtime', [(a, 0, 10)])
+    assert output_key('runtime', [(a, 0, 10)]) == key
+    assert output_key('other', [(a, 0, 10)]) != key
+    assert output_key('runtime', [(a, 0, 5)]) != key
+    assert output_key('runtime', [(a, 0, 10)], {'storage': 'small'}) != key
+    assert output_key('runtime', [a]) != key
+
+    st = os.stat(a)
+    os.utime(a, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert output_key('runtime', [(a, 0, 10)]) != key
+
+def test_runtime_key(tmp_path):
+    script = _write(tmp_path / 'script.py', b'x = 1')
+    key = runtime_key(script, [], [])
+    assert runtime_key(script, [], []) == key
+    # a missing library only contributes its name
+    assert runtime_key(script, [str(tmp_path / 'libA.so')], []) != key
+    time.sleep(0.01)
+    _write(script, b'x = 2')
+    assert runtime_key(script, [], []) != key
+
+#__________________________________________________________
+def test_stage_cache(tmp_path):
+    cache = StageCache(str(tmp_path))
+    assert cache.lookup('ee.root', 'd1') is None
+    _write(tmp_path / 'ee.root')
+    cache.record('ee.root', 'd1', ['ee.root'], all=10)
+
+    reloaded = StageCache(str(tmp_path))
+    assert reloaded.lookup('ee.root', 'd1')['all'] == 10
+    assert reloaded.lookup('ee.root', 'd2') is None
+    os.remove(tmp_path / 'ee.root')
+    assert reloaded.lookup('ee.root', 'd1') is None
+    assert sorted(os.listdir(tmp_path)) == [CACHE_FILE]
+
+def test_invalid_cache(tmp_path):
+    with open(tmp_path / CACHE_FILE, 'w') as f:
+        f.write('{"version": 0, "outputs": {"a": {}}}')
+    cache = StageCache(str(tmp_path))
+    assert cache.outputs == {} and cache.memory == {}
+
+def test_memory_estimates(tmp_path):
+    cache = StageCache(str(tmp_path))
+    assert cache.memory_estimate('key:1000') is None
+    cache.record_memory('key:1000', 2**30, 2**28)
+    reloaded = StageCache(str(tmp_path))
+    assert reloaded.memory_estimate('key:1000') == (2**30, 2**28)
+    assert reloaded.memory_estimate('key:500') is None
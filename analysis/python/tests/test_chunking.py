@@ -0,0 +1,76 @@
+from mgana.chunking import full_ranges, plan_chunks, truncate_ranges, split_ranges, processed_events
+
+#__________________________________________________________
+def _sizes(chunkList):
+    return [sum(last - first for _, first, last in chunk) for chunk in chunkList]
+
+def _covered(chunkList):
+    return [r for chunk in chunkList for r in chunk]
+
+def test_full_ranges():
+    infos = [{'entries': 10}, {'entries': 0}, {'entries': 5}]
+    assert full_ranges(['a', 'b', 'c'], infos) == [('a', 0, 10), ('c', 0, 5)]
+
+#__________________________________________________________
+def test_equal_chunks_without_clusters():
+    chunkList = plan_chunks(['a'], [{'entries': 1000}], 3)
+    assert _sizes(chunkList) == [333, 333, 334]
+    assert _covered(chunkList) == [('a', 0, 333), ('a', 333, 666), ('a', 666, 1000)]
+
+def test_cluster_edges_minimise_largest_chunk():
+    info = {'entries': 1510, 'clusters': list(range(0, 1510, 300))}
+    chunkList = plan_chunks(['a'], [info], 4)
+    assert max(_sizes(chunkList)) == 600
+    assert sum(_sizes(chunkList)) == 1510
+    for chunk in chunkList[1:]:
+        assert chunk[0][1] % 300 == 0
+
+def test_chunks_across_files():
+    infos = [{'entries': 100, 'clusters': [0]}, {'entries': 250, 'clusters': [0]}, {'entries': 50, 'clusters': [0]}]
+    chunkList = plan_chunks(['a', 'b', 'c'], infos, 2)
+    assert chunkList == [[('a', 0, 100)], [('b', 0, 250), ('c', 0, 50)]]
+
+def test_more_chunks_than_boundaries():
+    infos = [{'entries': 100, 'clusters': [0]}]*3
+    assert _sizes(plan_chunks(['a', 'b', 'c'], infos, 5)) == [100, 100, 100]
+
+def test_fraction_is_exact_with_clusters():
+    info = {'entries': 1000, 'clusters': list(range(0, 1000, 10))}
+    chunkList = plan_chunks(['a'], [info], 4, 0.555)
+    assert sum(_sizes(chunkList)) == 555
+    assert len(chunkList) == 4
+
+def test_fraction_rounded_to_files():
+    infos = [{'entries': 1510}, {'entries': 800}]
+    assert plan_chunks(['a', 'b'], infos, 2, 0.5, 'file') == [[('a', 0, 1510)]]
+    assert plan_chunks(['a', 'b'], infos, 2, 0.1, 'file') == [[('a', 0, 1510)]]
+    assert plan_chunks(['a', 'b'], infos, 2, 0.9, 'file') == [[('a', 0, 1510)], [('b', 0, 800)]]
+
+def test_empty():
+    assert plan_chunks(['a'], [{'entries': 0}], 3) == []
+    assert plan_chunks(['a'], [{'entries': 10}], 3, 0.01) == []
+
+#__________________________________________________________
+def test_truncate_ranges():
+    ranges = [('a', 0, 10), ('b', 5, 20)]
+    assert truncate_ranges(ranges, 4) == [('a', 0, 4)]
+    assert truncate_ranges(ranges, 12) == [('a', 0, 10), ('b', 5, 7)]
+    assert truncate_ranges(ranges, 100) == ranges
+
+def test_split_ranges():
+    ranges = [('a', 0, 10), ('b', 5, 20)]
+    slices = split_ranges(ranges, 8)
+    assert slices == [[('a', 0, 8)], [('a', 8, 10), ('b', 5, 11)], [('b', 11, 19)], [('b', 19, 20)]]
+    assert split_ranges(ranges, 100) == [ranges]
+
+#__________________________________________________________
+def test_processed_events_pro_rata():
+    infos = [{'entries': 100, 'eventsProcessed': 1000}, {'entries': 50, 'eventsProcessed': None},
+             {'entries': 30, 'eventsProcessed': 90}]
+    ranges = [('a', 0, 100), ('b', 0, 50), ('c', 0, 30)]
+    assert processed_events(ranges, infos) == 1090
+    # --nevents 120: all of a and 20 entries of b, which has no eventsProcessed
+    assert processed_events(truncate_ranges(ranges, 120), infos) == 1000
+    # a chunk of a third of c
+    assert processed_events([('c', 10, 20)], infos[2:]) == 30
+    assert processed_events(truncate_ranges(ranges, 25), infos) == 250
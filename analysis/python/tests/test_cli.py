@@ -0,0 +1,27 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+BIN = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'bin', 'mgana')
+
+# run bin/mgana in a fresh interpreter, then report whether ROOT was imported
+CHECK = '''
+import sys, runpy
+sys.argv = ['mgana'] + sys.argv[1:]
+try:
+    runpy.run_path({bin!r}, run_name='__main__')
+except SystemExit:
+    pass
+print('ROOT' in sys.modules)
+'''
+
+#__________________________________________________________
+@pytest.mark.parametrize('command', ['init', 'build', 'run', 'final', 'plot', 'bench', 'pipeline'])
+def test_help_does_not_import_root(command):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    out = subprocess.run([sys.executable, '-c', CHECK.format(bin=BIN), command, '--help'],
+                         capture_output=True, text=True, env=env, check=True)
+    assert 'usage:' in out.stdout
+    assert out.stdout.strip().splitlines()[-1] == 'False'
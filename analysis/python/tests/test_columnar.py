@@ -0,0 +1,30 @@
+import pytest
+
+ROOT = pytest.importorskip('ROOT')
+pa = pytest.importorskip('pyarrow')
+
+from mgana.columnar import write_columnar, read_columnar
+from mgana.chunking import full_ranges
+from mgana.index import scan_files
+
+#__________________________________________________________
+@pytest.mark.parametrize('fmt', ['arrow', 'parquet'])
+def test_row_groups_of_one_graph(tmp_path, make_events, fmt):
+    files = [make_events(str(tmp_path / 'in' / f'f{i}.root'), n) for i, n in enumerate((250, 180))]
+    ranges = full_ranges(files, scan_files(files))
+    builds = []
+    def build(df):
+        builds.append(df)
+        return df.Filter('x > 10').Define('y', 'hits.size()*x')
+
+    out = str(tmp_path / f'out.{fmt}')
+    n = write_columnar(build, ranges, ['x', 'y', 'hits'], out, {'format': fmt, 'rowGroupSize': 100}, {'eventsProcessed': 430})
+    table = read_columnar(out)
+    # x restarts at 0 in the second file
+    expected = [float(x) for x in list(range(250)) + list(range(180)) if x > 10]
+    assert n == len(expected) == table.num_rows
+    assert table['x'].to_pylist() == expected
+    assert table['y'].to_pylist() == [float((int(x) % 5)*x) for x in expected]
+    assert table.schema.metadata[b'eventsProcessed'] == b'430'
+    if hasattr(ROOT.Internal.RDF, 'ChangeSpec'):
+        assert len(builds) == 1
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from mgana.expressions import parse_expression
+
+COLUMNS = {'x', 'hits', 'jet', 'jet.pt', 'rdfentry_'}
+
+#__________________________________________________________
+def test_columns_in_order():
+    assert parse_expression('hits.size() > x && x > 0', COLUMNS) == (['hits', 'x'], '_c0.size() > _c1 && _c1 > 0')
+
+def test_longest_dotted_prefix():
+    assert parse_expression('jet.pt[0] + jet.eta', COLUMNS) == (['jet.pt', 'jet'], '_c0[0] + _c1.eta')
+
+def test_literals_members_and_scopes():
+    expr = 'ROOT::VecOps::Sum(hits) + std::string("x").size() + p->x + o.x'
+    used, body = parse_expression(expr, COLUMNS)
+    assert used == ['hits']
+    assert body == 'ROOT::VecOps::Sum(_c0) + std::string("x").size() + p->x + o.x'
+
+def test_no_columns():
+    assert parse_expression('1 + 2', COLUMNS) == ([], '1 + 2')
+    assert parse_expression("'x' == c", COLUMNS) == ([], "'x' == c")
+
+#__________________________________________________________
+def _loop(key):
+    import ROOT
+    from mgana import rdfwrap
+    cache = rdfwrap.ExpressionCache(key)
+    rdfwrap.set_expression_cache(cache)
+    df = rdfwrap.wrap_node(ROOT.RDataFrame(10).Define('x', 'double(rdfentry_)'))
+    sig, _, compiled = cache.lookup('Define', rdfwrap.unwrap_node(df), '2*x')
+    total = df.Define('y', '2*x').Sum('y').GetValue()
+    rdfwrap.record_expressions()
+    return compiled, total, dict(cache.pending), sig in cache.loaded
+
+def test_warm_start_books_compiled(workspace):
+    pytest.importorskip('ROOT')
+    from mgana import rdfwrap
+    from mgana.memory import run_forked
+
+    def cold(key):
+        result = _loop(key)
+        rdfwrap.compile_expressions()
+        return result
+
+    # first run: jitted and recorded, compiled once at the end
+    compiled, total, _, _ = run_forked(cold, '0'*16)
+    assert not compiled and total == 90.
+    # next run: booked by the library, nothing left to record
+    compiled, total, pending, loaded = run_forked(_loop, '0'*16)
+    assert compiled and loaded and total == 90. and pending == {}
+
+def test_unused_libraries_collected(workspace):
+    ROOT = pytest.importorskip('ROOT')
+    import fcntl
+    from mgana.rdfwrap import ExpressionCache
+    cache = ExpressionCache('1'*16)
+    os.makedirs(cache.directory)
+    ext = ROOT.gSystem.GetSoExt()
+    libs = [os.path.join(cache.directory, f'MganaExpressions_{c*16}_C.{ext}') for c in 'abc']
+    for lib in libs:
+        open(lib, 'w').close()
+        open(lib[:-len(f'_C.{ext}')] + '.C', 'w').close()
+    # b is loaded by another process
+    with open(libs[1], 'rb') as held:
+        fcntl.flock(held, fcntl.LOCK_SH)
+        cache._collect(libs[2])
+    assert [os.path.exists(lib) for lib in libs] == [False, True, True]
+    assert not os.path.exists(libs[0][:-len(f'_C.{ext}')] + '.C')
@@ -0,0 +1,86 @@
+import types
+
+import pytest
+
+ROOT = pytest.importorskip('ROOT')
+
+from mgana.ana_run import runFinalProcesses
+
+HISTOS = {'x': {'variable': 'x', 'title': 'x', 'bin': 10, 'xmin': 0, 'xmax': 500}}
+
+#__________________________________________________________
+def _final(tmp_path, make_events, module, sizes=(500, 300)):
+    '''
+    Run the final processes of module over one input file of each size, one process per file.
+    '''
+    processFiles = {f'p{i}': [make_events(str(tmp_path / 'in' / f'p{i}.root'), n)] for i, n in enumerate(sizes)}
+    script = tmp_path / 'final.py'
+    script.write_text('')
+    args = types.SimpleNamespace(ncpus=2, pathToAnalysisScript=str(script), runtimeKey='test')
+    out = tmp_path / 'out'
+    out.mkdir(exist_ok=True)
+    try:
+        return runFinalProcesses(types.SimpleNamespace(**module), processFiles, str(out), args), out
+    finally:
+        ROOT.ROOT.DisableImplicitMT()
+
+#__________________________________________________________
+def test_processes_in_one_pass(tmp_path, make_events, monkeypatch):
+    passes = []
+    runGraphs = ROOT.RDF.RunGraphs
+    def count(handles):
+        passes.append(len(handles))
+        return runGraphs(handles)
+    monkeypatch.setattr(ROOT.RDF, 'RunGraphs', count)
+    results, out = _final(tmp_path, make_events, {'cutList': {'low': 'x < 100', 'high': 'x > 250'}, 'histoList': HISTOS})
+    # the counts and histograms of both processes are triggered together
+    assert passes == [2*(1 + 2 + 2)]
+    assert results['p0']['all'] == 500 and results['p0']['counts'] == [100, 249]
+    assert results['p1']['all'] == 300 and results['p1']['counts'] == [100, 49]
+    tf = ROOT.TFile.Open(str(out / 'p1_high_histo.root'))
+    assert tf.Get('x').GetEntries() == 49
+    tf.Close()
+
+#__________________________________________________________
+def test_cut_chain_cutflow(tmp_path, make_events):
+    cuts = {'a': 'x >= 100', 'b': 'x < 400', 'c': 'int(x) % 2 == 0'}
+    results, _ = _final(tmp_path, make_events, {'cutList': cuts, 'histoList': HISTOS, 'cutChain': True})
+    # each cut on the survivors of the previous ones, the report has the same cumulative counts
+    assert results['p0']['counts'] == [400, 300, 150]
+    assert results['p0']['cutflow'] == [['a', 400, 500], ['b', 300, 400], ['c', 150, 300]]
+    assert results['p1']['cutflow'] == [['a', 200, 300], ['b', 200, 200], ['c', 100, 200]]
+    # independent cuts have no report
+    results, _ = _final(tmp_path, make_events, {'cutList': cuts, 'histoList': HISTOS})
+    assert results['p0']['counts'] == [400, 400, 250] and 'cutflow' not in results['p0']
+
+#__________________________________________________________
+def test_variations(tmp_path, make_events):
+    from mgana.manifest import read_manifest
+    variations = {'scale': {'column': 'x', 'exprs': {'up': 'x*1.1', 'down': 'x*0.9'}},
+                  'shift': {'column': 'x', 'expr': 'ROOT::RVecD{x + 50, x - 50}', 'tags': ['up', 'down']}}
+    results, out = _final(tmp_path, make_events, {'cutList': {'low': 'x < 100'}, 'histoList': HISTOS,
+                                                  'variationList': variations})
+    assert results['p0']['counts'] == [100]
+    histo = str(out / 'p0_low_histo.root')
+    names = ['x', 'x__scale__up', 'x__scale__down', 'x__shift__up', 'x__shift__down']
+    assert sorted(read_manifest(histo)['keys']) == sorted(names)
+    # the cut follows the varied values: x*1.1 < 100, x*0.9 < 100, x+50 < 100, x-50 < 100
+    tf = ROOT.TFile.Open(histo)
+    assert [tf.Get(n).GetEntries() for n in names] == [100, 91, 112, 50, 150]
+    tf.Close()
+
+#__________________________________________________________
+def test_manifests_before_rename(tmp_path, make_events, monkeypatch):
+    import os
+    from mgana import ana_run
+    from mgana.manifest import manifest_path, read_manifest
+    renamed = []
+    def commit(tmpFile, path):
+        # every output appears with its manifest already in place
+        assert os.path.isfile(manifest_path(path))
+        renamed.append(os.path.basename(path))
+        os.replace(tmpFile, path)
+    monkeypatch.setattr(ana_run, 'commit_path', commit)
+    results, out = _final(tmp_path, make_events, {'cutList': {'low': 'x < 100'}, 'histoList': HISTOS, 'saveCutTree': True})
+    assert sorted(renamed) == ['p0_low.root', 'p0_low_histo.root', 'p1_low.root', 'p1_low_histo.root']
+    assert read_manifest(str(out / 'p0_low.root'))['entries'] == 100
@@ -0,0 +1,76 @@
+import os
+import sys
+import argparse
+
+import pytest
+
+STAGE = '''
+inputDir = "{inputDir}"
+outputDir = "stage1"
+processList = {{'proc': {{'chunks': 2}}}}
+nCPUS = 1
+friendOutput = True
+
+class RDFanalysis():
+    def analysers(df):
+        return df.Define("y", "2*x")
+
+    def output():
+        return ['y']
+'''
+
+# y is a column of the friend output, x of its parent files
+FINAL = '''
+inputDir = "stage1"
+outputDir = "final"
+processList = {'proc': {}}
+nCPUS = 1
+cutList = {"sel0": "y > 10 && x < 50"}
+histoList = {"x": {"variable": "x", "title": "x", "bin": 10, "xmin": 0, "xmax": 100}}
+'''
+
+PIPELINE = '''
+stages = {
+    'stage1': {'script': 'stage1.py'},
+    'final':  {'script': 'final.py', 'command': 'final', 'after': ['stage1']},
+}
+'''
+
+#__________________________________________________________
+def test_friend_round_trip(workspace, make_events, monkeypatch):
+    pytest.importorskip('megat')
+    import ROOT
+    from mgana.ana_pipeline import setup_pipeline_parser, pipeline_analysis
+    from mgana.chunking import full_ranges
+    from mgana.dataset import make_dataframe
+    from mgana.index import scan_files
+    from mgana.manifest import read_manifest
+
+    make_events(str(workspace / 'inputs' / 'proc' / 'f0.root'), 60)
+    make_events(str(workspace / 'inputs' / 'proc' / 'f1.root'), 40)
+    (workspace / 'stage1.py').write_text(STAGE.format(inputDir=workspace / 'inputs'))
+    (workspace / 'final.py').write_text(FINAL)
+    (workspace / 'pipeline.py').write_text(PIPELINE)
+
+    parser = argparse.ArgumentParser()
+    setup_pipeline_parser(parser)
+    monkeypatch.setattr(sys, 'argv', ['mgana', str(workspace / 'pipeline.py'), '--ncpus', '1', '--jobs', '1'])
+    pipeline_analysis(parser)
+
+    stage1 = workspace / 'workspace' / 'stage1'
+    chunks = [str(stage1 / 'proc' / f'chunk{i}.root') for i in range(2)]
+    # only the new column is written, the parents are recorded
+    for c in chunks:
+        tf = ROOT.TFile.Open(c)
+        assert [str(b.GetName()) for b in tf.Get('events').GetListOfBranches()] == ['y']
+        tf.Close()
+        assert read_manifest(c)['parents']
+
+    # read back on top of the parent files, both columns usable
+    df = make_dataframe(full_ranges(chunks, scan_files(chunks)))
+    assert df.Count().GetValue() == 100
+    assert df.Filter('y != 2*x').Count().GetValue() == 0
+
+    # y = 2x > 10 and x < 50: x in 6..49 of f0 and 6..39 of f1
+    histo = str(workspace / 'workspace' / 'final' / 'proc_sel0_histo.root')
+    assert read_manifest(histo)['count'] == 44 + 34
@@ -0,0 +1,21 @@
+from mgana.histstore import HistoStore, variation_name, split_variation
+
+#__________________________________________________________
+def test_variation_names():
+    name = variation_name('mass', 'jes', 'up')
+    assert split_variation(name) == ('mass', 'jes', 'up')
+    assert split_variation('mass') == ('mass', None, None)
+
+def test_variable_with_separator():
+    # the variation and tag are the last two parts
+    name = variation_name(variation_name('m', 'a', 'b'), 'jes', 'up')
+    assert split_variation(name) == (variation_name('m', 'a', 'b'), 'jes', 'up')
+
+def test_variations():
+    store = HistoStore()
+    for var in ('mass', variation_name('mass', 'jes', 'up'), variation_name('mass', 'jes', 'down'),
+                variation_name('pt', 'jes', 'up')):
+        store.histos[('ee', 'sel0', var)] = object()
+    store.histos[('ee', 'sel1', variation_name('mass', 'lumi', 'up'))] = object()
+    assert store.variations('sel0', 'mass') == sorted([variation_name('mass', 'jes', 'up'), variation_name('mass', 'jes', 'down')])
+    assert store.variations('sel0', 'eta') == []
@@ -0,0 +1,89 @@
+import os
+import json
+
+import pytest
+
+from mgana import index
+from mgana.index import FileIndex, INDEX_FILE, scan_files
+from mgana.manifest import write_manifest
+
+#__________________________________________________________
+@pytest.fixture
+def scans(monkeypatch):
+    '''
+    Record the files opened by the index instead of opening them with ROOT.
+    '''
+    opened = []
+    def scan(path):
+        opened.append(os.path.basename(path))
+        return {'entries': os.path.getsize(path), 'clusters': [0], 'eventsProcessed': None,
+                'trees': ['events'], 'keys': ['events'], 'format': 'ttree', 'parents': None}
+    monkeypatch.setattr(index, '_scan_file', scan)
+    monkeypatch.setattr(index, '_indices', {})
+    return opened
+
+def _write(path, data=b'0123456789'):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+#__________________________________________________________
+def test_rescan_on_size_and_mtime(tmp_path, scans):
+    path = _write(tmp_path / 'a.root')
+    idx = FileIndex(str(tmp_path))
+    assert idx.lookup(path)['entries'] == 10
+    idx.lookup(path)
+    assert scans == ['a.root']
+
+    _write(path, b'0123456789ab')
+    assert idx.lookup(path)['entries'] == 12
+    assert scans == ['a.root']*2
+
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    idx.lookup(path)
+    assert scans == ['a.root']*3
+
+def test_outputs_indexed_from_manifest(tmp_path, scans):
+    path = _write(tmp_path / 'out.root')
+    write_manifest(path, {'entries': 42, 'clusters': [0, 20]})
+    info = FileIndex(str(tmp_path)).lookup(path)
+    assert (info['entries'], info['clusters']) == (42, [0, 20])
+    assert scans == []
+    # a rewritten output is opened again
+    _write(path, b'01234567890')
+    assert FileIndex(str(tmp_path)).lookup(path)['entries'] == 11
+    assert scans == ['out.root']
+
+def test_save_and_reload(tmp_path, scans):
+    a = _write(tmp_path / 'a.root')
+    b = _write(tmp_path / 'b.root')
+    idx = FileIndex(str(tmp_path))
+    idx.lookup(a)
+    idx.lookup(b)
+    os.remove(b)
+    idx.save()
+    # written through a temporary file, entries of removed files dropped
+    assert sorted(os.listdir(tmp_path)) == [INDEX_FILE, 'a.root']
+    with open(tmp_path / INDEX_FILE) as f:
+        assert list(json.load(f)['files']) == ['a.root']
+
+    FileIndex(str(tmp_path)).lookup(a)
+    assert scans == ['a.root', 'b.root']
+
+def test_invalid_index(tmp_path, scans):
+    a = _write(tmp_path / 'a.root')
+    with open(tmp_path / INDEX_FILE, 'w') as f:
+        json.dump({'version': -1, 'files': {'a.root': {}}}, f)
+    assert FileIndex(str(tmp_path)).files == {}
+    assert scan_files([a])[0]['entries'] == 10
+
+def test_scan_files(tmp_path, scans):
+    os.makedirs(tmp_path / 'd1')
+    os.makedirs(tmp_path / 'd2')
+    files = [_write(tmp_path / 'd1' / 'a.root'), _write(tmp_path / 'd2' / 'b.root', b'01'), _write(tmp_path / 'd1' / 'c.root', b'0')]
+    assert [info['entries'] for info in scan_files(files)] == [10, 2, 1]
+    assert os.path.isfile(tmp_path / 'd1' / INDEX_FILE)
+    assert os.path.isfile(tmp_path / 'd2' / INDEX_FILE)
+    scan_files(files)
+    assert scans == ['a.root', 'b.root', 'c.root']
@@ -0,0 +1,37 @@
+import os
+
+from mgana.manifest import write_manifest, read_manifest, manifest_path
+from mgana.utility import temporary_path, commit_path
+
+#__________________________________________________________
+def _output(tmp_path):
+    output = str(tmp_path / 'out.root')
+    tmp = temporary_path(output)
+    with open(tmp, 'wb') as f:
+        f.write(b'0123456789')
+    return output, tmp
+
+def test_written_before_rename(tmp_path):
+    output, tmp = _output(tmp_path)
+    write_manifest(output, {'entries': 42}, tmp)
+    # the manifest is complete before the output appears, and still valid after the rename
+    assert os.path.isfile(manifest_path(output)) and not os.path.exists(output)
+    assert read_manifest(output) is None
+    commit_path(tmp, output)
+    m = read_manifest(output)
+    assert m['entries'] == 42 and m['output'] == 'out.root' and m['size'] == 10
+    assert [n for n in os.listdir(tmp_path) if n.endswith('.tmp')] == []
+
+def test_stale_manifest_ignored(tmp_path):
+    output, tmp = _output(tmp_path)
+    write_manifest(output, {'entries': 42}, tmp)
+    commit_path(tmp, output)
+    # rewritten by another tool: same size, new mtime
+    st = os.stat(output)
+    os.utime(output, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert read_manifest(output) is None
+    os.utime(output, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert read_manifest(output)['entries'] == 42
+    with open(output, 'ab') as f:
+        f.write(b'x')
+    assert read_manifest(output) is None
@@ -0,0 +1,32 @@
+import pytest
+
+from mgana.memory import parse_size, format_size, fit_budget
+
+GB = 2**30
+
+#__________________________________________________________
+def test_parse_size():
+    assert parse_size('16G') == 16*GB
+    assert parse_size('512M') == 512*2**20
+    assert parse_size('1.5GiB') == int(1.5*GB)
+    assert parse_size('2 gb') == 2*GB
+    assert parse_size(1024) == 1024
+    for text in ('', 'lots', '16X', '-1G'):
+        with pytest.raises(ValueError):
+            parse_size(text)
+
+def test_format_size():
+    assert format_size(2*GB) == '2.00 GB'
+    assert format_size(300*2**20) == '300 MB'
+
+#__________________________________________________________
+def test_fit_budget():
+    # everything fits
+    assert fit_budget(100*GB, GB, GB//2, 4, 4) == (4, 4)
+    # workers traded for threads: 2 x 8 uses all 16 cores in 10 GB
+    assert fit_budget(10*GB, GB, GB//2, 4, 4) == (2, 8)
+    # no per-thread growth, only the workers count: 3 fit, 2 x 4 keep all 8 cores
+    assert fit_budget(3*GB, GB, 0, 4, 2) == (2, 4)
+
+def test_fit_budget_too_small():
+    assert fit_budget(GB, 2*GB, GB, 4, 4) == (1, 1)
@@ -0,0 +1,88 @@
+import os
+import sys
+import argparse
+
+import pytest
+
+STAGE = '''
+inputDir = "{inputDir}"
+outputDir = "stage1"
+processList = {{'proc': {{'chunks': 2}}}}
+nCPUS = 1
+
+class RDFanalysis():
+    def analysers(df):
+        return df.Define("y", "2*x")
+
+    def output():
+        return ['x', 'y']
+'''
+
+FINAL = '''
+inputDir = "stage1"
+outputDir = "final"
+processList = {'proc': {}}
+nCPUS = 1
+cutList = {"sel0": "y > 10"}
+histoList = {"y": {"variable": "y", "title": "y", "bin": 10, "xmin": 0, "xmax": 200}}
+'''
+
+PIPELINE = '''
+stages = {
+    'stage1': {'script': 'stage1.py'},
+    'final':  {'script': 'final.py', 'command': 'final', 'after': ['stage1']},
+}
+'''
+
+#__________________________________________________________
+def test_two_stage_pipeline(workspace, make_events, monkeypatch):
+    pytest.importorskip('megat')
+    from mgana.ana_pipeline import setup_pipeline_parser, pipeline_analysis
+    from mgana.manifest import read_manifest
+    from mgana.cache import StageCache
+
+    make_events(str(workspace / 'inputs' / 'proc' / 'f0.root'), 60)
+    make_events(str(workspace / 'inputs' / 'proc' / 'f1.root'), 40)
+    (workspace / 'stage1.py').write_text(STAGE.format(inputDir=workspace / 'inputs'))
+    (workspace / 'final.py').write_text(FINAL)
+    (workspace / 'pipeline.py').write_text(PIPELINE)
+
+    parser = argparse.ArgumentParser()
+    setup_pipeline_parser(parser)
+    # two workers, so the nodes cross the process boundary
+    monkeypatch.setattr(sys, 'argv', ['mgana', str(workspace / 'pipeline.py'), '--ncpus', '2', '--jobs', '2'])
+    pipeline_analysis(parser)
+
+    stage1 = workspace / 'workspace' / 'stage1'
+    chunks = [str(stage1 / 'proc' / f'chunk{i}.root') for i in range(2)]
+    assert all(os.path.isfile(c) for c in chunks)
+    assert sum(read_manifest(c)['entries'] for c in chunks) == 100
+    # the outputs carry their bookkeeping, the manifest is a copy
+    import ROOT
+    for c in chunks:
+        tf = ROOT.TFile.Open(c)
+        assert tf.Get('eventsProcessed').GetVal() == read_manifest(c)['eventsProcessed']
+        tf.Close()
+
+    # y = 2x > 10 for x in 6..59 and 6..39
+    histo = str(workspace / 'workspace' / 'final' / 'proc_sel0_histo.root')
+    assert read_manifest(histo)['count'] == 54 + 34
+    assert StageCache(str(workspace / 'workspace' / 'final')).outputs['proc']['counts'] == [88]
+
+#__________________________________________________________
+def test_stage_scheduler_options_rejected(tmp_path):
+    from mgana.ana_pipeline import stageArgs
+    script = tmp_path / 'stage1.py'
+    script.write_text('')
+    args = stageArgs('stage1', {'script': str(script), 'command': 'run', 'options': ['--storage', 'fast-read']}, 4, False)
+    assert (args.ncpus, args.jobs, args.executor) == (4, 1, 'local')
+    with pytest.raises(SystemExit):
+        stageArgs('stage1', {'script': str(script), 'command': 'run', 'options': ['--memory-budget', '8G']}, 4, False)
+    with pytest.raises(SystemExit):
+        stageArgs('final', {'script': str(script), 'command': 'final', 'options': ['--jobs', '4']}, 4, False)
+
+def test_geometry_conflict():
+    from mgana.ana_pipeline import checkGeometries
+    checkGeometries({'stage1': {'default': ['a.xml'], 'TPC': ['a.xml']}, 'stage2': {'default': ['a.xml']}})
+    with pytest.raises(SystemExit):
+        checkGeometries({'stage1': {'default': ['a.xml']}, 'stage2': {'default': ['b.xml']}})
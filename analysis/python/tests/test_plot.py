@@ -0,0 +1,36 @@
+import types
+
+import pytest
+
+ROOT = pytest.importorskip('ROOT')
+
+from mgana.ana_plot import systematicBand
+from mgana.histstore import HistoStore, variation_name
+
+#__________________________________________________________
+def _histo(name, contents):
+    h = ROOT.TH1D(name, '', len(contents), 0., len(contents))
+    h.SetDirectory(ROOT.nullptr)
+    for i, c in enumerate(contents):
+        h.SetBinContent(i + 1, c)
+    return h
+
+def _param():
+    return types.SimpleNamespace(plots={'p': {'signal': {'sig': []}, 'backgrounds': {'bkg': []}}})
+
+def test_band():
+    store = HistoStore()
+    store.histos[('p/bkg', 'sel0', 'x')] = _histo('b', [10., 20.])
+    store.histos[('p/sig', 'sel0', 'x')] = _histo('s', [1., 2.])
+    store.histos[('p/bkg', 'sel0', variation_name('x', 'jes', 'up'))] = _histo('bu', [13., 20.])
+    store.histos[('p/bkg', 'sel0', variation_name('x', 'jes', 'down'))] = _histo('bd', [9., 16.])
+    band = systematicBand('x', 'p', 'sel0', _param(), store)
+    assert band.GetBinContent(1) == pytest.approx(11.)
+    assert band.GetBinError(1) == pytest.approx(3.)
+    assert band.GetBinError(2) == pytest.approx(4.)
+
+def test_band_without_nominal():
+    # variations read for a plot whose nominal histograms are missing
+    store = HistoStore()
+    store.histos[('p/bkg', 'sel0', variation_name('x', 'jes', 'up'))] = _histo('bu', [13., 20.])
+    assert systematicBand('x', 'p', 'sel0', _param(), store) is None
@@ -0,0 +1,58 @@
+import os
+import time
+import threading
+
+from mgana.prefetch import ScratchCache
+
+#__________________________________________________________
+def _input(tmp_path, name, size):
+    path = tmp_path / 'inputs' / name
+    os.makedirs(path.parent, exist_ok=True)
+    path.write_bytes(b'x'*size)
+    return str(path)
+
+def test_scratch_lru_eviction(tmp_path):
+    scratch = ScratchCache(str(tmp_path / 'scratch'), 250)
+    a, b, c = (_input(tmp_path, f'{n}.root', 100) for n in 'abc')
+    copyA = scratch.fetch(a)
+    copyB = scratch.fetch(b)
+    # a is read again, b becomes the least recently used copy
+    os.utime(copyB, (time.time() - 100, os.path.getmtime(copyB)))
+    assert scratch.acquire(a) == copyA
+    scratch.release()
+    copyC = scratch.fetch(c)
+    assert os.path.exists(copyA) and os.path.exists(copyC)
+    assert not os.path.exists(copyB)
+
+def test_scratch_pins_copies_in_use(tmp_path):
+    scratch = ScratchCache(str(tmp_path / 'scratch'), 150)
+    a, b = _input(tmp_path, 'a.root', 100), _input(tmp_path, 'b.root', 100)
+    copyA = scratch.fetch(a)
+    assert scratch.acquire(a) == copyA
+    # a is read, b does not fit and is read in place
+    assert scratch.fetch(b) is None
+    assert os.path.exists(copyA)
+    scratch.release()
+    assert scratch.fetch(b) is not None
+    assert not os.path.exists(copyA)
+
+def test_scratch_release_does_not_wait(tmp_path, monkeypatch):
+    scratch = ScratchCache(str(tmp_path / 'scratch'), 1000)
+    a = _input(tmp_path, 'a.root', 100)
+    started, done = threading.Event(), threading.Event()
+    fetch = scratch.fetch
+    def slow_fetch(path):
+        started.set()
+        done.wait(5)
+        return fetch(path)
+    monkeypatch.setattr(scratch, 'fetch', slow_fetch)
+    scratch.prefetch([a])
+    started.wait(5)
+    # the copy goes on while the next chunk is prepared
+    scratch.release()
+    assert scratch.thread.is_alive()
+    done.set()
+    # the next chunk waits for it and reads the copy
+    assert scratch.acquire(a) is not None
+    assert scratch.thread is None
+    scratch.close()
@@ -0,0 +1,27 @@
+import pytest
+
+ROOT = pytest.importorskip('ROOT')
+
+from mgana import rdfwrap
+
+#__________________________________________________________
+def test_profile_table_and_graph(tmp_path, monkeypatch):
+    monkeypatch.setattr(rdfwrap, 'expressionCache', None)
+    monkeypatch.setattr(rdfwrap, 'profiler', rdfwrap.Profiler())
+    root = ROOT.RDataFrame(100)
+    df = rdfwrap.wrap_node(root).Define('x', 'double(rdfentry_)').Filter('x >= 10', 'sel').Define('y', 'x*x')
+    assert df.Sum('y').GetValue() == sum(x*x for x in range(10, 100))
+
+    prefix = str(tmp_path / 'prof')
+    rdfwrap.profiler.report(rdfwrap.profiler.take(), root, prefix)
+    # kind, time, share, calls, ns/call, node
+    rows = {line.split()[-1]: line.split() for line in open(f'{prefix}.txt').read().splitlines()[1:]}
+    assert set(rows) == {'x', 'sel', 'y'}
+    assert [rows[n][0] for n in ('x', 'sel', 'y')] == ['Define', 'Filter', 'Define']
+    # the expressions after the filter see only the events passing it
+    assert [int(rows[n][3]) for n in ('x', 'sel', 'y')] == [100, 100, 90]
+    assert sum(float(r[2].rstrip('%')) for r in rows.values()) == pytest.approx(100, abs=0.5)
+    dot = open(f'{prefix}.dot').read()
+    assert dot.startswith('digraph') and '/ 90 calls' in dot
+    # probes are only reported once
+    assert rdfwrap.profiler.take() == []
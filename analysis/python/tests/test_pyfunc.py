@@ -0,0 +1,60 @@
+import types
+import linecache
+
+import pytest
+
+from mgana import pyfunc
+
+#__________________________________________________________
+def _script(name, source):
+    '''
+    Module built from source, standing for an analysis script.
+    '''
+    module = types.ModuleType(name)
+    filename = f'<{name}>'
+    # inspect reads the sources of the functions from linecache
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    exec(compile(source, filename, 'exec'), module.__dict__)
+    return module
+
+SCRIPT = '''
+SCALE = 2.
+def helper(x):
+    return x*SCALE
+def hit_r(x, y):
+    return helper(x) + y
+'''
+
+def test_same_function_in_two_scripts():
+    a = _script('stage1', SCRIPT)
+    b = _script('stage2', SCRIPT + '\ndef unrelated():\n    return 1\n')
+    assert pyfunc._function_source(a.hit_r) == pyfunc._function_source(b.hit_r)
+
+def test_helper_and_constant_change_the_source():
+    a = _script('stage1', SCRIPT)
+    b = _script('stage2', SCRIPT.replace('SCALE = 2.', 'SCALE = 3.'))
+    c = _script('stage3', SCRIPT.replace('x*SCALE', 'x*SCALE + 1'))
+    source = pyfunc._function_source(a.hit_r)
+    assert pyfunc._function_source(b.hit_r) != source
+    assert pyfunc._function_source(c.hit_r) != source
+
+def test_recursive_function():
+    a = _script('stage1', 'def f(n):\n    return 0 if n == 0 else f(n - 1)\n')
+    assert 'def f' in pyfunc._function_source(a.f)
+
+#__________________________________________________________
+def test_parse_type():
+    assert pyfunc._parse_type('const ROOT::VecOps::RVec<float>&') == ('float', True)
+    assert pyfunc._parse_type('RVecD') == ('double', True)
+    assert pyfunc._parse_type('int') == ('int', False)
+    with pytest.raises(TypeError):
+        pyfunc._parse_type('std::string')
+
+def test_rvec_result_runs_once():
+    types_ = [('float', True)]
+    source = pyfunc._python_source({'f': (None, types_, ('float', True))})
+    body = source.split('def _mgana_f')[1]
+    assert body.count('f(') == 1
+    cpp = pyfunc._cpp_source('f', 1234, types_, ('float', True))
+    assert cpp.count('fn(') == 1
+    assert 'detail::grow<float>' in cpp
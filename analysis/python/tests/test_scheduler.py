@@ -0,0 +1,87 @@
+import os
+import time
+import multiprocessing
+
+import pytest
+
+from mgana.scheduler import split_core_budget, run_tasks
+
+#__________________________________________________________
+def test_split_core_budget():
+    assert split_core_budget(16, 100) == (16, 1)
+    assert split_core_budget(16, 4) == (4, 4)
+    assert split_core_budget(16, 100, jobs=2) == (2, 8)
+    assert split_core_budget(16, 1, jobs=8) == (1, 16)
+    assert split_core_budget(0, 3) == (1, 1)
+
+#__________________________________________________________
+def _square(x):
+    return x*x, os.getpid()
+
+def _fail(x):
+    if x == 2:
+        raise ValueError('chunk 2 failed')
+    return x
+
+def test_run_tasks():
+    done = []
+    results = run_tasks(_square, [(i,) for i in range(6)], 3, callback=lambda i, r: done.append(i))
+    assert [r[0] for r in results] == [i*i for i in range(6)]
+    # forked workers, results in task order whatever the completion order
+    assert os.getpid() not in {r[1] for r in results}
+    assert sorted(done) == list(range(6))
+
+def test_run_tasks_sequential():
+    results = run_tasks(_square, [(3,)], 1)
+    assert results == [(9, os.getpid())]
+
+def test_run_tasks_error():
+    with pytest.raises(ValueError, match='chunk 2 failed'):
+        run_tasks(_fail, [(i,) for i in range(4)], 2)
+
+#__________________________________________________________
+def _probe(x, nthreads=None):
+    time.sleep(0.1)
+    return os.getpid(), nthreads
+
+def test_run_tasks_memory_guard():
+    # every sample is over budget: the concurrency, then the threads are lowered
+    results = run_tasks(_probe, [(i,) for i in range(10)], 3, memory_budget=1, threads=4)
+    assert results[-1][1] == 1
+    # tasks with fewer threads ran in new workers, the others exited
+    lowered = {pid for pid, n in results if n}
+    assert lowered and not lowered & {pid for pid, n in results if not n}
+    assert multiprocessing.active_children() == []
+
+def test_run_tasks_single_worker_guard():
+    results = run_tasks(_probe, [(i,) for i in range(4)], 1, memory_budget=1, threads=2)
+    assert os.getpid() not in {pid for pid, _ in results}
+    assert [n for _, n in results] == [None, 1, 1, 1]
+
+def _crash(x):
+    os._exit(7)
+
+def test_run_tasks_worker_died():
+    with pytest.raises(RuntimeError, match='exit code 7'):
+        run_tasks(_crash, [(0,), (1,)], 2)
+
+#__________________________________________________________
+def _dask_task(x):
+    time.sleep(0.05*(3 - x % 3))
+    if x == 4:
+        raise ValueError('chunk 4 failed')
+    return x*x
+
+def test_run_tasks_dask():
+    distributed = pytest.importorskip('dask.distributed')
+    from mgana.scheduler import run_tasks_dask
+    with distributed.LocalCluster(n_workers=2, threads_per_worker=1, processes=False,
+                                  dashboard_address=None) as cluster:
+        done = []
+        results = run_tasks_dask(_dask_task, [(i,) for i in range(4)], 2,
+                                 callback=lambda i, r: done.append(i), address=cluster)
+        # results in task order whatever the completion order
+        assert results == [0, 1, 4, 9]
+        assert sorted(done) == list(range(4))
+        with pytest.raises(ValueError, match='chunk 4 failed'):
+            run_tasks_dask(_dask_task, [(i,) for i in range(6)], 2, address=cluster)
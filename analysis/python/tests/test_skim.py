@@ -0,0 +1,52 @@
+import pytest
+
+ROOT = pytest.importorskip('ROOT')
+
+from mgana.skim import book_skim, write_skim, skim_dataframe
+
+#__________________________________________________________
+def test_skim_matches_filtered_dataframe(tmp_path, make_events):
+    files = [make_events(str(tmp_path / 'in' / f'f{i}.root'), n, cluster=100) for i, n in enumerate((1000, 700))]
+    vec = ROOT.std.vector['std::string'](files)
+    df = ROOT.RDataFrame('events', vec).Filter('int(x) % 7 == 3 || x > 900')
+    skim = book_skim(df)
+    count = df.Count()
+    selected = df.Take['double']('x')
+
+    n = write_skim(str(tmp_path / 'sel_skim.root'), files, skim.GetValue(), 1700)
+    assert n == count.GetValue()
+    read = skim_dataframe(str(tmp_path / 'sel_skim.root')).Take['double']('x')
+    assert sorted(read.GetValue()) == sorted(selected.GetValue())
+
+#__________________________________________________________
+def test_skim_refuses_mt(make_events, tmp_path):
+    f = make_events(str(tmp_path / 'f.root'), 10)
+    ROOT.ROOT.EnableImplicitMT(2)
+    try:
+        with pytest.raises(RuntimeError):
+            book_skim(ROOT.RDataFrame('events', f))
+    finally:
+        ROOT.ROOT.DisableImplicitMT()
+
+#__________________________________________________________
+def test_final_skims_keep_mt(workspace, make_events, tmp_path):
+    import types
+    from mgana.ana_run import runFinalProcesses
+    files = [make_events(str(tmp_path / 'in' / f'f{i}.root'), n, cluster=100) for i, n in enumerate((500, 300))]
+    script = tmp_path / 'final.py'
+    script.write_text('')
+    module = types.SimpleNamespace(cutList={'sel0': 'x > 450'}, saveCutSkim=True,
+                                   histoList={'x': {'variable': 'x', 'title': 'x', 'bin': 10, 'xmin': 0, 'xmax': 500}})
+    args = types.SimpleNamespace(ncpus=2, pathToAnalysisScript=str(script), runtimeKey='test')
+    out = tmp_path / 'out'
+    out.mkdir()
+    try:
+        result = runFinalProcesses(module, {'proc': files}, str(out), args)
+        # the histograms ran with implicit MT, only the skim pass was sequential
+        assert ROOT.ROOT.IsImplicitMTEnabled()
+    finally:
+        ROOT.ROOT.DisableImplicitMT()
+    # x > 450: 49 entries of f0 and none of f1
+    assert result['proc']['counts'] == [49]
+    read = skim_dataframe(str(out / 'proc_sel0_skim.root')).Take['double']('x').GetValue()
+    assert sorted(read) == [float(x) for x in range(451, 500)]
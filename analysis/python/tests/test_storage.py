@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+from mgana.storage import STORAGE_PROFILES, get_profile, snapshot_options, compare_profiles
+
+#__________________________________________________________
+def test_get_profile():
+    assert get_profile('fast-read') == STORAGE_PROFILES['fast-read']
+    # a copy, the named profile is not modified
+    get_profile('default')['level'] = 1
+    assert STORAGE_PROFILES['default'] == {}
+    # a dict extends its base
+    profile = get_profile({'base': 'balanced', 'level': 9})
+    assert profile['compression'] == 'zstd' and profile['level'] == 9 and 'base' not in profile
+    assert get_profile({'compression': 'lz4'}) == {'compression': 'lz4'}
+    with pytest.raises(ValueError, match='Unknown storage profile'):
+        get_profile('fastest')
+
+def test_snapshot_options():
+    ROOT = pytest.importorskip('ROOT')
+    opts = snapshot_options(get_profile('fast-read'), lazy=True)
+    assert opts.fLazy
+    assert opts.fCompressionAlgorithm == ROOT.ROOT.RCompressionSetting.EAlgorithm.kLZ4
+    assert (opts.fCompressionLevel, opts.fBasketSize, opts.fSplitLevel) == (4, 256*1024, 99)
+    assert opts.fAutoFlush == -50*1000*1000
+    if hasattr(ROOT.RDF, 'ESnapshotOutputFormat'):
+        assert snapshot_options(get_profile('rntuple')).fOutputFormat == ROOT.RDF.ESnapshotOutputFormat.kRNTuple
+
+def test_compare_profiles(tmp_path, make_events):
+    ROOT = pytest.importorskip('ROOT')
+    f = make_events(str(tmp_path / 'in.root'), 2000)
+    profiles = ['default', 'small'] + (['rntuple'] if hasattr(ROOT.RDF, 'ESnapshotOutputFormat') else [])
+    rows = compare_profiles([f], profiles, columns=['x'])
+    assert [r['profile'] for r in rows] == profiles
+    assert all(r['size'] > 0 and r['write'] >= 0 and r['read'] >= 0 for r in rows)
@@ -0,0 +1,15 @@
+from mgana.timing import limiting_factor
+
+#__________________________________________________________
+def test_limiting_factor():
+    loop = {'cpu': 30., 'wait': 10., 'blkio': 8.}
+    assert limiting_factor(loop) == 'CPU'
+    loop = {'cpu': 10., 'wait': 30., 'blkio': 20.}
+    assert limiting_factor(loop) == 'I/O'
+    loop = {'cpu': 10., 'wait': 30., 'blkio': 2.}
+    assert limiting_factor(loop) == 'idle threads'
+    # network reads are not block I/O
+    assert limiting_factor(loop, remote=True) == 'I/O or idle threads'
+    # no delay accounting
+    loop = {'cpu': 10., 'wait': 30., 'blkio': 0.}
+    assert limiting_factor(loop) == 'I/O or idle threads'
@@ -0,0 +1,33 @@
+import os
+
+from mgana.watch import WatchState, WATCH_FILE
+
+#__________________________________________________________
+def test_state_persists(tmp_path):
+    state = WatchState(str(tmp_path))
+    assert state.regular('ee') is None
+    assert state.chunks('ee') == {}
+
+    state.start('ee', ['b.root', 'a.root'])
+    chunk = state.add('ee', ['c.root'])
+    assert chunk == 'ee/chunk_w0.root'
+    assert state.add('ee', ['d.root']) == 'ee/chunk_w1.root'
+
+    reloaded = WatchState(str(tmp_path))
+    assert reloaded.regular('ee') == ['a.root', 'b.root']
+    assert reloaded.chunks('ee') == {'ee/chunk_w0.root': ['c.root'], 'ee/chunk_w1.root': ['d.root']}
+    assert reloaded.assigned('ee') == {'a.root', 'b.root', 'c.root', 'd.root'}
+
+def test_reset(tmp_path):
+    state = WatchState(str(tmp_path))
+    state.start('ee', ['a.root'])
+    state.start('mumu', ['m.root'])
+    state.reset('ee')
+    reloaded = WatchState(str(tmp_path))
+    assert reloaded.regular('ee') is None
+    assert reloaded.regular('mumu') == ['m.root']
+
+def test_unreadable_state(tmp_path):
+    with open(os.path.join(tmp_path, WATCH_FILE), 'w') as f:
+        f.write('{not json')
+    assert WatchState(str(tmp_path)).outputs == {}
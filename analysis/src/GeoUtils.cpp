@@ -1,11 +1,38 @@
 #include "Analysis/GeoUtils.h"
 //#include "spdlog/spdlog.h"
 #include <Parsers/Printout.h>
+#include <map>
+#include <mutex>
 #include <stdexcept>
 
 namespace megat {
   namespace utility {
 
+    namespace {
+      // arguments of loadGeometry for each registered tag
+      struct GeometrySpec {
+        std::vector<std::string> xmlList;
+        std::string              tpc_readout_name;
+        std::string              tpc_name;
+        dd4hep::PrintLevel       level;
+      };
+
+      std::map<std::string, GeometrySpec>& registry() {
+        static std::map<std::string, GeometrySpec> specs;
+        return specs;
+      }
+
+      std::mutex& registryMutex() {
+        static std::mutex mtx;
+        return mtx;
+      }
+
+      std::string geometryTag( const std::string& tpc_readout_name, const std::string& tag ) {
+        if ( tpc_readout_name.empty() ) return "default";
+        return tag.empty() ? tpc_readout_name : tag;
+      }
+    } // namespace
+
     /**
      * @brief load and register geometry under different tags
      * @details different tags match different segmentation of TPC [todo: better solution]
@@ -43,5 +70,41 @@ namespace megat {
       return detector;
     }
 
+    /**
+     * @brief register a geometry under a tag without building it
+     * @details the geometry is built by requireGeometry, i.e. when the first IdConverter
+     *          (or CellPosition) of this tag is created; parameters are the ones of loadGeometry
+     */
+    void registerGeometry( std::vector<std::string> xmlList, std::string tpc_readout_name, std::string tag,
+                           std::string tpc_name, dd4hep::PrintLevel level ) {
+      std::lock_guard<std::mutex> lock( registryMutex() );
+      registry()[geometryTag( tpc_readout_name, tag )] = { xmlList, tpc_readout_name, tpc_name, level };
+    }
+
+    /**
+     * @brief return the geometry of a tag, building a registered one on first use
+     * @param[in] tag tag name of the geometry
+     * @return the loaded detector description
+     */
+    dd4hep::Detector& requireGeometry( std::string tag ) {
+      using namespace dd4hep;
+
+      // geometries already seen built by this thread, looked up without taking any lock
+      thread_local std::map<std::string, Detector*> built;
+      auto it = built.find( tag );
+      if ( it != built.end() ) return *it->second;
+
+      std::lock_guard<std::mutex> lock( registryMutex() );
+      auto& detector = Detector::getInstance( tag );
+      if ( detector.state() != Detector::State::READY ) {
+        auto spec = registry().find( tag );
+        if ( spec == registry().end() ) { throw std::runtime_error( "Load the detector geometry first" ); }
+        const auto& s = spec->second;
+        loadGeometry( s.xmlList, s.tpc_readout_name, tag, s.tpc_name, s.level );
+      }
+      built.emplace( tag, &detector );
+      return detector;
+    }
+
   } // namespace utility
 } // namespace megat
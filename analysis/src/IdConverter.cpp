@@ -1,14 +1,13 @@
 #include "Analysis/IdConverter.h"
+#include "Analysis/GeoUtils.h"
 
 namespace megat {
   namespace utility {
     using edm4hep::Vector3d;
 
     IdConverter::IdConverter( std::string tag ) {
-      auto& detector = Detector::getInstance( tag );
-      if ( detector.state() != Detector::State::READY ) {
-        throw std::runtime_error( "Load the detector geometry first" );
-      }
+      // build the geometry of this tag if it was only registered
+      auto& detector = requireGeometry( tag );
       m_volumeManager = VolumeManager::getVolumeManager( detector );
       m_description   = &detector;
     }